@@ -0,0 +1,374 @@
+import os
+import io
+import sys
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import contextlib
+import ujson
+import numpy as np
+import pandas as pd
+import synthetic_p1
+
+# --- Constants ---
+BENCH_RESULTS_DIR = os.path.join(os.getcwd(), "bench_results")
+REGRESSION_THRESHOLD = 1.2 # slower than this ratio against the baseline is flagged
+
+QUERY_RANGES = {"day": 1, "week": 7, "month": 30, "year": 365}
+AGGREGATOR_SPECS = [
+    {"metric": "active_power_w", "aggregation": "MAX", "value_type": "PRODUCTION"},
+    {"metric": "active_power_w", "aggregation": "AVG", "time_of_day": "avond"},
+    {"metric": "total_power_import_kwh", "aggregation": "DELTA"},
+    {"metric": "total_power_export_kwh", "aggregation": "DELTA"},
+]
+# Vector index comparison: exact float32 search is the ground truth for recall@k
+VECTOR_COUNT = 20000
+VECTOR_DIM = 384 # all-MiniLM-L6-v2
+VECTOR_QUERIES = 200
+VECTOR_K = 10
+HNSW_EF_SEARCH_VALUES = (10, 50, 100, 200)
+QUANTIZED_DTYPES = ("int8", "float16")
+PARSER_QUERIES = [
+    "hoogste week qua teruglevering in 2025",
+    "top 5 dagen met het meeste verbruik in 2024",
+    "laagste maand import",
+    "welk uur had de minste export in 2025",
+    "wat was het weer gisteren",
+]
+
+@contextlib.contextmanager
+def _patched(module, **values):
+    """Temporarily points module-level constants (paths, names) somewhere else."""
+    originals = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in originals.items():
+            setattr(module, name, value)
+
+def _timed(fn, repeat=1, setup=None, quiet=True):
+    """Runs `fn` `repeat` times (calling `setup` untimed before each run) and summarises the timings."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        output = io.StringIO() if quiet else sys.stdout
+        with contextlib.redirect_stdout(output):
+            start = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - start)
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "runs": len(timings)}, result
+
+def _guarded(name, fn):
+    """Runs one benchmark; a failure (e.g. a missing embedding model) is recorded instead of aborting the suite."""
+    print(f"Running {name}...")
+    try:
+        return fn()
+    except Exception as e:
+        print(f"  {name} failed: {type(e).__name__}: {e}")
+        return {"error": f"{type(e).__name__}: {e}"}
+
+# --- Benchmarks ---
+def bench_load_data(data_dir, repeat):
+    import main
+    with _patched(main, DATA_DIR=data_dir):
+        timing, (documents, _, _) = _timed(main.load_data, repeat)
+    timing["records"] = len(documents)
+    timing["records_per_sec"] = len(documents) / timing["median_s"]
+    return timing
+
+def bench_indexing(data_dir, work_dir, workers, documents="readings"):
+    """End-to-end main.run_indexing into a fresh Chroma database, embedding cache and numeric store."""
+    import main
+    work_dir = os.path.join(work_dir, f"index_{documents}")
+    chroma_path = os.path.join(work_dir, "index_chroma_db")
+    paths = dict(
+        DATA_DIR=data_dir,
+        CHROMA_DB_PATH=chroma_path,
+        MANIFEST_PATH=os.path.join(chroma_path, main.MANIFEST_FILENAME),
+        ROLLUP_STATE_PATH=os.path.join(chroma_path, main.ROLLUP_STATE_FILENAME),
+        NUMERIC_STORE_PATH=os.path.join(work_dir, "index_numeric_store"),
+        EMBEDDING_CACHE_PATH=os.path.join(work_dir, "index_embedding_cache"),
+    )
+    with _patched(main, **paths):
+        timing, stats = _timed(lambda: main.run_indexing(rebuild=True, workers=workers, documents=documents))
+    timing["documents"] = stats["documents"] if stats else 0
+    timing["docs_per_sec"] = timing["documents"] / timing["median_s"]
+    return timing
+
+def bench_setup_database(csv_path, work_dir, repeat):
+    import smart_database
+    chroma_path = os.path.join(work_dir, "rollup_chroma_db")
+    with _patched(smart_database, CSV_PATH=csv_path, CHROMA_PATH=chroma_path):
+        timing, collection = _timed(lambda: smart_database.setup_database(rebuild=True), repeat)
+        timing["documents"] = collection.count()
+    return timing
+
+def fill_numeric_store(path, **kwargs):
+    """Writes synthetic readings straight into a NumericStore, bypassing the embedding stage."""
+    from numeric_store import NumericStore
+    store = NumericStore(path)
+    for df in synthetic_p1.iter_days(**kwargs):
+        columns = {column: df[column].to_numpy() for column in df.columns if column != "timestamp"}
+        columns["epoch"] = df["timestamp"].to_numpy()
+        store.append(columns)
+    return store
+
+def bench_query_aggregator(store_path, start_date, days, repeat):
+    """Times single-spec and batched aggregations per range size; the result cache is bypassed."""
+    import tools
+    results = {}
+    missing_manifest = os.path.join(store_path, "no_manifest.json") # no ingest state -> nothing is cached
+    with _patched(tools, NUMERIC_STORE_PATH=store_path, MANIFEST_PATH=missing_manifest):
+        for range_name, range_days in QUERY_RANGES.items():
+            if range_days > days:
+                continue
+            start = pd.Timestamp(start_date)
+            end = (start + pd.Timedelta(days=range_days - 1)).strftime("%Y-%m-%d")
+            start = start.strftime("%Y-%m-%d")
+            for spec in AGGREGATOR_SPECS:
+                name = f"{range_name}.{spec['metric']}.{spec['aggregation']}"
+                timing, result = _timed(lambda: tools.query_aggregator(start_date=start, end_date=end, **spec), repeat)
+                if "error" in result:
+                    timing["error"] = result["error"]
+                results[name] = timing
+            timing, _ = _timed(lambda: tools.query_aggregator_batch(start, end, AGGREGATOR_SPECS), repeat)
+            results[f"{range_name}.batch"] = timing
+    return results
+
+def bench_query_parser(repeat, iterations=1000):
+    from query_ai import QueryParser
+    parser = QueryParser()
+    def parse_all():
+        for _ in range(iterations):
+            for query in PARSER_QUERIES:
+                parser.parse(query)
+    timing, _ = _timed(parse_all, repeat)
+    timing["parses_per_sec"] = iterations * len(PARSER_QUERIES) / timing["median_s"]
+    return timing
+
+def synthetic_embeddings(count, dim=VECTOR_DIM, clusters=50, seed=synthetic_p1.SEED):
+    """Unit vectors around random cluster centres; templated reading sentences embed in tight clusters too."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, size=count)] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def load_collection_embeddings(chroma_path, limit=VECTOR_COUNT):
+    """Reads up to `limit` stored embeddings from the indexed collection, for a run on real data."""
+    import chromadb
+    import main
+    collection = chromadb.PersistentClient(path=chroma_path).get_collection(name=main.COLLECTION_NAME)
+    return np.asarray(collection.get(include=["embeddings"], limit=limit)["embeddings"], dtype=np.float32)
+
+def _search_timings(search, queries, truth, k):
+    """Times `search` per query; reports latency percentiles and recall@k against `truth`."""
+    timings, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(query)
+        timings.append(time.perf_counter() - start)
+        hits += len(set(found) & set(expected))
+    return {
+        "median_s": statistics.median(timings),
+        "min_s": min(timings),
+        "runs": len(timings),
+        "p95_ms": float(np.percentile(timings, 95)) * 1000,
+        "recall_at_k": hits / (len(queries) * k),
+    }
+
+def bench_vector_index(work_dir, vectors=None, count=VECTOR_COUNT, queries=VECTOR_QUERIES, k=VECTOR_K,
+                       ef_values=HNSW_EF_SEARCH_VALUES, hnsw_m=None, hnsw_ef_construction=None):
+    """
+    Compares Chroma's HNSW index at several ef_search values with the quantized in-process
+    index (exact blocked brute force) on recall@k, per-query latency and index size.
+    Queries are held-out vectors from the same distribution as the indexed ones.
+    """
+    import chromadb
+    import main
+    from vector_index import QuantizedIndex
+    vectors = synthetic_embeddings(count + queries) if vectors is None else np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    corpus, held_out = vectors[:-queries], vectors[-queries:]
+    ids = [f"v{i}" for i in range(len(corpus))]
+    k = min(k, len(corpus))
+    truth = [[ids[i] for i in np.argsort(-scores)[:k]] for scores in held_out @ corpus.T]
+    results = {"vectors": {"count": len(corpus), "dim": corpus.shape[1], "float32_bytes": corpus.nbytes}}
+
+    client = chromadb.PersistentClient(path=os.path.join(work_dir, "vector_chroma_db"))
+    collection = client.create_collection(
+        name="vector_bench", embedding_function=None,
+        metadata=main.hnsw_metadata(m=hnsw_m, ef_construction=hnsw_ef_construction))
+    start = time.perf_counter()
+    for offset in range(0, len(corpus), main.BATCH_SIZE):
+        collection.add(ids=ids[offset:offset + main.BATCH_SIZE], embeddings=corpus[offset:offset + main.BATCH_SIZE])
+    build_s = time.perf_counter() - start
+    for ef_search in ef_values:
+        main.set_search_ef(collection, ef_search)
+        timing = _search_timings(
+            lambda query: collection.query(query_embeddings=[query], n_results=k, include=[])["ids"][0],
+            held_out, truth, k)
+        timing["build_s"] = build_s
+        results[f"hnsw.ef{ef_search}"] = timing
+
+    for dtype in QUANTIZED_DTYPES:
+        index = QuantizedIndex(os.path.join(work_dir, "vector_index"), dtype=dtype)
+        start = time.perf_counter()
+        for offset in range(0, len(corpus), main.BATCH_SIZE):
+            index.add(ids[offset:offset + main.BATCH_SIZE], corpus[offset:offset + main.BATCH_SIZE])
+        build_s = time.perf_counter() - start
+        timing = _search_timings(lambda query: index.search([query], k=k)[0][0], held_out, truth, k)
+        timing["build_s"] = build_s
+        timing["bytes"] = index.nbytes()
+        results[f"quantized.{dtype}"] = timing
+    return results
+
+# --- Results ---
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def _environment():
+    import chromadb
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "chromadb": chromadb.__version__,
+    }
+
+def _flatten(benchmarks, prefix=""):
+    """Yields (name, timing) for every leaf timing in the nested benchmark results."""
+    for name, value in benchmarks.items():
+        if name == "vectors":
+            continue # data set description, not a timing
+        if "median_s" in value or "error" in value:
+            yield prefix + name, value
+        else:
+            yield from _flatten(value, prefix + name + ".")
+
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    """Prints the median ratio per benchmark against a previous run; returns the names that regressed."""
+    previous = dict(_flatten(baseline["benchmarks"]))
+    regressions = []
+    print(f"\nComparison with {baseline.get('git_commit')} ({baseline.get('created')}):")
+    for name, timing in _flatten(current["benchmarks"]):
+        before = previous.get(name)
+        if not before or "median_s" not in before or "median_s" not in timing:
+            continue
+        ratio = timing["median_s"] / before["median_s"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  <-- REGRESSION"
+            regressions.append(name)
+        print(f"  {name:<55} {before['median_s'] * 1000:10.2f} ms -> {timing['median_s'] * 1000:10.2f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+def run_suite(years=0.1, cadence_s=10, seed=synthetic_p1.SEED, start_date=synthetic_p1.START_DATE,
+              repeat=3, workers=0, skip=(), work_dir=None, vectors=None):
+    """
+    Generates the synthetic data set once and runs every benchmark that is not skipped.
+    `vectors` optionally replaces the synthetic embeddings of the vector_index benchmark.
+    """
+    days = max(1, int(round(years * 365)))
+    own_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="smartmeter_bench_")
+    data = dict(start_date=start_date, days=days, cadence_s=cadence_s, seed=seed)
+    benchmarks = {}
+    try:
+        print(f"Generating {days} day(s) of synthetic P1 data at {cadence_s}s cadence in {work_dir}...")
+        data_dir = os.path.join(work_dir, "logs")
+        csv_path = os.path.join(work_dir, "P1metingen.csv")
+        store_path = os.path.join(work_dir, "numeric_store")
+        synthetic_p1.write_jsonl(data_dir, **data)
+
+        if "load_data" not in skip:
+            benchmarks["load_data"] = _guarded("load_data", lambda: bench_load_data(data_dir, repeat))
+        if "indexing" not in skip:
+            benchmarks["indexing"] = _guarded("indexing", lambda: bench_indexing(data_dir, work_dir, workers))
+        if "indexing_daily" not in skip:
+            benchmarks["indexing_daily"] = _guarded(
+                "indexing_daily", lambda: bench_indexing(data_dir, work_dir, workers, documents="daily"))
+        if "setup_database" not in skip:
+            synthetic_p1.write_csv(csv_path, **data)
+            benchmarks["setup_database"] = _guarded("setup_database", lambda: bench_setup_database(csv_path, work_dir, repeat))
+        if "query_aggregator" not in skip:
+            fill_numeric_store(store_path, **data)
+            benchmarks["query_aggregator"] = _guarded(
+                "query_aggregator", lambda: bench_query_aggregator(store_path, start_date, days, repeat))
+        if "query_parser" not in skip:
+            benchmarks["query_parser"] = _guarded("query_parser", lambda: bench_query_parser(repeat))
+        if "vector_index" not in skip:
+            benchmarks["vector_index"] = _guarded("vector_index", lambda: bench_vector_index(work_dir, vectors=vectors))
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "created": pd.Timestamp.now(tz="UTC").isoformat(),
+        "git_commit": _git_commit(),
+        "environment": _environment(),
+        "params": dict(data, repeat=repeat, workers=workers),
+        "benchmarks": benchmarks,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and queries on synthetic P1 data.")
+    parser.add_argument("--years", type=float, default=0.1, help="Years of synthetic data (0.1 is about 5 weeks).")
+    parser.add_argument("--cadence", type=int, choices=[1, 10], default=10, help="Seconds between readings.")
+    parser.add_argument("--seed", type=int, default=synthetic_p1.SEED)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark; the median is reported.")
+    parser.add_argument("--workers", type=int, default=0, help="Embedding worker processes for the indexing benchmark.")
+    parser.add_argument("--skip", nargs="*", default=[],
+                        choices=["load_data", "indexing", "indexing_daily", "setup_database", "query_aggregator", "query_parser",
+                                 "vector_index"])
+    parser.add_argument("--vector-source", type=str, default=None,
+                        help="ChromaDB directory whose stored embeddings replace the synthetic vectors in vector_index.")
+    parser.add_argument("--out", type=str, default=None, help="Results file (default: bench_results/<time>_<commit>.json).")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier results file to compare against.")
+    args = parser.parse_args()
+
+    vectors = load_collection_embeddings(args.vector_source) if args.vector_source else None
+    results = run_suite(years=args.years, cadence_s=args.cadence, seed=args.seed,
+                        repeat=args.repeat, workers=args.workers, skip=args.skip, vectors=vectors)
+
+    out = args.out
+    if out is None:
+        stamp = pd.Timestamp(results["created"]).strftime("%Y%m%dT%H%M%S")
+        out = os.path.join(BENCH_RESULTS_DIR, f"{stamp}_{results['git_commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, 'w') as f:
+        ujson.dump(results, f, indent=2)
+
+    print("\n--- Benchmark results ---")
+    for name, timing in _flatten(results["benchmarks"]):
+        if "recall_at_k" in timing:
+            print(f"  {name:<55} {timing['median_s'] * 1000:10.2f} ms (p95 {timing['p95_ms']:.2f} ms, "
+                  f"recall@{VECTOR_K} {timing['recall_at_k']:.3f})")
+        elif "median_s" in timing:
+            print(f"  {name:<55} {timing['median_s'] * 1000:10.2f} ms (min {timing['min_s'] * 1000:.2f} ms)")
+        else:
+            print(f"  {name:<55} {timing['error']}")
+    print(f"Results written to {out}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, ujson.load(f))
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than x{REGRESSION_THRESHOLD}.")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import os
+import time
+import shutil
+import argparse
+import ujson
+import numpy as np
+import pandas as pd
+from numeric_store import NUMERIC_STORE_PATH, NumericStore, partition_of
+from daily_patterns import local_day_start
+from metrics import timer
+
+# --- Constants ---
+TIERS_DIRNAME = "tiers"
+STATE_FILENAME = "compaction_state.json"
+# (tier name, period in seconds, fold the previous tier into this one after N days).
+# Defaults: raw readings for 30 days, then minute summaries for a year, then hourly summaries.
+DEFAULT_TIERS = (("minute", 60, 30), ("hour", 3600, 365))
+# Metrics kept in the summary tiers; the index is stored in the 'metric' column
+SUMMARY_METRICS = ["active_power_w", "total_power_import_kwh", "total_power_export_kwh", "total_gas_m3"]
+SUMMARY_COLUMNS = {
+    "epoch": np.dtype("int64"), # period start
+    "metric": np.dtype("int8"),
+    "sign": np.dtype("int8"), # 0 positive, 1 negative, 2 zero (as tools.SIGNS)
+    "count": np.dtype("int64"),
+    "sum": np.dtype("float64"),
+    "min": np.dtype("float64"),
+    "min_epoch": np.dtype("int64"),
+    "max": np.dtype("float64"),
+    "max_epoch": np.dtype("int64"),
+    "first": np.dtype("float64"),
+    "first_epoch": np.dtype("int64"),
+    "last": np.dtype("float64"),
+    "last_epoch": np.dtype("int64"),
+}
+KEYS = ["epoch", "metric", "sign"]
+# Periods are aligned to epoch multiples; only periods that divide an hour line up with
+# local hours (and so with local days and the time-of-day windows), as tools relies on
+MAX_PERIOD = 3600
+CHROMA_DELETE_BATCH = 5000
+
+def _signs(values):
+    return np.where(values > 0, 0, np.where(values < 0, 1, 2)).astype("int8")
+
+def merge_summaries(df, keys=KEYS):
+    """
+    Merges summary rows per `keys` exactly like tools.AggregateState.merge: counts and
+    sums add up, min/max keep the earliest extreme and first/last come from the
+    earliest/latest reading. Fully vectorized; returns a DataFrame sorted by `keys`.
+    """
+    grouped = df.groupby(keys, sort=True)
+    out = grouped[["count", "sum"]].sum()
+    picks = (
+        (["min", "min_epoch"], [True, True], ["min", "min_epoch"]),
+        (["max", "max_epoch"], [False, True], ["max", "max_epoch"]),
+        (["first_epoch"], [True], ["first", "first_epoch"]),
+        (["last_epoch"], [False], ["last", "last_epoch"]),
+    )
+    for sort_by, ascending, columns in picks:
+        best = df.sort_values(sort_by, ascending=ascending, kind="stable").drop_duplicates(keys).set_index(keys)
+        out[columns] = best[columns]
+    return out.reset_index()
+
+def summarize_readings(data, period):
+    """Turns raw store columns ({'epoch': ..., metric: ...}) into summary rows of `period` seconds."""
+    epochs = np.asarray(data["epoch"], dtype="int64")
+    frames = []
+    for index, metric in enumerate(SUMMARY_METRICS):
+        values = np.asarray(data[metric], dtype="float64")
+        valid = ~np.isnan(values)
+        if not valid.any():
+            continue
+        e, v = epochs[valid], values[valid]
+        frames.append(pd.DataFrame({
+            "epoch": e - e % period, "metric": np.int8(index), "sign": _signs(v), "count": 1, "sum": v,
+            "min": v, "min_epoch": e, "max": v, "max_epoch": e, "first": v, "first_epoch": e, "last": v, "last_epoch": e,
+        }))
+    if not frames:
+        return pd.DataFrame(columns=list(SUMMARY_COLUMNS))
+    return merge_summaries(pd.concat(frames, ignore_index=True))
+
+def resummarize(df, period):
+    """Folds summary rows into coarser periods of `period` seconds."""
+    if df.empty:
+        return df
+    return merge_summaries(df.assign(epoch=df["epoch"] - df["epoch"] % period))
+
+class SummaryStore:
+    """
+    One summary tier: per (period start, metric, sign) the mergeable aggregate state of
+    all readings in that period, as monthly directories of raw binary columns sorted
+    by KEYS. Appending rows for existing keys merges them.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def partitions(self):
+        return NumericStore(self.path).partitions()
+
+    def _column_path(self, partition, column):
+        return os.path.join(self.path, partition, f"{column}.bin")
+
+    def read_partition(self, partition):
+        columns = {column: np.fromfile(self._column_path(partition, column), dtype=dtype)
+                   for column, dtype in SUMMARY_COLUMNS.items()}
+        rows = min(len(values) for values in columns.values())
+        return pd.DataFrame({column: values[:rows] for column, values in columns.items()})
+
+    def append(self, df):
+        if df.empty:
+            return
+        partitions = partition_of(df["epoch"].to_numpy())
+        for partition in np.unique(partitions):
+            rows = df[partitions == partition]
+            if os.path.isdir(os.path.join(self.path, partition)):
+                rows = merge_summaries(pd.concat([self.read_partition(partition), rows], ignore_index=True))
+            self._write_partition(partition, rows)
+
+    def _write_partition(self, partition, df):
+        os.makedirs(os.path.join(self.path, partition), exist_ok=True)
+        for column, dtype in SUMMARY_COLUMNS.items():
+            tmp_path = self._column_path(partition, column) + ".tmp"
+            df[column].to_numpy(dtype=dtype).tofile(tmp_path)
+            os.replace(tmp_path, self._column_path(partition, column))
+
+    def read_range(self, start_epoch, end_epoch):
+        """Summary rows with start_epoch <= period start <= end_epoch."""
+        first, last = partition_of([start_epoch, end_epoch])
+        frames = []
+        for partition in self.partitions():
+            if first <= partition <= last:
+                df = self.read_partition(partition)
+                frames.append(df[(df["epoch"] >= start_epoch) & (df["epoch"] <= end_epoch)])
+        if not frames:
+            return pd.DataFrame(columns=list(SUMMARY_COLUMNS))
+        return pd.concat(frames, ignore_index=True)
+
+    def remove_before(self, epoch):
+        removed = 0
+        for partition in self.partitions():
+            df = self.read_partition(partition)
+            keep = df["epoch"] >= epoch
+            if keep.all():
+                continue
+            removed += int((~keep).sum())
+            if not keep.any():
+                shutil.rmtree(os.path.join(self.path, partition))
+            else:
+                self._write_partition(partition, df[keep])
+        return removed
+
+# --- Tier bookkeeping ---
+def tiers_path(store_path):
+    return os.path.join(store_path, TIERS_DIRNAME)
+
+def load_state(store_path):
+    """
+    Returns {'tiers': [{'name', 'period', 'days', 'horizon'}, ...]} from fine to coarse.
+    Tier i holds the periods before its own horizon that
+    are not older than the next tier's horizon; raw readings cover everything from the
+    first tier's horizon on. Queries read each tier only over that span, so leftovers
+    of an interrupted compaction are never counted twice.
+    """
+    path = os.path.join(tiers_path(store_path), STATE_FILENAME)
+    if not os.path.exists(path):
+        return {"tiers": []}
+    with open(path, 'r') as f:
+        return ujson.load(f)
+
+def save_state(state, store_path):
+    os.makedirs(tiers_path(store_path), exist_ok=True)
+    path = os.path.join(tiers_path(store_path), STATE_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        ujson.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+def coverage(store_path):
+    """
+    Returns (raw_from, [(SummaryStore, from_epoch, before_epoch), ...]): raw readings
+    count from `raw_from` (None = all), each tier covers [from_epoch, before_epoch).
+    """
+    tiers = load_state(store_path)["tiers"]
+    if not tiers:
+        return None, []
+    spans = []
+    for i, tier in enumerate(tiers):
+        older = tiers[i + 1]["horizon"] if i + 1 < len(tiers) else None
+        spans.append((SummaryStore(os.path.join(tiers_path(store_path), tier["name"])), older, tier["horizon"]))
+    return tiers[0]["horizon"], spans
+
+def read_summaries(store_path, start_epoch, end_epoch, metrics):
+    """Summary rows for `metrics` in the range, each tier limited to the span it is authoritative for."""
+    frames = []
+    metric_index = [SUMMARY_METRICS.index(metric) for metric in metrics]
+    for tier, older, before in coverage(store_path)[1]:
+        lo = start_epoch if older is None else max(start_epoch, older)
+        hi = min(end_epoch, before - 1)
+        if lo > hi:
+            continue
+        df = tier.read_range(lo, hi)
+        frames.append(df[df["metric"].isin(metric_index)])
+    if not frames:
+        return pd.DataFrame(columns=list(SUMMARY_COLUMNS))
+    return pd.concat(frames, ignore_index=True)
+
+def first_epoch(store_path):
+    """
+    Oldest epoch the store answers for: its oldest summary period or raw reading,
+    each tier only within the span it is authoritative for. None when it holds nothing.
+    """
+    firsts = []
+    raw_first = NumericStore(store_path).first_epoch()
+    if raw_first is not None:
+        firsts.append(raw_first)
+    for summaries, from_epoch, before_epoch in coverage(store_path)[1]:
+        for partition in summaries.partitions():
+            epochs = summaries.read_partition(partition)["epoch"]
+            epochs = epochs[(epochs >= (from_epoch or 0)) & (epochs < before_epoch)]
+            if len(epochs):
+                firsts.append(int(epochs.min()))
+                break
+    return min(firsts) if firsts else None
+
+def has_data(store_path):
+    return bool(NumericStore(store_path).partitions()) or bool(load_state(store_path)["tiers"])
+
+# --- Compaction ---
+def compact(store_path=NUMERIC_STORE_PATH, tiers=DEFAULT_TIERS, now=None, collection=None):
+    """
+    Folds raw readings older than the first tier's age into that tier, and each tier's
+    periods older than the next tier's age into the next one. Horizons are aligned to
+    local midnight, so a queried day never straddles two tiers. With a `collection`,
+    the per-reading Chroma documents that were folded away are deleted as well.
+    Returns {tier: rows folded in}.
+    """
+    for name, period, _ in tiers:
+        if period <= 0 or MAX_PERIOD % period:
+            raise ValueError(f"Tier '{name}': the period must divide {MAX_PERIOD} seconds, got {period}.")
+    now = time.time() if now is None else now
+    store = NumericStore(store_path)
+    state = load_state(store_path)
+    previous = {tier["name"]: tier["horizon"] for tier in state["tiers"]}
+    folded = {}
+
+    for i, (name, period, days) in enumerate(tiers):
+        horizon = local_day_start(now - days * 86400)
+        horizon = max(horizon, previous.get(name, horizon))
+        if i > 0:
+            horizon = min(horizon, state["tiers"][i - 1]["horizon"])
+        start = previous.get(name)
+        target = SummaryStore(os.path.join(tiers_path(store_path), name))
+
+        with timer("compaction", tier=name):
+            if i == 0:
+                bounds = store.bounds()
+                lo = previous.get(name, bounds[0] if bounds else horizon)
+                rows = summarize_readings(store.read_range(lo, horizon - 1, SUMMARY_METRICS), period) if bounds else pd.DataFrame()
+            else:
+                source = SummaryStore(os.path.join(tiers_path(store_path), tiers[i - 1][0]))
+                lo = start if start is not None else -2**62
+                rows = resummarize(source.read_range(lo, horizon - 1), period)
+            target.append(rows)
+        folded[name] = len(rows)
+
+        # Record the new horizon before deleting the source, so a crash in between leaves
+        # leftovers outside every query span instead of counting them twice
+        entry = {"name": name, "period": period, "days": days, "horizon": horizon}
+        if i < len(state["tiers"]):
+            state["tiers"][i] = entry
+        else:
+            state["tiers"].append(entry)
+        save_state(state, store_path)
+
+        if i == 0:
+            removed = store.remove_before(horizon)
+            if collection is not None and start != horizon:
+                _delete_readings(collection, lo, horizon)
+        else:
+            removed = source.remove_before(horizon)
+        print(f"Tier '{name}': {len(rows)} summary rows folded in, {removed} older rows removed, horizon "
+              f"{pd.Timestamp(horizon, unit='s', tz='UTC').tz_convert('Europe/Amsterdam'):%Y-%m-%d}.")
+    return folded
+
+def _delete_readings(collection, start_epoch, end_epoch):
+    """Deletes per-reading documents with start_epoch <= epoch < end_epoch; rollups and patterns have no epoch."""
+    deleted = 0
+    where = {"$and": [{"epoch": {"$gte": int(start_epoch)}}, {"epoch": {"$lt": int(end_epoch)}}]}
+    while True:
+        with timer("chroma", op="get"):
+            ids = collection.get(where=where, include=[], limit=CHROMA_DELETE_BATCH)["ids"]
+        if not ids:
+            break
+        with timer("chroma", op="delete"):
+            collection.delete(ids=ids)
+        deleted += len(ids)
+    print(f"{deleted} compacted reading documents deleted from ChromaDB.")
+    return deleted
+
+def parse_tier(text):
+    """Parses 'name:period_seconds:days', e.g. 'minute:60:30'; the period must divide an hour."""
+    try:
+        name, period, days = text.split(":")
+        period, days = int(period), int(days)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected name:period_seconds:days, got '{text}'.")
+    if period <= 0 or MAX_PERIOD % period:
+        raise argparse.ArgumentTypeError(f"The period must divide {MAX_PERIOD} seconds, got {period}.")
+    return name, period, days
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Downsample old raw readings into minute/hour summary tiers.")
+    parser.add_argument("--store", type=str, default=NUMERIC_STORE_PATH)
+    parser.add_argument("--tier", type=parse_tier, action="append", default=None,
+                        help="name:period_seconds:days, in order from fine to coarse (default: minute:60:30 hour:3600:365).")
+    parser.add_argument("--chroma", action="store_true", help="Also delete the compacted per-reading documents from ChromaDB.")
+    args = parser.parse_args()
+
+    collection = None
+    if args.chroma:
+        import chromadb
+        import main
+        collection = chromadb.PersistentClient(path=main.CHROMA_DB_PATH).get_collection(name=main.COLLECTION_NAME)
+    compact(args.store, tuple(args.tier) if args.tier else DEFAULT_TIERS, collection=collection)
@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+# --- Constants ---
+LOCAL_TZ = "Europe/Amsterdam"
+# Day part -> first local hour; the same buckets as tools.TIME_OF_DAY_MAPPING
+DAY_PARTS = {"night": 0, "morning": 6, "afternoon": 12, "evening": 18}
+DAY_PART_NAMES = list(DAY_PARTS)
+PATTERN_COLUMNS = ["active_power_w", "total_power_import_kwh", "total_power_export_kwh", "total_gas_m3"]
+# Daily export (kWh) above which the solar yield is called high / moderate
+SOLAR_YIELD_LEVELS = ((10.0, "high"), (3.0, "moderate"), (0.0, "low"))
+PATTERN_BATCH_SIZE = 256
+
+def iter_pattern_readings(store, since_epoch=None):
+    """
+    Yields power and counter readings from the numeric store as DataFrames with an
+    'epoch' column, one local calendar month at a time, starting at the local day of
+    `since_epoch`. Months hold whole local days, so every day is profiled from all
+    of its readings while memory stays bounded by one month.
+    """
+    bounds = store.bounds()
+    if bounds is None:
+        return
+    start = local_day_start(bounds[0] if since_epoch is None else max(since_epoch, bounds[0]))
+    while start <= bounds[1]:
+        month = pd.Timestamp(start, unit="s", tz="UTC").tz_convert(LOCAL_TZ).normalize().replace(day=1)
+        end = int((month + pd.DateOffset(months=1)).timestamp())
+        data = store.read_range(start, end - 1, PATTERN_COLUMNS)
+        if len(data["epoch"]):
+            yield pd.DataFrame({column: np.asarray(values) for column, values in data.items()})
+        start = end
+
+def local_day_start(epoch):
+    """Epoch of local midnight for the day containing `epoch`."""
+    day = pd.Timestamp(epoch, unit="s", tz="UTC").tz_convert(LOCAL_TZ).normalize()
+    return int(day.timestamp())
+
+def _profile(df, keys):
+    """
+    One row per group of `keys` with average/peak/lowest power, the local time of the
+    peak, and the counter deltas (max - min) for import, export and gas.
+    """
+    grouped = df.groupby(keys, sort=True)
+    profile = grouped["active_power_w"].agg(avg_power_w="mean", peak_power_w="max", min_power_w="min", readings="count")
+    peak_rows = grouped["active_power_w"].idxmax().dropna().astype("int64")
+    peak_epochs = df["epoch"].to_numpy()[peak_rows.to_numpy()]
+    profile["peak_time"] = pd.Series(
+        pd.to_datetime(peak_epochs, unit="s", utc=True).tz_convert(LOCAL_TZ).strftime("%H:%M"), index=peak_rows.index)
+    counters = grouped[["total_power_import_kwh", "total_power_export_kwh", "total_gas_m3"]].agg(["min", "max"])
+    for column, name in (("total_power_import_kwh", "import_kwh"), ("total_power_export_kwh", "export_kwh"), ("total_gas_m3", "gas_m3")):
+        profile[name] = counters[(column, "max")] - counters[(column, "min")]
+    profile["period_start"] = grouped["epoch"].min()
+    return profile
+
+def compute_day_profiles(df):
+    """
+    Vectorized load profiles from raw readings: returns (days, day_parts), two
+    DataFrames indexed by local date and by (local date, day part).
+    """
+    local = pd.to_datetime(df["epoch"].to_numpy(), unit="s", utc=True).tz_convert(LOCAL_TZ)
+    df = df.reset_index(drop=True).assign(
+        date=local.tz_localize(None).floor("D"), # wall-clock date; formatted once per group below
+        part=np.searchsorted(list(DAY_PARTS.values()), local.hour, side="right") - 1,
+    )
+    days = _profile(df, "date")
+    days.index = days.index.strftime("%Y-%m-%d")
+    day_parts = _profile(df, ["date", "part"])
+    day_parts.index = day_parts.index.set_levels(day_parts.index.levels[0].strftime("%Y-%m-%d"), level=0)
+    # Day part with the highest average consumption
+    busiest = day_parts["avg_power_w"].unstack("part").idxmax(axis=1)
+    days["peak_part"] = busiest.map(lambda part: DAY_PART_NAMES[int(part)] if pd.notna(part) else None)
+    return days, day_parts
+
+def _solar_yield(export_kwh):
+    for threshold, label in SOLAR_YIELD_LEVELS:
+        if export_kwh > threshold:
+            return label
+    return "no"
+
+def describe_day(date, row):
+    """Short description of a day's pattern, e.g. 'consumption peak in the evening, low solar yield during the day'."""
+    weekday = pd.Timestamp(date).day_name()
+    parts = [f"{weekday} {date}:"]
+    if row.get("peak_part"):
+        parts.append(f"consumption peak in the {row['peak_part']}, highest draw {row['peak_power_w']:.0f} W at {row['peak_time']},")
+    parts.append(f"{_solar_yield(row['export_kwh'])} solar yield during the day ({row['export_kwh']:.1f} kWh exported),")
+    parts.append(f"{row['import_kwh']:.1f} kWh imported")
+    if pd.notna(row["gas_m3"]):
+        parts.append(f"and {row['gas_m3']:.2f} m3 gas used")
+    return " ".join(parts) + "."
+
+def describe_day_part(date, part, row):
+    weekday = pd.Timestamp(date).day_name()
+    text = (f"{weekday} {date} in the {DAY_PART_NAMES[part]}: average use {row['avg_power_w']:.0f} W, "
+            f"peak {row['peak_power_w']:.0f} W at {row['peak_time']}, lowest {row['min_power_w']:.0f} W, "
+            f"{row['import_kwh']:.2f} kWh imported, {row['export_kwh']:.2f} kWh exported")
+    if pd.notna(row["gas_m3"]):
+        text += f", {row['gas_m3']:.2f} m3 gas used"
+    return text + "."
+
+def _metadata(row, **extra):
+    """Chroma metadata from a profile row; missing values are left out, since Chroma rejects None."""
+    metadata = dict(extra)
+    for key in ("avg_power_w", "peak_power_w", "min_power_w", "import_kwh", "export_kwh", "gas_m3"):
+        if pd.notna(row[key]):
+            metadata[key] = float(row[key])
+    for key in ("peak_time", "peak_part"):
+        if isinstance(row.get(key), str):
+            metadata[key] = row[key]
+    metadata["period_start"] = int(row["period_start"])
+    return metadata
+
+def build_pattern_documents(days, day_parts, per_day_part=False):
+    """
+    Turns day profiles into (documents, metadatas, ids): one document per day, or
+    one per day part with `per_day_part`. Ids are stable per date, so re-running
+    over a day that got new readings replaces its document.
+    """
+    documents, metadatas, ids = [], [], []
+    if per_day_part:
+        for (date, part), row in day_parts.iterrows():
+            documents.append(describe_day_part(date, part, row))
+            metadatas.append(_metadata(row, doc_type="day_part_pattern", date=date, day_part=DAY_PART_NAMES[part],
+                                       year=int(date[:4]), month=int(date[5:7])))
+            ids.append(f"pattern_{date}_{DAY_PART_NAMES[part]}")
+    else:
+        for date, row in days.iterrows():
+            documents.append(describe_day(date, row))
+            metadatas.append(_metadata(row, doc_type="daily_pattern", date=date, year=int(date[:4]), month=int(date[5:7])))
+            ids.append(f"pattern_{date}")
+    return documents, metadatas, ids
+
+def iter_pattern_batches(frames, per_day_part=False, batch_size=PATTERN_BATCH_SIZE):
+    """
+    Yields (documents, metadatas, ids) batches for the days in `frames`, ready for
+    ingest_pipeline.run_pipeline. `frames` is one DataFrame or an iterable of frames
+    that each hold whole days (see iter_pattern_readings); they are profiled one by one.
+    """
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    for df in frames:
+        if df.empty:
+            continue
+        documents, metadatas, ids = build_pattern_documents(*compute_day_profiles(df), per_day_part=per_day_part)
+        for start in range(0, len(ids), batch_size):
+            yield documents[start:start + batch_size], metadatas[start:start + batch_size], ids[start:start + batch_size]
@@ -0,0 +1,255 @@
+import os
+import time
+import argparse
+import numpy as np
+from typing import Any, Dict, List
+from chromadb.api.types import EmbeddingFunction
+from metrics import METRICS, count
+
+# --- Constants ---
+BACKENDS = ("torch", "onnx", "onnx-int8")
+# all-MiniLM-L6-v2 exported to ONNX, as downloaded by Chroma's ONNXMiniLM_L6_V2 (model.onnx + tokenizer.json)
+ONNX_MODEL_DIR = os.path.join(os.path.expanduser("~"), ".cache", "chroma", "onnx_models", "all-MiniLM-L6-v2", "onnx")
+INT8_MODEL_FILENAME = "model.int8.onnx"
+MAX_TOKENS = 256 # the model was trained on at most 256 word pieces
+DEFAULT_BATCH_SIZE = 32
+BATCH_SIZES = (8, 16, 32, 64, 128, 256) # candidates for the warm-up probe
+PROBE_TEXTS = 512 # texts timed per candidate setting
+TUNE_MIN_TEXTS = 256 # smaller calls (queries, trickle updates) run at the defaults instead of tuning on too few texts
+# Parity thresholds against the reference (PyTorch) embeddings
+PARITY_MIN_COSINE = 0.98
+PARITY_MIN_OVERLAP = 0.9 # fraction of the reference top-k neighbours that is found again
+PARITY_K = 10
+
+def thread_candidates(cpus=None):
+    """1, 2, 4, ... up to the number of cores, plus the core count itself."""
+    cpus = cpus or os.cpu_count() or 1
+    candidates, threads = [], 1
+    while threads < cpus:
+        candidates.append(threads)
+        threads *= 2
+    return candidates + [cpus]
+
+def cache_name(model_name, backend):
+    """
+    Name the embedding cache is keyed by. ONNX in fp32 reproduces the PyTorch vectors,
+    so both share a cache; the int8 model gives slightly different vectors and gets its own.
+    """
+    return f"{model_name}.int8" if backend == "onnx-int8" else model_name
+
+def quantize_model(model_dir=ONNX_MODEL_DIR):
+    """Writes a dynamically int8-quantized copy of model.onnx once; needs the `onnx` package for the conversion."""
+    target = os.path.join(model_dir, INT8_MODEL_FILENAME)
+    if not os.path.exists(target):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        print(f"Quantizing {os.path.join(model_dir, 'model.onnx')} to int8...")
+        quantize_dynamic(os.path.join(model_dir, "model.onnx"), target, weight_type=QuantType.QInt8)
+    return target
+
+def ensure_model(model_dir=ONNX_MODEL_DIR):
+    """Downloads the ONNX export through Chroma when it is not on disk yet."""
+    if not os.path.exists(os.path.join(model_dir, "model.onnx")):
+        from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+        ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])(["download"])
+
+class OnnxMiniLM(EmbeddingFunction):
+    """
+    all-MiniLM-L6-v2 on ONNX Runtime (optionally int8-quantized), producing the same
+    mean-pooled, normalised vectors as the sentence-transformers model.
+
+    Texts are tokenized once, sorted by length and padded per batch to the longest
+    text in that batch, so short meter sentences are not padded to 256 tokens. With
+    `batch_size` or `threads` left at 0, the first call of at least TUNE_MIN_TEXTS
+    texts (an indexing batch) probes the candidate settings on a sample of its own
+    texts and keeps the fastest; smaller calls such as a single query run at the
+    defaults until then. The session is created on first use. It reports itself as
+    the sentence-transformers function with the config that function runs with, so
+    collections stay interchangeable with clients that embed queries with PyTorch.
+    """
+    def __init__(self, model_name="all-MiniLM-L6-v2", quantized=False, threads=0, batch_size=0,
+                 model_dir=ONNX_MODEL_DIR):
+        self.model_name = model_name
+        self.quantized = quantized
+        self.threads = threads
+        self.batch_size = batch_size
+        self.model_dir = model_dir
+        self._session = None
+        self._session_threads = None
+        self._tokenizer = None
+
+    @staticmethod
+    def name():
+        return "sentence_transformer"
+
+    def get_config(self) -> Dict[str, Any]:
+        # As CachedEmbeddingFunction and the PyTorch function report: encode() runs without its
+        # extra normalisation; the unit-length output comes from the model's own Normalize layer (see _run)
+        return {"model_name": self.model_name, "device": "cpu", "normalize_embeddings": False, "kwargs": {}}
+
+    @staticmethod
+    def build_from_config(config):
+        return OnnxMiniLM(model_name=config.get("model_name", "all-MiniLM-L6-v2"))
+
+    # --- Model ---
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            from tokenizers import Tokenizer
+            ensure_model(self.model_dir)
+            self._tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+            self._tokenizer.enable_truncation(max_length=MAX_TOKENS)
+            self._tokenizer.no_padding()
+        return self._tokenizer
+
+    def session(self, threads=None):
+        """The inference session for `threads` intra-op threads (0 = ONNX Runtime's default)."""
+        threads = self.threads if threads is None else threads
+        if self._session is None or self._session_threads != threads:
+            import onnxruntime as ort
+            ensure_model(self.model_dir)
+            path = quantize_model(self.model_dir) if self.quantized else os.path.join(self.model_dir, "model.onnx")
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+            self._session_threads = threads
+        return self._session
+
+    # --- Inference ---
+    def _run(self, session, encodings):
+        """Embeds one batch of encodings, padded to its longest member."""
+        width = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.zeros((len(encodings), width), dtype=np.int64)
+        attention_mask = np.zeros_like(input_ids)
+        token_type_ids = np.zeros_like(input_ids)
+        for i, encoding in enumerate(encodings):
+            n = len(encoding.ids)
+            input_ids[i, :n] = encoding.ids
+            attention_mask[i, :n] = encoding.attention_mask
+            token_type_ids[i, :n] = encoding.type_ids
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": token_type_ids}
+        names = {model_input.name for model_input in session.get_inputs()}
+        hidden = session.run(None, {name: value for name, value in feeds.items() if name in names})[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        # all-MiniLM-L6-v2 ends in a Normalize module, so sentence-transformers returns unit vectors too
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def _embed(self, encodings, batch_size, session) -> np.ndarray:
+        order = np.argsort([len(encoding.ids) for encoding in encodings], kind="stable")
+        vectors = np.empty((len(encodings), 0), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            batch = self._run(session, [encodings[i] for i in rows]).astype(np.float32)
+            if vectors.shape[1] == 0:
+                vectors = np.empty((len(encodings), batch.shape[1]), dtype=np.float32)
+            vectors[rows] = batch
+        return vectors
+
+    def tune(self, texts: List[str]) -> Dict[str, int]:
+        """
+        Times the candidate thread counts (at the default batch size) and then the
+        candidate batch sizes on `texts`, and keeps the fastest of each.
+        """
+        encodings = self.tokenizer.encode_batch(list(texts[:PROBE_TEXTS]))
+        self._embed(encodings[:DEFAULT_BATCH_SIZE], DEFAULT_BATCH_SIZE, self.session(self.threads or 0)) # warm-up
+
+        def throughput(batch_size, threads):
+            session = self.session(threads)
+            start = time.perf_counter()
+            self._embed(encodings, batch_size, session)
+            return len(encodings) / (time.perf_counter() - start)
+
+        if not self.threads:
+            results = {threads: throughput(self.batch_size or DEFAULT_BATCH_SIZE, threads) for threads in thread_candidates()}
+            self.threads = max(results, key=results.get)
+        if not self.batch_size:
+            results = {size: throughput(size, self.threads) for size in BATCH_SIZES if size <= max(len(encodings), BATCH_SIZES[0])}
+            self.batch_size = max(results, key=results.get)
+        count("embedding_tuned")
+        print(f"Embedding backend tuned: {self.threads} thread(s), batch size {self.batch_size}.")
+        return {"threads": self.threads, "batch_size": self.batch_size}
+
+    def __call__(self, input):
+        texts = list(input)
+        if not texts:
+            return []
+        if (not self.batch_size or not self.threads) and len(texts) >= TUNE_MIN_TEXTS:
+            self.tune(texts)
+        start = time.perf_counter()
+        vectors = self._embed(self.tokenizer.encode_batch(texts), self.batch_size or DEFAULT_BATCH_SIZE, self.session())
+        METRICS.observe("embedding_backend", time.perf_counter() - start, backend="onnx-int8" if self.quantized else "onnx")
+        return list(vectors)
+
+class Int8MiniLM(OnnxMiniLM):
+    """OnnxMiniLM on the dynamically int8-quantized model."""
+    def __init__(self, model_name="all-MiniLM-L6-v2", threads=0, batch_size=0, model_dir=ONNX_MODEL_DIR):
+        super().__init__(model_name, quantized=True, threads=threads, batch_size=batch_size, model_dir=model_dir)
+
+def embedding_function_class(backend):
+    """Class (or factory) taking model_name=..., as CachedEmbeddingFunction and the ingest workers expect."""
+    if backend == "torch":
+        from chromadb.utils import embedding_functions
+        return embedding_functions.SentenceTransformerEmbeddingFunction
+    if backend == "onnx":
+        return OnnxMiniLM
+    if backend == "onnx-int8":
+        return Int8MiniLM
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+def parity_check(reference: np.ndarray, candidate: np.ndarray, k: int = PARITY_K) -> Dict[str, Any]:
+    """
+    Compares candidate embeddings of the same texts against the reference: per-text
+    cosine similarity, and how many of each text's top-k reference neighbours the
+    candidate vectors retrieve too.
+    """
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = (reference * candidate).sum(axis=1)
+
+    k = min(k, len(reference) - 1)
+    overlap = 1.0
+    if k > 0:
+        def neighbours(vectors):
+            scores = vectors @ vectors.T
+            np.fill_diagonal(scores, -np.inf)
+            return np.argpartition(-scores, k, axis=1)[:, :k]
+        expected, found = neighbours(reference), neighbours(candidate)
+        overlap = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(expected, found)]))
+    result = {"texts": len(reference), "min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean()),
+              f"overlap_at_{k}": overlap}
+    result["passed"] = result["min_cosine"] >= PARITY_MIN_COSINE and overlap >= PARITY_MIN_OVERLAP
+    return result
+
+def stored_model_name(collection, default="all-MiniLM-L6-v2") -> str:
+    """Model name in the embedding function config persisted with the collection, or `default`."""
+    config = ((getattr(collection, "configuration_json", None) or {}).get("embedding_function") or {}).get("config") or {}
+    return config.get("model_name", default)
+
+def collection_parity(collection, backend, limit=2000, k=PARITY_K) -> Dict[str, Any]:
+    """Re-embeds up to `limit` stored documents with `backend` and compares with their stored embeddings."""
+    stored = collection.get(limit=limit, include=["documents", "embeddings"])
+    rows = [i for i, document in enumerate(stored["documents"]) if document]
+    documents = [stored["documents"][i] for i in rows]
+    reference = np.asarray(stored["embeddings"], dtype=np.float32)[rows]
+    candidate = np.asarray(embedding_function_class(backend)(model_name=stored_model_name(collection))(documents))
+    return parity_check(reference, candidate, k)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check an embedding backend against the embeddings stored in the collection.")
+    parser.add_argument("--backend", choices=BACKENDS, default="onnx-int8")
+    parser.add_argument("--limit", type=int, default=2000, help="Stored documents to re-embed.")
+    parser.add_argument("--k", type=int, default=PARITY_K, help="Neighbours compared per document.")
+    args = parser.parse_args()
+
+    import chromadb
+    import main
+    collection = chromadb.PersistentClient(path=main.CHROMA_DB_PATH).get_collection(name=main.COLLECTION_NAME)
+    result = collection_parity(collection, args.backend, args.limit, args.k)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    if not result["passed"]:
+        raise SystemExit(f"{args.backend} does not match the stored embeddings closely enough.")
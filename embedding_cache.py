@@ -0,0 +1,176 @@
+import os
+import hashlib
+import threading
+import ujson
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+# --- Constants ---
+EMBEDDING_CACHE_PATH = os.path.join(os.getcwd(), "embedding_cache")
+KEY_SIZE = 16 # bytes of the blake2b digest used as cache key
+
+def cache_key(model_name, text):
+    """Content address of a document: a hash of the model name and the exact text."""
+    digest = hashlib.blake2b(digest_size=KEY_SIZE)
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.digest()
+
+class EmbeddingCache:
+    """
+    Append-only, content-addressed store of embeddings on disk.
+
+    Vectors live in a raw float32/float16 matrix that is memory-mapped for reads,
+    keys in a parallel file of fixed-size digests. Row i of the matrix belongs to
+    key i, so the index can be rebuilt from the key file alone. Vectors are written
+    before their keys, which keeps the files consistent after an interrupted write.
+    Safe for threads within one process; use one writing process per cache directory.
+    """
+    def __init__(self, cache_dir, model_name, dtype="float32"):
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        slug = model_name.replace("/", "_")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.meta_path = os.path.join(cache_dir, f"{slug}.{self.dtype.name}.json")
+        self.vectors_path = os.path.join(cache_dir, f"{slug}.{self.dtype.name}.vectors")
+        self.keys_path = os.path.join(cache_dir, f"{slug}.{self.dtype.name}.keys")
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._mapped_rows = 0
+        self.dim = None
+        self.index = {}
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                self.dim = ujson.load(f)["dim"]
+            self._load_index()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _load_index(self):
+        keys = b""
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, 'rb') as f:
+                keys = f.read()
+        rows = len(keys) // KEY_SIZE
+        row_bytes = self.dim * self.dtype.itemsize
+        vector_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        rows = min(rows, vector_rows)
+
+        # Drop anything past the last complete (vector, key) pair
+        with open(self.keys_path, 'ab') as f:
+            f.truncate(rows * KEY_SIZE)
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(rows * row_bytes)
+
+        self.index = {keys[i * KEY_SIZE:(i + 1) * KEY_SIZE]: i for i in range(rows)}
+
+    def _matrix(self):
+        """Returns the memory-mapped matrix, remapping it when rows were appended."""
+        if self._mapped_rows != len(self.index):
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(len(self.index), self.dim))
+            self._mapped_rows = len(self.index)
+        return self._vectors
+
+    def get_many(self, texts):
+        """Returns a list with a float32 vector for every cached text and None for misses."""
+        with self._lock:
+            rows = [self.index.get(cache_key(self.model_name, text)) for text in texts]
+            if not self.index:
+                return [None] * len(texts)
+            matrix = self._matrix()
+            return [None if row is None else np.asarray(matrix[row], dtype=np.float32) for row in rows]
+
+    def put_many(self, texts, vectors):
+        """Appends the vectors of texts that are not cached yet."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(texts) != len(vectors):
+            raise ValueError("Expected one embedding vector per text.")
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.meta_path, 'w') as f:
+                    ujson.dump({"model_name": self.model_name, "dim": self.dim, "dtype": self.dtype.name}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match cache dimension {self.dim}.")
+
+            new_keys = {}
+            for i, text in enumerate(texts):
+                key = cache_key(self.model_name, text)
+                if key not in self.index and key not in new_keys:
+                    new_keys[key] = i
+            if not new_keys:
+                return
+
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vectors[list(new_keys.values())].astype(self.dtype).tobytes())
+            with open(self.keys_path, 'ab') as f:
+                f.write(b"".join(new_keys))
+
+            first_row = len(self.index)
+            for offset, key in enumerate(new_keys):
+                self.index[key] = first_row + offset
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """
+    Chroma embedding function that serves repeated documents from an EmbeddingCache
+    and only runs the wrapped model for texts it has never seen.
+
+    The wrapped embedding function is created lazily from `embedding_function_class`
+    and `kwargs`, so a run where every text is cached never loads the model. The
+    wrapper reports the wrapped function's name and config to Chroma, so collections
+    stay compatible with clients that use the plain embedding function. `cache_name`
+    keys the cache when a backend of the same model gives different vectors
+    (see embedding_backend.cache_name).
+    """
+    def __init__(self, embedding_function_class, model_name, cache_dir=EMBEDDING_CACHE_PATH, dtype="float32",
+                 cache_name=None, **kwargs):
+        self.embedding_function_class = embedding_function_class
+        self.model_name = model_name
+        self.kwargs = kwargs
+        self.cache = EmbeddingCache(cache_dir, cache_name or model_name, dtype=dtype)
+        self._embedding_function = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def embedding_function(self):
+        if self._embedding_function is None:
+            self._embedding_function = self.embedding_function_class(model_name=self.model_name, **self.kwargs)
+        return self._embedding_function
+
+    def __call__(self, input):
+        texts = list(input)
+        vectors = self.cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        self.hits += len(texts) - sum(vector is None for vector in vectors)
+        self.misses += len(missing)
+
+        if missing:
+            computed = np.asarray(self.embedding_function(missing), dtype=np.float32)
+            self.cache.put_many(missing, computed)
+            by_text = dict(zip(missing, computed))
+            vectors = [by_text[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+
+        return vectors
+
+    def name(self):
+        name = getattr(self.embedding_function_class, "name", None)
+        return name() if name else NotImplemented
+
+    def get_config(self):
+        """
+        The config the wrapped sentence-transformer function would report. Chroma asks
+        for it whenever a collection is opened, so it is built from the constructor
+        arguments instead of instantiating (and loading) the model.
+        """
+        kwargs = dict(self.kwargs)
+        return {
+            "model_name": self.model_name,
+            "device": kwargs.pop("device", "cpu"),
+            "normalize_embeddings": kwargs.pop("normalize_embeddings", False),
+            "kwargs": kwargs,
+        }
@@ -0,0 +1,303 @@
+import os
+import glob
+import time
+import argparse
+from typing import Any, Dict, List, Optional
+from metrics import METRICS, count, timer
+from ingest_manifest import load_manifest, save_manifest, record_ingest, resume_position, record_position
+
+# --- Constants ---
+POLL_INTERVAL = 0.5   # seconds to sleep when no file grew
+FLUSH_RECORDS = 500   # flush a micro-batch once this many records are buffered...
+FLUSH_SECONDS = 2.0   # ...or once the oldest buffered record waited this long
+ROLLUP_SECONDS = 60.0 # rollups (and the watermark) are brought up to date at most this often
+READ_BYTES = 1 << 20  # bytes read from one file per poll, so a large backlog is flushed in steps
+IDLE_SECONDS = 30.0   # a file that did not grow for this long has its handle closed
+MAX_OPEN_FILES = 64   # files read at the same time; others wait until a handle is closed
+
+class TailedFile:
+    """
+    An open log file that is read as it grows. `offset` is the byte position after
+    the last complete line; bytes of a line that is still being written are kept in
+    `partial` and only counted once the newline arrives.
+    """
+    def __init__(self, path, offset=0, lines=0):
+        self.path = path
+        self.handle = open(path, 'rb')
+        self.inode = os.fstat(self.handle.fileno()).st_ino
+        self.handle.seek(offset)
+        self.offset = offset
+        self.lines = lines
+        self.partial = b""
+        self.last_read = time.monotonic() # when data last arrived, for closing idle handles
+
+    def read_lines(self, max_bytes=READ_BYTES) -> List[bytes]:
+        """Complete lines appended since the previous call (at most about `max_bytes`)."""
+        data = self.handle.read(max_bytes)
+        if not data:
+            return []
+        self.last_read = time.monotonic()
+        data = self.partial + data
+        complete, newline, self.partial = data.rpartition(b"\n")
+        if not newline:
+            return []
+        self.offset += len(complete) + 1
+        return complete.split(b"\n")
+
+    def size_read(self) -> int:
+        return self.offset + len(self.partial)
+
+    def truncated(self) -> bool:
+        """True when the file was cut back below what was read (copy-truncate rotation)."""
+        return os.stat(self.path).st_size < self.size_read()
+
+    def rewind(self):
+        self.handle.seek(0)
+        self.offset, self.lines, self.partial = 0, 0, b""
+
+    def close(self):
+        self.handle.close()
+
+class Follower:
+    """
+    Tails the *.jsonl files in `data_dir` and writes new readings to the collection
+    and the numeric store in micro-batches, so they are queryable within seconds.
+
+    Positions are kept in the ingest manifest, so a restarted follower (or a later
+    main.py run) continues after the last flushed line. Files are tracked by inode:
+    a log that is renamed away is drained before the new file under its name is
+    read, one that disappears from the directory is drained once more, and a file
+    that is truncated in place is read again from the start. Re-reading is harmless,
+    since document ids and store epochs are derived from the reading timestamp.
+    Only files that grew are kept open: a handle is closed once its lines are flushed
+    and the file has not grown for `idle_seconds`, and a closed file is reopened when
+    its size changes. At most `max_open_files` are open; changed files wait for a
+    free handle, newest first, so a directory of historical logs costs one stat
+    per file per poll.
+    Rollups and the watermark follow every `rollup_seconds` (see run_indexing).
+    """
+    def __init__(self, collection, store, data_dir, manifest_path, rollup_state_path,
+                 flush_records=FLUSH_RECORDS, flush_seconds=FLUSH_SECONDS, rollup_seconds=ROLLUP_SECONDS,
+                 idle_seconds=IDLE_SECONDS, max_open_files=MAX_OPEN_FILES):
+        self.collection = collection
+        self.store = store
+        self.data_dir = data_dir
+        self.manifest_path = manifest_path
+        self.rollup_state_path = rollup_state_path
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.rollup_seconds = rollup_seconds
+        self.idle_seconds = idle_seconds
+        self.max_open_files = max_open_files
+        self.manifest = load_manifest(manifest_path)
+        self.files: Dict[str, TailedFile] = {}
+        self.idle: Dict[str, tuple] = {} # path -> (inode, size) when it was last read, for files without a handle
+        self.buffer: List[tuple] = []
+        self.positions: Dict[str, tuple] = {}
+        self.oldest = None # monotonic time the oldest buffered record was read
+        self.last_rollup = time.monotonic()
+        self.rollups_pending = False
+
+    # --- Reading ---
+    def _read(self, tailed, max_bytes=READ_BYTES, final=False):
+        lines = tailed.read_lines(max_bytes)
+        if final and tailed.partial:
+            # The writer has moved on, so a last line without newline will never be completed
+            lines.append(tailed.partial)
+            tailed.offset += len(tailed.partial)
+            tailed.partial = b""
+        if not lines:
+            return 0
+        import main
+        source_file = os.path.basename(tailed.path)
+        for line in lines:
+            tailed.lines += 1
+            record = main.parse_line(line, source_file, tailed.lines)
+            if record is not None:
+                self.buffer.append((record, source_file))
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+        self.positions[tailed.path] = (tailed.offset, tailed.lines)
+        return len(lines)
+
+    def _drain(self, tailed):
+        """Reads a file that will not grow any more to its end, then closes it."""
+        while self._read(tailed, final=True):
+            pass
+        tailed.close()
+
+    def poll(self) -> int:
+        """Reads what was appended to the log files since the last poll; returns the number of lines."""
+        read = 0
+        started = time.monotonic()
+        paths = sorted(glob.glob(os.path.join(self.data_dir, "*.jsonl")))
+        by_inode = {tailed.inode: tailed for tailed in self.files.values()}
+        current, changed = {}, []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue # rotated away between the listing and the stat
+            tailed = by_inode.pop(stat.st_ino, None)
+            if tailed is None:
+                if self.idle.get(path) != (stat.st_ino, stat.st_size):
+                    changed.append((stat.st_mtime_ns, path, stat))
+                continue
+            if tailed.path != path:
+                # Renamed within the directory: keep reading where it was
+                self.manifest["files"].pop(os.path.basename(tailed.path), None)
+                self.positions.pop(tailed.path, None)
+                tailed.path = path
+                self.positions[path] = (tailed.offset, tailed.lines)
+            elif tailed.truncated():
+                print(f"{os.path.basename(path)} was truncated, reading it from the start.")
+                tailed.rewind()
+            current[path] = tailed
+        # Files that left the directory or were replaced by a new file under their name
+        for tailed in by_inode.values():
+            read += self._drain_rotated(tailed)
+        self.files = current
+
+        # Files that changed since they were last read, the most recently written first
+        waiting = 0
+        for _, path, stat in sorted(changed, reverse=True):
+            if len(self.files) >= self.max_open_files:
+                waiting += 1
+                continue
+            self.idle.pop(path, None)
+            position = resume_position(self.manifest, path)
+            if position is None:
+                self.idle[path] = (stat.st_ino, stat.st_size) # indexed before, unchanged since
+                continue
+            self.files[path] = TailedFile(path, *position)
+        for tailed in self.files.values():
+            read += self._read(tailed)
+        self._close_idle(started, waiting)
+        return read
+
+    def _close_idle(self, started, waiting=0):
+        """
+        Closes handles of files that did not grow for `idle_seconds`, or that did not
+        grow in the poll `started` at while `waiting` changed files have no handle. Only
+        files whose lines are all flushed are closed, so they are reopened from the manifest.
+        """
+        idle = sorted((tailed.last_read, path) for path, tailed in self.files.items()
+                      if path not in self.positions and tailed.last_read < started)
+        for last_read, path in idle:
+            if started - last_read < self.idle_seconds and waiting <= 0:
+                break
+            tailed = self.files.pop(path)
+            self.idle[path] = (tailed.inode, tailed.size_read())
+            tailed.close()
+            count("follow_idle_closes")
+            waiting -= 1
+
+    def _drain_rotated(self, tailed):
+        lines_before = len(self.buffer)
+        self._drain(tailed)
+        self.positions.pop(tailed.path, None)
+        count("follow_rotations")
+        return len(self.buffer) - lines_before
+
+    # --- Writing ---
+    def due(self) -> bool:
+        if not self.buffer:
+            return False
+        return len(self.buffer) >= self.flush_records or time.monotonic() - self.oldest >= self.flush_seconds
+
+    def flush(self) -> int:
+        """Writes the buffered records to the store and the collection, then records the file positions."""
+        import main
+        records, self.buffer = self.buffer, []
+        if records:
+            with timer("follow_stage", stage="parse"):
+                documents, metadatas, ids = main._build_batch(records)
+            for _ in main.store_numeric_readings([(documents, metadatas, ids)], self.store):
+                pass
+            with timer("follow_stage", stage="upsert"):
+                # The collection's embedding function keeps the model loaded between micro-batches
+                self.collection.upsert(documents=documents, metadatas=metadatas, ids=ids)
+            count("follow_records", len(ids))
+            METRICS.observe("follow_stage", time.monotonic() - self.oldest, stage="read_to_queryable")
+            self.rollups_pending = True
+        for path, (offset, lines) in self.positions.items():
+            if os.path.exists(path):
+                record_position(self.manifest, path, offset, lines)
+        self.positions.clear()
+        save_manifest(self.manifest, self.manifest_path)
+        self.oldest = None
+        return len(records)
+
+    def update_rollups(self):
+        """Brings the rollups up to date with the flushed readings, then records what was written (see record_ingest)."""
+        from smart_database import load_rollup_state, load_store_readings, rollup_cutoff, update_rollups
+        written = self.store.take_written()
+        with timer("follow_stage", stage="rollups"):
+            since_epoch = rollup_cutoff(load_rollup_state(self.rollup_state_path), written)
+            update_rollups(self.collection, load_store_readings(self.store, since_epoch), self.rollup_state_path, written)
+        bounds = self.store.bounds()
+        if bounds is not None:
+            self.manifest["watermark"] = bounds[1]
+            record_ingest(self.manifest, written)
+            save_manifest(self.manifest, self.manifest_path)
+        self.rollups_pending = False
+        self.last_rollup = time.monotonic()
+
+    def step(self) -> int:
+        """One poll, plus a flush and a rollup update when they are due; returns the lines read."""
+        read = self.poll()
+        if self.due() or (self.positions and not self.buffer):
+            self.flush()
+        if self.rollups_pending and time.monotonic() - self.last_rollup >= self.rollup_seconds:
+            self.update_rollups()
+        return read
+
+    def run(self, max_seconds: Optional[float] = None, poll_interval: float = POLL_INTERVAL):
+        """Follows the directory until interrupted (or for `max_seconds`); flushes what is buffered on exit."""
+        print(f"Following {self.data_dir} (flush every {self.flush_records} records or {self.flush_seconds:.1f} s)...")
+        deadline = None if max_seconds is None else time.monotonic() + max_seconds
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                if not self.step():
+                    # Nothing new: sleep instead of spinning, but wake up in time for a pending flush
+                    wait = poll_interval
+                    if self.buffer:
+                        wait = max(0.0, min(wait, self.oldest + self.flush_seconds - time.monotonic()))
+                    time.sleep(wait)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self.flush()
+        if self.rollups_pending:
+            self.update_rollups()
+        for tailed in self.files.values():
+            tailed.close()
+        self.files = {}
+
+def follow(flush_records=FLUSH_RECORDS, flush_seconds=FLUSH_SECONDS, rollup_seconds=ROLLUP_SECONDS,
+           max_seconds=None, hnsw=None, backend=None, idle_seconds=IDLE_SECONDS) -> Dict[str, Any]:
+    """Tails main.DATA_DIR into the indexed collection; returns the follower counters."""
+    import main
+    from numeric_store import NumericStore
+    collection = main.setup_chroma_db(hnsw=hnsw, backend=backend or main.EMBEDDING_BACKEND)
+    follower = Follower(collection, NumericStore(main.NUMERIC_STORE_PATH), main.DATA_DIR,
+                        main.MANIFEST_PATH, main.ROLLUP_STATE_PATH, flush_records=flush_records,
+                        flush_seconds=flush_seconds, rollup_seconds=rollup_seconds, idle_seconds=idle_seconds)
+    follower.run(max_seconds=max_seconds)
+    return {"records": METRICS.counters.get(("follow_records", ()), 0),
+            "rotations": METRICS.counters.get(("follow_rotations", ()), 0)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Follow the P1 log directory and index new readings in micro-batches.")
+    parser.add_argument("--flush-records", type=int, default=FLUSH_RECORDS, help="Records per micro-batch.")
+    parser.add_argument("--flush-seconds", type=float, default=FLUSH_SECONDS, help="Longest a read record waits before it is flushed.")
+    parser.add_argument("--rollup-seconds", type=float, default=ROLLUP_SECONDS, help="How often rollups and the watermark are updated.")
+    parser.add_argument("--idle-seconds", type=float, default=IDLE_SECONDS, help="Close a file that did not grow for this long.")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Stop after this long (default: until interrupted).")
+    args = parser.parse_args()
+
+    stats = follow(args.flush_records, args.flush_seconds, args.rollup_seconds, args.max_seconds, idle_seconds=args.idle_seconds)
+    print(f"Follower stopped after {stats['records']} records and {stats['rotations']} rotation(s).")
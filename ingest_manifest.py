@@ -0,0 +1,125 @@
+import os
+import hashlib
+import ujson
+
+# --- Constants ---
+MANIFEST_FILENAME = "ingest_manifest.json"
+# Version of the metadata written on reading documents. A fresh manifest means every
+# document is (re)written, so it gets the current version; manifests from before
+# versioning count as 1 until the next --rebuild.
+# 2: derived local time fields (local_date, hour, weekday, iso_year/iso_week, time_of_day, power_sign)
+METADATA_VERSION = 2
+# Leading bytes hashed to recognise a file; a different head under the same name means it was rotated
+FINGERPRINT_BYTES = 256
+# Ingest runs whose written epoch range is remembered; cached results older than that are dropped
+WRITE_LOG_LENGTH = 256
+
+def empty_manifest(generation=0):
+    """
+    Returns a manifest that has not seen any source file yet. A rebuild passes the
+    previous ingest generation: it continues from there with an empty write log,
+    so every result cached before the rebuild is dropped (see result_cache).
+    """
+    manifest = {"files": {}, "metadata_version": METADATA_VERSION}
+    if generation:
+        manifest["generation"] = generation + 1
+    return manifest
+
+def load_manifest(path):
+    """
+    Loads the per-source-file ingest manifest. A missing or unreadable manifest
+    is treated as empty, which simply means everything is (re-)indexed.
+    """
+    if not os.path.exists(path):
+        return empty_manifest()
+    try:
+        with open(path, 'r') as f:
+            manifest = ujson.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not read manifest '{path}', starting from scratch: {e}")
+        return empty_manifest()
+    manifest.setdefault("files", {})
+    return manifest
+
+def record_ingest(manifest, written, meter=None):
+    """
+    Bumps the ingest generation and logs the (first, last) epoch range `written` by
+    this run, once every derived store is up to date. Nothing is recorded when no
+    readings were written. `meter` tags the entry in a log shared by several meters
+    (see shards.ShardCatalog).
+    """
+    if written is None:
+        return
+    manifest["generation"] = manifest.get("generation", 0) + 1
+    entry = [manifest["generation"], int(written[0]), int(written[1])]
+    writes = manifest.setdefault("writes", [])
+    writes.append(entry if meter is None else entry + [meter])
+    del writes[:-WRITE_LOG_LENGTH]
+
+def ingest_state(manifest, meters=None):
+    """
+    What result_cache.ResultCache needs to tell which cached results are still
+    current: {'generation': current ingest generation, 'since': first generation
+    still in the log, 'writes': [[generation, first_epoch, last_epoch], ...]},
+    restricted to `meters` when given. None if nothing was ingested yet.
+    """
+    if "generation" not in manifest:
+        return None
+    writes = manifest.get("writes", [])
+    since = writes[0][0] if writes else manifest["generation"] + 1
+    relevant = [write[:3] for write in writes if meters is None or (len(write) > 3 and write[3] in meters)]
+    return {"generation": manifest["generation"], "since": since, "writes": relevant}
+
+def read_ingest_state(path):
+    """The ingest state (see ingest_state) of the manifest at `path`."""
+    return ingest_state(load_manifest(path))
+
+def read_metadata_version(path):
+    """Metadata version of the indexed reading documents (see METADATA_VERSION); 1 when unknown."""
+    if not os.path.exists(path):
+        return 1
+    return load_manifest(path).get("metadata_version", 1)
+
+def save_manifest(manifest, path):
+    """Writes the manifest atomically so an interrupted run never leaves it half-written."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        ujson.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def file_fingerprint(file_path, length=FINGERPRINT_BYTES):
+    """Returns (bytes hashed, sha1) of the first `length` bytes of the file."""
+    with open(file_path, 'rb') as f:
+        head = f.read(length)
+    return len(head), hashlib.sha1(head).hexdigest()
+
+def resume_position(manifest, file_path):
+    """
+    Returns (offset, lines) to resume reading `file_path` from, or None when the
+    file is unchanged since the last run and can be skipped entirely.
+    A file that shrank, or whose first bytes changed (a log rotated in under the
+    same name), is assumed to be rewritten and is read from the start.
+    """
+    stat = os.stat(file_path)
+    entry = manifest["files"].get(os.path.basename(file_path))
+    if not entry or stat.st_size < entry.get("offset", 0):
+        return 0, 0
+    if "fingerprint" in entry and file_fingerprint(file_path, entry["head_bytes"]) != (entry["head_bytes"], entry["fingerprint"]):
+        return 0, 0
+    if stat.st_size == entry["offset"] and stat.st_mtime_ns == entry.get("mtime_ns"):
+        return None
+    return entry["offset"], entry.get("lines", 0)
+
+def record_position(manifest, file_path, offset, lines):
+    """Stores how far `file_path` has been indexed (byte offset of the next unread line)."""
+    stat = os.stat(file_path)
+    head_bytes, fingerprint = file_fingerprint(file_path, min(offset, FINGERPRINT_BYTES))
+    manifest["files"][os.path.basename(file_path)] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "offset": offset,
+        "lines": lines,
+        "head_bytes": head_bytes,
+        "fingerprint": fingerprint,
+    }
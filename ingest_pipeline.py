@@ -0,0 +1,164 @@
+import os
+import copy
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from chromadb.utils import embedding_functions
+from embedding_backend import cache_name, embedding_function_class
+from embedding_cache import EMBEDDING_CACHE_PATH, EmbeddingCache
+from metrics import METRICS, count, timer
+
+# --- Constants ---
+QUEUE_SIZE = 4 # parsed batches waiting for the embedding stage
+_DONE = object()
+
+# --- Embedding worker (runs in the pool processes) ---
+_worker_embedding_function = None
+
+def _init_worker(model_name, threads, backend="torch"):
+    """Loads the model once per worker and keeps it for all batches that worker embeds."""
+    global _worker_embedding_function
+    if backend != "torch":
+        # ONNX Runtime sizes its own thread pool; 0 lets the warm-up probe pick it
+        _worker_embedding_function = embedding_function_class(backend)(model_name=model_name, threads=threads)
+        return
+    if threads:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    _worker_embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+
+def _embed_texts(texts):
+    """Returns (vectors, seconds spent in the model); the timing travels back from worker processes."""
+    start = time.perf_counter()
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32), 0.0
+    vectors = np.asarray(_worker_embedding_function(texts), dtype=np.float32)
+    return vectors, time.perf_counter() - start
+
+# --- Pipeline stages ---
+def _parse_stage(batches, manifest, cache, out_queue, stop, errors):
+    """
+    Pulls batches from the parser and looks them up in the embedding cache.
+    The manifest is snapshotted per batch, because the parser advances it ahead of the writer.
+    """
+    try:
+        for documents, metadatas, ids in batches:
+            if stop.is_set():
+                break
+            snapshot = copy.deepcopy(manifest) if manifest is not None else None
+            if not documents:
+                out_queue.put((documents, metadatas, ids, [], [], snapshot))
+                continue
+            with timer("ingest_stage", stage="cache_lookup"):
+                vectors = cache.get_many(documents)
+            missing = list(dict.fromkeys(doc for doc, vector in zip(documents, vectors) if vector is None))
+            out_queue.put((documents, metadatas, ids, vectors, missing, snapshot))
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        out_queue.put(_DONE)
+
+def run_pipeline(collection, batches, model_name, workers=0, manifest=None, save_manifest=None,
+                 cache_dir=EMBEDDING_CACHE_PATH, queue_size=QUEUE_SIZE, vector_index=None, backend="torch"):
+    """
+    Indexes `batches` of (documents, metadatas, ids) with three overlapping stages:
+
+    1. a parse thread that reads batches and resolves cached embeddings,
+    2. a pool of `workers` processes that embed the cache misses
+       (workers=0 runs the model in a single in-process thread),
+    3. this thread as the single writer, upserting batches in order with their embeddings.
+
+    Stages are connected by bounded queues, so memory stays bounded by a few batches.
+    After each write `save_manifest(snapshot)` is called with the manifest as it was
+    when that batch was parsed. With a `vector_index` (see vector_index.QuantizedIndex)
+    each batch is also added there. `backend` selects the inference backend of the
+    workers (see embedding_backend). Returns a dict with counts and docs/sec throughput.
+    """
+    cache = EmbeddingCache(cache_dir, cache_name(model_name, backend))
+    parsed = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    parser_thread = threading.Thread(target=_parse_stage, args=(batches, manifest, cache, parsed, stop, errors), daemon=True)
+
+    if workers > 0:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_name, threads, backend))
+    else:
+        executor = ThreadPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(model_name, 0, backend))
+    max_in_flight = max(1, workers) * 2
+
+    stats = {"batches": 0, "documents": 0, "embedded": 0, "cached": 0}
+    in_flight = deque()
+    start = time.perf_counter()
+
+    def write_oldest():
+        documents, metadatas, ids, vectors, missing, snapshot, future = in_flight.popleft()
+        if documents:
+            if missing:
+                with timer("ingest_stage", stage="embed_wait"):
+                    computed, embed_seconds = future.result()
+                METRICS.observe("ingest_stage", embed_seconds, stage="embed")
+                with timer("ingest_stage", stage="cache_store"):
+                    cache.put_many(missing, computed)
+                by_text = dict(zip(missing, computed))
+                vectors = [by_text[doc] if vector is None else vector for doc, vector in zip(documents, vectors)]
+            embeddings = np.asarray(vectors, dtype=np.float32)
+            with timer("chroma", op="upsert"):
+                collection.upsert(
+                    documents=documents,
+                    metadatas=metadatas,
+                    ids=ids,
+                    embeddings=embeddings
+                )
+            if vector_index is not None:
+                with timer("ingest_stage", stage="vector_index"):
+                    vector_index.add(ids, embeddings)
+            count("ingest_documents", len(documents))
+            count("ingest_embedded", len(missing))
+            stats["batches"] += 1
+            stats["documents"] += len(documents)
+            stats["embedded"] += len(missing)
+            stats["cached"] += len(documents) - len(missing)
+            elapsed = time.perf_counter() - start
+            print(f"Upserted batch {stats['batches']} ({len(documents)} documents, {len(missing)} embedded) "
+                  f"- {stats['documents'] / elapsed:.0f} docs/sec")
+        # Persist progress only after the batch is safely stored
+        if save_manifest is not None and snapshot is not None:
+            save_manifest(snapshot)
+
+    try:
+        parser_thread.start()
+        while True:
+            item = parsed.get()
+            if item is _DONE:
+                break
+            documents, metadatas, ids, vectors, missing, snapshot = item
+            future = executor.submit(_embed_texts, missing) if missing else None
+            in_flight.append((documents, metadatas, ids, vectors, missing, snapshot, future))
+            if len(in_flight) >= max_in_flight:
+                write_oldest()
+        while in_flight:
+            write_oldest()
+    finally:
+        # Unblock the parse thread if the writer stopped early
+        stop.set()
+        while parser_thread.is_alive():
+            try:
+                parsed.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = elapsed
+    stats["docs_per_sec"] = stats["documents"] / elapsed if elapsed > 0 else 0.0
+    return stats
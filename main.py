@@ -1,142 +1,508 @@
 
 import os
 import glob
+import argparse
+import itertools
+import shutil
 import ujson
+import numpy as np
 import pandas as pd
-from sentence_transformers import SentenceTransformer
 import chromadb
-from chromadb.utils import embedding_functions
+from embedding_backend import BACKENDS, cache_name, embedding_function_class
+from embedding_cache import EMBEDDING_CACHE_PATH, CachedEmbeddingFunction
+from ingest_pipeline import run_pipeline
+from vector_index import VECTOR_INDEX_PATH, DTYPES, QuantizedIndex
+from daily_patterns import iter_pattern_batches, iter_pattern_readings, local_day_start
+from numeric_store import NUMERIC_STORE_PATH, NumericStore
+from smart_database import ROLLUP_STATE_FILENAME, load_rollup_state, load_store_readings, rollup_cutoff, update_rollups
+from topk_index import TOPK_INDEX_DIRNAME
+from metrics import METRICS, count, enable_profiling, profiled, timer
+from tools import LOCAL_TZ, TIME_OF_DAY_BUCKETS, _time_of_day_buckets
+from ingest_manifest import MANIFEST_FILENAME, empty_manifest, load_manifest, save_manifest, record_ingest, resume_position, record_position
 
 # --- Constants ---
 DATA_DIR = "C:\\Users\\emanu\\Documenten\\GitHub\\P1-energie-dashboard\\sample_logs"
 CHROMA_DB_PATH = os.path.join(os.getcwd(), "chroma_db")
 COLLECTION_NAME = "smartmeter_data"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_BACKEND = "torch" # or 'onnx' / 'onnx-int8', see embedding_backend.py
+MANIFEST_PATH = os.path.join(CHROMA_DB_PATH, MANIFEST_FILENAME)
+ROLLUP_STATE_PATH = os.path.join(CHROMA_DB_PATH, ROLLUP_STATE_FILENAME)
 
-def load_data():
+# HNSW graph parameters (Chroma's defaults): M is the number of neighbours per node,
+# ef_construction the candidate list while building and ef_search the candidate list per
+# query. Higher values raise recall at the cost of build time, memory and query latency.
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 100
+HNSW_EF_SEARCH = 100
+
+BATCH_SIZE = 1000
+# What gets embedded: one sentence per raw reading, or one pattern summary per day / day part
+DOCUMENT_MODES = ("readings", "daily", "day_parts")
+
+def _parse_timestamps(values):
     """
-    Loads smart meter data from .jsonl files, processes it into natural language sentences,
-    and extracts metadata.
+    Parses a batch of raw timestamp values in one vectorized call.
+    Unparseable values become NaT so the caller can skip them.
     """
-    print(f"Loading data from: {DATA_DIR}")
-    jsonl_files = glob.glob(os.path.join(DATA_DIR, "*.jsonl"))
-    
-    if not jsonl_files:
-        print("No .jsonl files found in the specified directory.")
-        return [], []
+    try:
+        return pd.to_datetime(pd.Series(values, dtype="object"), errors="coerce")
+    except ValueError:
+        # Mixed UTC offsets (e.g. across a DST switch) cannot share one dtype;
+        # normalise them to UTC first and convert back to local time.
+        parsed = pd.to_datetime(pd.Series(values, dtype="object"), errors="coerce", utc=True)
+        return parsed.dt.tz_convert("Europe/Amsterdam")
+
+def _to_epoch(timestamps):
+    """
+    Converts parsed timestamps to integer epoch seconds. Naive timestamps are local
+    (Europe/Amsterdam) wall-clock time, the same reading the date in the document
+    and the derived local fields get. The repeated hour when DST ends is inferred
+    from the order of the batch; when the batch cannot tell, it counts as summer time.
+    Times skipped when DST starts move forward to the first valid time.
+    """
+    if timestamps.dt.tz is None:
+        try:
+            timestamps = timestamps.dt.tz_localize(LOCAL_TZ, ambiguous="infer", nonexistent="shift_forward")
+        except ValueError:
+            timestamps = timestamps.dt.tz_localize(LOCAL_TZ, ambiguous=np.ones(len(timestamps), dtype=bool),
+                                                   nonexistent="shift_forward")
+    timestamps = timestamps.dt.tz_convert("UTC").dt.tz_localize(None)
+    return (timestamps - pd.Timestamp("1970-01-01")) // pd.Timedelta(seconds=1)
+
+def _derived_time_fields(epochs):
+    """
+    DST-correct local calendar fields per epoch, stored as metadata so Chroma can
+    filter on them directly (see tools.query_aggregator_batch). Computed once per batch.
+    """
+    valid = epochs.notna().to_numpy()
+    values = epochs.fillna(0).to_numpy(dtype="int64")
+    local = pd.to_datetime(values, unit='s', utc=True).tz_convert(LOCAL_TZ)
+    iso = local.isocalendar()
+    columns = zip(
+        local.strftime("%Y-%m-%d"),
+        local.hour,
+        local.weekday,
+        iso["year"].to_numpy(),
+        iso["week"].to_numpy(),
+        _time_of_day_buckets(values),
+    )
+    return [
+        {"local_date": date, "hour": int(hour), "weekday": int(weekday), "iso_year": int(iso_year),
+         "iso_week": int(week), "time_of_day": TIME_OF_DAY_BUCKETS[bucket]} if ok else {}
+        for ok, (date, hour, weekday, iso_year, week, bucket) in zip(valid, columns)
+    ]
+
+def _build_batch(raw_records):
+    """
+    Converts a list of (record, source_file) tuples into documents, metadatas and ids.
+    Timestamps are parsed and formatted once per batch instead of once per line.
+    """
+    timestamps = _parse_timestamps([record.get("timestamp") for record, _ in raw_records])
+    sentence_times = timestamps.dt.strftime('%Y-%m-%d at %H:%M')
+    dates = timestamps.dt.strftime("%Y-%m-%d")
+    epochs = _to_epoch(timestamps)
+    derived = _derived_time_fields(epochs)
 
     documents = []
     metadatas = []
     ids = []
-    
+    positions = {}
+
+    for i, (record, source_file) in enumerate(raw_records):
+        ts = timestamps.iat[i]
+        if pd.isna(ts):
+            print(f"Skipping line with invalid timestamp in {source_file}: {record.get('timestamp')!r}")
+            continue
+
+        data = record.get("data", {})
+
+        # Extract relevant data points
+        active_power = data.get("active_power_w")
+        power_import = data.get("total_power_import_kwh")
+        power_export = data.get("total_power_export_kwh")
+        gas_m3 = data.get("total_gas_m3")
+
+        # Create a natural language sentence
+        doc_parts = [f"On {sentence_times.iat[i]}"]
+        if power_import is not None:
+            doc_parts.append(f"the total power import was {power_import:.3f} kWh")
+        if power_export is not None:
+            doc_parts.append(f"the total power export was {power_export:.3f} kWh")
+        if gas_m3 is not None:
+            doc_parts.append(f"and the total gas consumption was {gas_m3:.3f} m3")
+
+        document = ", ".join(doc_parts) + "."
+
+        # Create metadata
+        metadata = {
+            "timestamp": str(ts),
+            "epoch": int(epochs.iat[i]),
+            "source_file": source_file,
+            "date": dates.iat[i] # Added date for filtering
+        }
+        if active_power is not None:
+            metadata["active_power_w"] = active_power
+        if power_import is not None:
+            metadata["power_import_kwh"] = power_import
+        if power_export is not None:
+            metadata["power_export_kwh"] = power_export
+        if gas_m3 is not None:
+            metadata["gas_m3"] = gas_m3
+        metadata.update(derived[i])
+        if active_power is not None:
+            metadata["power_sign"] = (active_power > 0) - (active_power < 0) # 1 consumption, -1 production
+
+        record_id = f"rec_{int(epochs.iat[i])}"
+        if record_id in positions:
+            documents[positions[record_id]] = document
+            metadatas[positions[record_id]] = metadata
+            continue
+
+        positions[record_id] = len(ids)
+        documents.append(document)
+        metadatas.append(metadata)
+        ids.append(record_id)
+
+    return documents, metadatas, ids
+
+def parse_line(line, source_file, line_number):
+    """Decodes one P1 log line; malformed lines are reported, counted and returned as None."""
+    try:
+        record = ujson.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError("record is not a JSON object")
+        return record
+    except ValueError as e:
+        print(f"Skipping malformed line {line_number} in {source_file}: {e}")
+        count("ingest_malformed_lines")
+        return None
+
+def iter_record_batches(batch_size=BATCH_SIZE, manifest=None, data_dir=None):
+    """
+    Streams smart meter data from .jsonl files and yields (documents, metadatas, ids)
+    batches of at most `batch_size` records, so memory stays bounded by one batch
+    regardless of how much history is on disk.
+
+    When a `manifest` is given, each file is read from the byte offset where the
+    previous run stopped, unchanged files are skipped, and the manifest is advanced
+    just before a batch is yielded. A trailing line without a newline is left for the
+    next run, since the logger may still be writing it. `data_dir` defaults to DATA_DIR.
+    """
+    data_dir = data_dir or DATA_DIR
+    print(f"Loading data from: {data_dir}")
+    jsonl_files = sorted(glob.glob(os.path.join(data_dir, "*.jsonl")))
+
+    if not jsonl_files:
+        print("No .jsonl files found in the specified directory.")
+        return
+
+    raw_records = []
+    pending_positions = {}
+
+    def advance_manifest():
+        if manifest is not None:
+            for path, (offset, lines) in pending_positions.items():
+                record_position(manifest, path, offset, lines)
+        pending_positions.clear()
+
     for file_path in jsonl_files:
-        with open(file_path, 'r') as f:
+        source_file = os.path.basename(file_path)
+        offset, line_count = 0, 0
+        if manifest is not None:
+            position = resume_position(manifest, file_path)
+            if position is None:
+                continue
+            offset, line_count = position
+
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
             for line in f:
-                try:
-                    record = ujson.loads(line)
-                    ts = pd.to_datetime(record.get("timestamp"))
-                    data = record.get("data", {})
-
-                    # Extract relevant data points
-                    power_import = data.get("total_power_import_kwh")
-                    power_export = data.get("total_power_export_kwh")
-                    gas_m3 = data.get("total_gas_m3")
-
-                    # Create a natural language sentence
-                    doc_parts = [f"On {ts.strftime('%Y-%m-%d at %H:%M')}"]
-                    if power_import is not None:
-                        doc_parts.append(f"the total power import was {power_import:.3f} kWh")
-                    if power_export is not None:
-                        doc_parts.append(f"the total power export was {power_export:.3f} kWh")
-                    if gas_m3 is not None:
-                        doc_parts.append(f"and the total gas consumption was {gas_m3:.3f} m3")
-                    
-                    document = ", ".join(doc_parts) + "."
-                    
-                    # Create metadata
-                    metadata = {
-                        "timestamp": str(ts),
-                        "source_file": os.path.basename(file_path),
-                        "date": ts.strftime("%Y-%m-%d") # Added date for filtering
-                    }
-                    if power_import is not None:
-                        metadata["power_import_kwh"] = power_import
-                    if power_export is not None:
-                        metadata["power_export_kwh"] = power_export
-                    if gas_m3 is not None:
-                        metadata["gas_m3"] = gas_m3
-
-                    documents.append(document)
-                    metadatas.append(metadata)
-                    ids.append(f"rec_{{ts.strftime('%Y%m%d%H%M%S')}}_{len(ids)}")
-
-                except (ValueError, KeyError) as e:
-                    print(f"Skipping malformed line in {os.path.basename(file_path)}: {e}")
+                if not line.endswith(b"\n"):
+                    break # Partial line, still being written
+                offset += len(line)
+                line_count += 1
+                pending_positions[file_path] = (offset, line_count)
+
+                record = parse_line(line, source_file, line_count)
+                if record is None:
+                    continue
+
+                raw_records.append((record, source_file))
+                if len(raw_records) >= batch_size:
+                    with timer("ingest_stage", stage="parse"):
+                        batch = _build_batch(raw_records)
+                    count("ingest_records", len(batch[2]))
+                    raw_records = []
+                    advance_manifest()
+                    yield batch
+
+    if raw_records:
+        with timer("ingest_stage", stage="parse"):
+            batch = _build_batch(raw_records)
+        count("ingest_records", len(batch[2]))
+        advance_manifest()
+        yield batch
+    advance_manifest()
+
+def store_numeric_readings(batches, store):
+    """
+    Passes batches through unchanged while appending their numeric readings to the
+    columnar store, which serves range aggregations in tools.query_aggregator.
+    """
+    for documents, metadatas, ids in batches:
+        if metadatas:
+            with timer("ingest_stage", stage="numeric_store_append"):
+                store.append({
+                    "epoch": [metadata["epoch"] for metadata in metadatas],
+                    "active_power_w": [metadata.get("active_power_w") for metadata in metadatas],
+                    "total_power_import_kwh": [metadata.get("power_import_kwh") for metadata in metadatas],
+                    "total_power_export_kwh": [metadata.get("power_export_kwh") for metadata in metadatas],
+                    "total_gas_m3": [metadata.get("gas_m3") for metadata in metadatas],
+                })
+        yield documents, metadatas, ids
+
+def load_data():
+    """
+    Loads smart meter data from .jsonl files, processes it into natural language sentences,
+    and extracts metadata. Materialises every batch from iter_record_batches in memory;
+    prefer the generator for large histories.
+    """
+    documents = []
+    metadatas = []
+    ids = []
+
+    for batch_docs, batch_metas, batch_ids in iter_record_batches():
+        documents.extend(batch_docs)
+        metadatas.extend(batch_metas)
+        ids.extend(batch_ids)
 
     print(f"Loaded {len(documents)} records.")
     return documents, metadatas, ids
 
-def setup_chroma_db():
+def hnsw_metadata(m=None, ef_construction=None, ef_search=None):
+    """Collection metadata for the cosine HNSW index; unset parameters fall back to the constants."""
+    return {
+        "hnsw:space": "cosine",
+        "hnsw:M": m or HNSW_M,
+        "hnsw:construction_ef": ef_construction or HNSW_EF_CONSTRUCTION,
+        "hnsw:search_ef": ef_search or HNSW_EF_SEARCH,
+    }
+
+def set_search_ef(collection, ef_search):
+    """
+    Changes ef_search on an existing collection. M and ef_construction are fixed once
+    the graph is built; changing those needs a rebuild.
+    """
+    try:
+        collection.modify(configuration={"hnsw": {"ef_search": ef_search}})
+    except TypeError:
+        # Chroma before 1.0 keeps the HNSW parameters in the collection metadata only
+        collection.modify(metadata={**(collection.metadata or {}), "hnsw:search_ef": ef_search})
+
+def setup_chroma_db(rebuild=False, hnsw=None, backend=EMBEDDING_BACKEND, path=None, name=None):
     """
     Initializes the ChromaDB client and creates/gets the collection.
+    The existing collection is kept unless `rebuild` is set.
+    `hnsw` optionally overrides the index parameters, as keyword arguments of hnsw_metadata;
+    `backend` selects the inference backend of the embedding model (see embedding_backend).
+    `path` and `name` default to CHROMA_DB_PATH and COLLECTION_NAME (shards.py opens per-meter collections).
     """
+    path = path or CHROMA_DB_PATH
+    name = name or COLLECTION_NAME
     print("Setting up ChromaDB...")
     # 1. Initialize ChromaDB client
-    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    client = chromadb.PersistentClient(path=path)
 
-    # Check if collection exists and delete it to ensure fresh indexing
-    try:
-        client.delete_collection(name=COLLECTION_NAME)
-        print(f"Existing collection '{COLLECTION_NAME}' deleted.")
-    except:
-        print(f"Collection '{COLLECTION_NAME}' does not exist or could not be deleted (first run).")
-        pass # Collection does not exist, no need to delete
-
-    # 2. Create an embedding function
-    embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=EMBEDDING_MODEL
+    # Only drop the collection when a full re-index is requested
+    if rebuild:
+        try:
+            client.delete_collection(name=name)
+            print(f"Existing collection '{name}' deleted.")
+        except Exception:
+            print(f"Collection '{name}' does not exist or could not be deleted (first run).")
+
+    # 2. Create an embedding function, backed by the on-disk embedding cache
+    embedding_function = CachedEmbeddingFunction(
+        embedding_function_class(backend),
+        model_name=EMBEDDING_MODEL,
+        cache_dir=EMBEDDING_CACHE_PATH,
+        cache_name=cache_name(EMBEDDING_MODEL, backend)
     )
 
     # 3. Get or create the collection
+    hnsw = hnsw or {}
+    metadata = hnsw_metadata(**hnsw)
     collection = client.get_or_create_collection(
-        name=COLLECTION_NAME,
+        name=name,
         embedding_function=embedding_function,
-        metadata={"hnsw:space": "cosine"} # Specify the distance metric
+        metadata=metadata # Cosine distance and the HNSW graph parameters
     )
-    print(f"Collection '{COLLECTION_NAME}' is ready.")
+
+    # An existing collection keeps the graph it was built with; only ef_search can change
+    current = collection.metadata or {}
+    configured = (getattr(collection, "configuration_json", None) or {}).get("hnsw") or {}
+    if hnsw.get("ef_search") and configured.get("ef_search", current.get("hnsw:search_ef")) != hnsw["ef_search"]:
+        set_search_ef(collection, hnsw["ef_search"])
+        print(f"HNSW ef_search set to {hnsw['ef_search']}.")
+    for key, metadata_key, config_name in (("m", "hnsw:M", "max_neighbors"), ("ef_construction", "hnsw:construction_ef", "ef_construction")):
+        built = configured.get(config_name, current.get(metadata_key, metadata[metadata_key]))
+        if hnsw.get(key) and built != hnsw[key]:
+            print(f"Collection was built with {metadata_key}={built}; use --rebuild to change it.")
+    print(f"Collection '{name}' is ready.")
     return collection
 
-def main():
+def index_daily_patterns(collection, batches, store, per_day_part=False, workers=0, vector_index=None,
+                         backend=EMBEDDING_BACKEND):
     """
-    Main function to load data, setup ChromaDB, and index the data.
+    Stores the raw readings as numeric data only and embeds one pattern document per
+    day (or per day part) instead. Every local day that received new readings is
+    summarised again from the numeric store, so a partly logged day is completed
+    on the next run. Days are profiled one local month at a time, so a first run or
+    a rebuild never holds the whole history in memory.
     """
-    # Step 1: Load and process data
-    documents, metadatas, ids = load_data()
+    first_epoch = None
+    for _, metadatas, _ in store_numeric_readings(batches, store):
+        if metadatas:
+            batch_first = min(metadata["epoch"] for metadata in metadatas)
+            first_epoch = batch_first if first_epoch is None else min(first_epoch, batch_first)
+    if first_epoch is None:
+        return {"batches": 0, "documents": 0, "embedded": 0, "cached": 0, "seconds": 0.0, "docs_per_sec": 0.0}
 
-    if not documents:
-        print("No documents to process. Exiting.")
-        return
+    return run_pipeline(
+        collection,
+        iter_pattern_batches(iter_pattern_readings(store, local_day_start(first_epoch)), per_day_part=per_day_part),
+        EMBEDDING_MODEL,
+        workers=workers,
+        cache_dir=EMBEDDING_CACHE_PATH,
+        vector_index=vector_index,
+        backend=backend
+    )
+
+def run_indexing(rebuild=False, workers=0, batch_size=BATCH_SIZE, documents="readings", hnsw=None,
+                 quantized_index=None, backend=EMBEDDING_BACKEND):
+    """
+    Streams new data into ChromaDB and the derived stores.
+    Only records appended since the previous run are parsed; parsing, embedding and
+    writing run as overlapping pipeline stages (see ingest_pipeline.run_pipeline).
+    With `documents` set to 'daily' or 'day_parts' only pattern summaries are embedded
+    (see index_daily_patterns). `hnsw` overrides the HNSW parameters (see setup_chroma_db);
+    `quantized_index` ('int8' or 'float16') also writes every embedding to the in-process
+    vector index (see vector_index.QuantizedIndex). `backend` selects the embedding
+    inference backend (see embedding_backend). Returns the pipeline stats, or None
+    when there was nothing new to index.
+    """
+    if documents not in DOCUMENT_MODES:
+        raise ValueError(f"Invalid documents mode: {documents}")
+    manifest = load_manifest(MANIFEST_PATH)
+    if rebuild:
+        manifest = empty_manifest(manifest.get("generation", 0))
+
+    # Step 1: Start streaming and process new data
+    batches = iter_record_batches(batch_size, manifest=manifest)
+    first_batch = next(batches, None)
+
+    if first_batch is None:
+        # A rebuild without data leaves the old collection, so keep its manifest too
+        if not rebuild:
+            save_manifest(manifest, MANIFEST_PATH)
+        print("No new documents to process. Exiting.")
+        return None
 
     # Step 2: Setup ChromaDB
-    collection = setup_chroma_db()
-
-    # Step 3: Add data to the collection in batches
-    batch_size = 1000
-    for i in range(0, len(documents), batch_size):
-        batch_docs = documents[i:i+batch_size]
-        batch_metas = metadatas[i:i+batch_size]
-        batch_ids = ids[i:i+batch_size]
-        
-        print(f"Adding batch {i//batch_size + 1} of {len(documents)//batch_size + 1} to ChromaDB...")
-        collection.add(
-            documents=batch_docs,
-            metadatas=batch_metas,
-            ids=batch_ids
+    collection = setup_chroma_db(rebuild=rebuild, hnsw=hnsw, backend=backend)
+    vector_index = None
+    if quantized_index:
+        if rebuild:
+            shutil.rmtree(VECTOR_INDEX_PATH, ignore_errors=True)
+        vector_index = QuantizedIndex(VECTOR_INDEX_PATH, dtype=quantized_index)
+
+    # Step 3: Parse, embed and upsert the batches as a pipeline;
+    # the numeric readings also go to the columnar store for aggregations
+    store = NumericStore(NUMERIC_STORE_PATH)
+    if documents == "readings":
+        stats = run_pipeline(
+            collection,
+            store_numeric_readings(itertools.chain([first_batch], batches), store),
+            EMBEDDING_MODEL,
+            workers=workers,
+            manifest=manifest,
+            save_manifest=lambda snapshot: save_manifest(snapshot, MANIFEST_PATH),
+            cache_dir=EMBEDDING_CACHE_PATH,
+            vector_index=vector_index,
+            backend=backend
         )
+    else:
+        # The manifest is only saved once the day documents are stored; re-reading
+        # readings after a crash is harmless, since the store deduplicates epochs
+        stats = index_daily_patterns(collection, itertools.chain([first_batch], batches), store,
+                                     per_day_part=(documents == "day_parts"), workers=workers,
+                                     vector_index=vector_index, backend=backend)
+    save_manifest(manifest, MANIFEST_PATH)
+
+    # Step 4: Bring the hour/day/week/month rollups up to date with the new readings
+    if rebuild:
+        if os.path.exists(ROLLUP_STATE_PATH):
+            os.remove(ROLLUP_STATE_PATH)
+        shutil.rmtree(os.path.join(CHROMA_DB_PATH, TOPK_INDEX_DIRNAME), ignore_errors=True)
+    # Readings written before the open periods (late or re-read files) pull the recompute back
+    written = store.take_written()
+    with timer("ingest_stage", stage="rollups"):
+        since_epoch = rollup_cutoff(load_rollup_state(ROLLUP_STATE_PATH), written)
+        update_rollups(collection, load_store_readings(store, since_epoch), ROLLUP_STATE_PATH, written)
+
+    # Step 5: Record what was written only now that every derived store is up to date,
+    # so cached query results over the written range are invalidated (see result_cache)
+    bounds = store.bounds()
+    if bounds is not None:
+        manifest["watermark"] = bounds[1]
+        record_ingest(manifest, written)
+        save_manifest(manifest, MANIFEST_PATH)
 
     print("\n--- Indexing Complete ---")
+    print(f"Documents upserted this run: {stats['documents']} "
+          f"({stats['embedded']} embedded, {stats['cached']} from cache)")
+    print(f"Throughput: {stats['docs_per_sec']:.0f} docs/sec over {stats['seconds']:.1f} s with {workers} worker(s)")
     print(f"Total documents indexed: {collection.count()}")
     print(f"ChromaDB database stored at: {CHROMA_DB_PATH}")
+    return stats
+
+def main():
+    """Main function to stream new data into ChromaDB."""
+    parser = argparse.ArgumentParser(description="Index smart meter data into ChromaDB.")
+    parser.add_argument("--rebuild", action="store_true", help="Drop the collection and re-index all files.")
+    parser.add_argument("--workers", type=int, default=0, help="Embedding worker processes (0 = one in-process thread).")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Documents per parse/embed/write batch.")
+    parser.add_argument("--documents", choices=DOCUMENT_MODES, default="readings",
+                        help="Embed one sentence per reading, or one pattern summary per day or day part.")
+    parser.add_argument("--hnsw-m", type=int, default=None, help=f"HNSW neighbours per node (default {HNSW_M}; needs --rebuild to change).")
+    parser.add_argument("--hnsw-ef-construction", type=int, default=None,
+                        help=f"HNSW build candidate list (default {HNSW_EF_CONSTRUCTION}; needs --rebuild to change).")
+    parser.add_argument("--hnsw-ef-search", type=int, default=None, help=f"HNSW query candidate list (default {HNSW_EF_SEARCH}).")
+    parser.add_argument("--quantized-index", choices=[dtype for dtype in DTYPES if dtype != "float32"], default=None,
+                        help="Also keep the embeddings in a quantized in-process index for brute-force search.")
+    parser.add_argument("--embedding-backend", choices=BACKENDS, default=EMBEDDING_BACKEND,
+                        help="Run the embedding model on PyTorch, ONNX Runtime, or ONNX Runtime with int8 weights.")
+    parser.add_argument("--follow", action="store_true",
+                        help="After indexing, keep tailing the log directory and index new readings in micro-batches (see follower.py).")
+    parser.add_argument("--metrics", type=str, default=None, help="Write stage timings to this file (.prom text or .jsonl).")
+    parser.add_argument("--profile", type=str, default=None, help="Write a cProfile dump of the run to this directory.")
+    args = parser.parse_args()
+    if args.follow and (args.documents != "readings" or args.quantized_index):
+        parser.error("--follow writes reading documents to the collection only.")
+    hnsw = {"m": args.hnsw_m, "ef_construction": args.hnsw_ef_construction, "ef_search": args.hnsw_ef_search}
+
+    if args.profile:
+        enable_profiling(args.profile)
+    with profiled("run_indexing"):
+        run_indexing(rebuild=args.rebuild, workers=args.workers, batch_size=args.batch_size, documents=args.documents,
+                     hnsw=hnsw, quantized_index=args.quantized_index, backend=args.embedding_backend)
+    if args.follow:
+        from follower import follow
+        follow(hnsw=hnsw, backend=args.embedding_backend)
+    if args.metrics:
+        METRICS.export(args.metrics, command="index")
+        print(f"Metrics written to {args.metrics}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,171 @@
+import os
+import time
+import ujson
+import cProfile
+import threading
+from contextlib import contextmanager
+
+# --- Constants ---
+PREFIX = "smartmeter_"
+# Opt-in hooks, also settable from code with enable_profiling() / enable_tracing()
+PROFILE_DIR_ENV = "SMARTMETER_PROFILE_DIR"
+TRACE_PATH_ENV = "SMARTMETER_TRACE_PATH"
+
+class Metrics:
+    """
+    In-process registry of counters and timers, cheap enough to wrap every batch or chunk.
+
+    Timers keep count, total and max seconds per (name, labels); counters keep a
+    running total. A snapshot can be written as a Prometheus text file (for the
+    node_exporter textfile collector) or appended as one JSON line per export.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Times the block; the duration is also written as a trace span when tracing is enabled."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(name, seconds, **labels)
+            if _trace_path is not None:
+                _write_span(name, labels, seconds)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def snapshot(self):
+        """Returns {'counters': [...], 'timers': [...]} with plain dicts, safe to serialise."""
+        with self._lock:
+            return {
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "timers": [{"name": name, "labels": dict(labels), "count": count, "sum_s": total, "max_s": longest}
+                           for (name, labels), (count, total, longest) in sorted(self.timers.items())],
+            }
+
+    def to_prometheus(self):
+        """Renders the registry in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        families = {} # metric -> (type, sample lines); every family is written as one block
+
+        def sample(metric, kind, line):
+            families.setdefault(metric, (kind, []))[1].append(line)
+
+        for counter in snapshot["counters"]:
+            metric = f"{PREFIX}{counter['name']}_total"
+            sample(metric, "counter", f"{metric}{_labels(counter['labels'])} {counter['value']}")
+        for timer in snapshot["timers"]:
+            metric = f"{PREFIX}{timer['name']}_seconds"
+            labels = _labels(timer['labels'])
+            sample(metric, "summary", f"{metric}_count{labels} {timer['count']}")
+            sample(metric, "summary", f"{metric}_sum{labels} {timer['sum_s']:.6f}")
+            sample(f"{metric}_max", "gauge", f"{metric}_max{labels} {timer['max_s']:.6f}")
+
+        lines = []
+        for metric, (kind, samples) in families.items():
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Writes the text file atomically, so a scraper never reads half a file."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def append_jsonl(self, path, **context):
+        """Appends the current snapshot as one JSON line, tagged with a timestamp and `context`."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        record = {"time": time.time(), **context, **self.snapshot()}
+        with open(path, 'a') as f:
+            f.write(ujson.dumps(record) + "\n")
+
+    def export(self, path, **context):
+        """Exports by file extension: '.jsonl' appends a JSON line, anything else is Prometheus text."""
+        if path.endswith(".jsonl"):
+            self.append_jsonl(path, **context)
+        else:
+            self.write_prometheus(path)
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+# Process-wide registry used by the ingest and query code
+METRICS = Metrics()
+timer = METRICS.timer
+count = METRICS.count
+
+# --- Opt-in tracing and profiling ---
+_trace_path = os.environ.get(TRACE_PATH_ENV) or None
+_trace_lock = threading.Lock()
+_profile_dir = os.environ.get(PROFILE_DIR_ENV) or None
+_profiling = threading.local()
+
+def enable_tracing(path):
+    """Writes every timed block as a JSON line span (name, labels, thread, end time, duration); None disables."""
+    global _trace_path
+    _trace_path = path
+
+def _write_span(name, labels, seconds):
+    span = {"name": name, "labels": labels, "thread": threading.current_thread().name,
+            "end": time.time(), "duration_s": seconds}
+    with _trace_lock:
+        with open(_trace_path, 'a') as f:
+            f.write(ujson.dumps(span) + "\n")
+
+def enable_profiling(directory):
+    """Profiles every `profiled` block with cProfile into `directory`; None disables."""
+    global _profile_dir
+    _profile_dir = directory
+
+@contextmanager
+def profiled(name):
+    """
+    Runs the block under cProfile when profiling is enabled and dumps the stats to
+    '<dir>/<name>-<time>.prof' (open with `python -m pstats` or snakeviz).
+    Nested blocks are folded into the outermost profile.
+    """
+    if _profile_dir is None or getattr(_profiling, "active", False):
+        yield
+        return
+    profiler = cProfile.Profile()
+    _profiling.active = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _profiling.active = False
+        os.makedirs(_profile_dir, exist_ok=True)
+        path = os.path.join(_profile_dir, f"{name}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        print(f"Profile written to {path}")
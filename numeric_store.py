@@ -0,0 +1,191 @@
+import os
+import re
+import shutil
+import numpy as np
+
+# --- Constants ---
+NUMERIC_STORE_PATH = os.path.join(os.getcwd(), "numeric_store")
+PARTITION_PATTERN = re.compile(r"^\d{4}-\d{2}$")
+
+# Column name -> on-disk dtype. Cumulative counters need float64 to keep watt-hour resolution.
+COLUMNS = {
+    "epoch": np.dtype("int64"),
+    "active_power_w": np.dtype("float32"),
+    "total_power_import_kwh": np.dtype("float64"),
+    "total_power_export_kwh": np.dtype("float64"),
+    "total_gas_m3": np.dtype("float64"),
+}
+
+def partition_of(epochs):
+    """Returns the monthly partition name ('YYYY-MM', UTC) for each epoch."""
+    months = np.asarray(epochs, dtype="int64").astype("datetime64[s]").astype("datetime64[M]")
+    return np.datetime_as_string(months, unit="M")
+
+class NumericStore:
+    """
+    Sorted, memory-mapped columnar store for the numeric meter readings.
+
+    Each month is a directory with one raw binary file per column, all sorted by
+    epoch. Range queries binary-search the epoch column and return memmap slices,
+    so nothing is copied until the caller touches the values. Missing readings are
+    stored as NaN. Epochs are unique: re-appending a reading overwrites it.
+    """
+    def __init__(self, path=NUMERIC_STORE_PATH):
+        self.path = path
+        self.written = None # (first, last) epoch appended through this instance, see take_written
+
+    def take_written(self):
+        """Returns the (first, last) epoch range appended since the previous call, or None, and resets it."""
+        written, self.written = self.written, None
+        return written
+
+    def partitions(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            name for name in os.listdir(self.path)
+            if PARTITION_PATTERN.match(name) and os.path.isdir(os.path.join(self.path, name))
+        )
+
+    def _column_path(self, partition, column):
+        return os.path.join(self.path, partition, f"{column}.bin")
+
+    def _rows(self, partition):
+        """Number of complete rows; a torn append leaves some columns longer than others."""
+        sizes = []
+        for column, dtype in COLUMNS.items():
+            column_path = self._column_path(partition, column)
+            sizes.append(os.path.getsize(column_path) // dtype.itemsize if os.path.exists(column_path) else 0)
+        return min(sizes)
+
+    def _open(self, partition, columns, rows=None):
+        rows = self._rows(partition) if rows is None else rows
+        if rows == 0:
+            return {column: np.empty(0, dtype=COLUMNS[column]) for column in columns}
+        return {
+            column: np.memmap(self._column_path(partition, column), dtype=COLUMNS[column], mode='r', shape=(rows,))
+            for column in columns
+        }
+
+    def __len__(self):
+        return sum(self._rows(partition) for partition in self.partitions())
+
+    def bounds(self):
+        """Returns (first_epoch, last_epoch) stored, or None when the store is empty."""
+        first = last = None
+        for partition in self.partitions():
+            epochs = self._open(partition, ["epoch"])["epoch"]
+            if len(epochs):
+                first = int(epochs[0]) if first is None else first
+                last = int(epochs[-1])
+        return None if first is None else (first, last)
+
+    def first_epoch(self):
+        """The oldest epoch stored, or None when empty; only months up to the first non-empty one are opened."""
+        for partition in self.partitions():
+            epochs = self._open(partition, ["epoch"])["epoch"]
+            if len(epochs):
+                return int(epochs[0])
+        return None
+
+    def append(self, columns):
+        """
+        Adds readings given as {column: values}; `epoch` is required, other columns
+        default to NaN. In-order data is appended to the column files directly;
+        out-of-order or duplicate epochs trigger a sorted rewrite of that month only.
+        """
+        epochs = np.asarray(columns["epoch"], dtype="int64")
+        if not len(epochs):
+            return
+        values = {
+            column: np.asarray(columns.get(column, np.full(len(epochs), np.nan)), dtype=dtype)
+            for column, dtype in COLUMNS.items() if column != "epoch"
+        }
+        values["epoch"] = epochs
+        first, last = int(epochs.min()), int(epochs.max())
+        self.written = (first, last) if self.written is None else (min(self.written[0], first), max(self.written[1], last))
+
+        order = np.argsort(epochs, kind="stable")
+        values = {column: array[order] for column, array in values.items()}
+        partitions = partition_of(values["epoch"])
+        boundaries = np.flatnonzero(partitions[1:] != partitions[:-1]) + 1
+
+        for chunk in np.split(np.arange(len(partitions)), boundaries):
+            self._append_partition(partitions[chunk[0]], {column: array[chunk] for column, array in values.items()})
+
+    def _append_partition(self, partition, values):
+        os.makedirs(os.path.join(self.path, partition), exist_ok=True)
+        rows = self._rows(partition)
+        existing = self._open(partition, list(COLUMNS), rows)
+        new_epochs = values["epoch"]
+        in_order = len(np.unique(new_epochs)) == len(new_epochs) and (rows == 0 or new_epochs[0] > existing["epoch"][-1])
+
+        if in_order:
+            # Fast path: truncate any torn tail and append; epoch goes last so it defines the row count
+            for column in [c for c in COLUMNS if c != "epoch"] + ["epoch"]:
+                with open(self._column_path(partition, column), 'ab') as f:
+                    f.truncate(rows * COLUMNS[column].itemsize)
+                    f.write(values[column].tobytes())
+            return
+
+        merged = {column: np.concatenate([np.asarray(existing[column]), values[column]]) for column in COLUMNS}
+        del existing
+        # Stable sort, then keep the last occurrence of every epoch (new values win)
+        order = np.argsort(merged["epoch"], kind="stable")
+        merged = {column: array[order] for column, array in merged.items()}
+        keep = np.append(merged["epoch"][1:] != merged["epoch"][:-1], True)
+        for column in COLUMNS:
+            tmp_path = self._column_path(partition, column) + ".tmp"
+            merged[column][keep].tofile(tmp_path)
+            os.replace(tmp_path, self._column_path(partition, column))
+
+    def remove_before(self, epoch):
+        """Deletes every reading older than `epoch`: whole months are dropped, the boundary month is rewritten."""
+        removed = 0
+        for partition in self.partitions():
+            data = self._open(partition, list(COLUMNS))
+            keep_from = int(np.searchsorted(data["epoch"], epoch, side="left"))
+            if keep_from == 0:
+                continue
+            removed += keep_from
+            if keep_from == len(data["epoch"]):
+                del data
+                shutil.rmtree(os.path.join(self.path, partition))
+                continue
+            kept = {column: np.array(array[keep_from:]) for column, array in data.items()}
+            del data
+            for column in COLUMNS:
+                tmp_path = self._column_path(partition, column) + ".tmp"
+                kept[column].tofile(tmp_path)
+                os.replace(tmp_path, self._column_path(partition, column))
+        return removed
+
+    def iter_range(self, start_epoch, end_epoch, columns):
+        """
+        Yields {column: memmap slice} per month for readings with
+        start_epoch <= epoch <= end_epoch. Slices are views; no data is copied.
+        """
+        columns = list(dict.fromkeys(["epoch"] + list(columns)))
+        first, last = partition_of([start_epoch, end_epoch])
+        for partition in self.partitions():
+            if partition < first or partition > last:
+                continue
+            data = self._open(partition, columns)
+            lo = np.searchsorted(data["epoch"], start_epoch, side="left")
+            hi = np.searchsorted(data["epoch"], end_epoch, side="right")
+            if hi > lo:
+                yield {column: array[lo:hi] for column, array in data.items()}
+
+    def count_range(self, start_epoch, end_epoch):
+        """Number of readings in the range, from the binary searches alone."""
+        return sum(len(part["epoch"]) for part in self.iter_range(start_epoch, end_epoch, []))
+
+    def read_range(self, start_epoch, end_epoch, columns):
+        """Returns the readings in the range as {column: array}, concatenated over months."""
+        parts = list(self.iter_range(start_epoch, end_epoch, columns))
+        columns = list(dict.fromkeys(["epoch"] + list(columns)))
+        if not parts:
+            return {column: np.empty(0, dtype=COLUMNS[column]) for column in columns}
+        if len(parts) == 1:
+            return parts[0]
+        return {column: np.concatenate([part[column] for part in parts]) for column in columns}
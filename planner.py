@@ -0,0 +1,242 @@
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from metrics import METRICS
+from smart_database import ROLLUP_LEVELS
+
+# --- Constants ---
+# Cost of touching one row in each source, relative to one metadata row paged out of Chroma
+ROW_COST = {
+    "topk_index": 0.001,    # bounded pre-sorted JSON list, already in memory
+    "rollup_scan": 1.0,     # paged Chroma get with a metadata filter
+    "raw_readings": 0.02,   # memmap slices, rollups recomputed with pandas
+    "numeric_store": 0.01,  # memmap slices folded with NumPy
+    "summary_tiers": 0.05,  # compacted summary rows, merged in pandas
+    "chroma_readings": 1.0, # per-reading documents paged out of Chroma
+}
+# Fixed cost per request: opening files or one Chroma round trip, in the same units
+FIXED_COST = {
+    "topk_index": 50,
+    "rollup_scan": 100,
+    "raw_readings": 200,
+    "numeric_store": 20,
+    "chroma_readings": 100,
+}
+PERIOD_PADDING = 7 * 86400 # see query_ai.ChromaManager._top_from_readings
+
+def _cost(source, rows):
+    return FIXED_COST.get(source, 0) + rows * ROW_COST[source]
+
+def _rows_scanned():
+    """Rows read so far in this process, summed over every source (see the query_rows_scanned counters)."""
+    return sum(value for (name, _), value in list(METRICS.counters.items()) if name == "query_rows_scanned")
+
+def _year_range(year):
+    start = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
+    return start, int(datetime(year, 12, 31, 23, 59, 59, tzinfo=timezone.utc).timestamp())
+
+class Planner:
+    """
+    Turns parsed intents (see query_ai.QueryParser) into execution plans.
+
+    Every source that can answer the intent exactly is costed from cheap statistics
+    - top-K index entries per year, binary searches on the numeric store, compaction
+    horizons - and the cheapest one is chosen. Sources that would only approximate the
+    answer are listed with the reason they were rejected. Statistics are gathered once
+    per planner; call refresh() after new data is ingested.
+    """
+    def __init__(self, chroma_manager, tools_module=None):
+        import tools
+        self.manager = chroma_manager
+        self.tools = tools_module or tools
+        self._stats = None
+
+    def refresh(self):
+        self._stats = None
+
+    # --- Statistics ---
+    def statistics(self) -> Dict[str, Any]:
+        if self._stats is None:
+            self._stats = self._collect_statistics()
+        return self._stats
+
+    def _collect_statistics(self):
+        import compaction
+        from numeric_store import NumericStore
+        from topk_index import ALL_YEARS, ORDERS, index_path, load_index
+        stats = {"rollups": {}}
+
+        store_path = self.manager.numeric_store_path
+        store = NumericStore(store_path)
+        stats["store_bounds"] = store.bounds()
+        stats["raw_from"] = compaction.coverage(store_path)[0]
+
+        tools_store = NumericStore(self.tools.NUMERIC_STORE_PATH)
+        stats["tools_store"] = tools_store if compaction.has_data(self.tools.NUMERIC_STORE_PATH) else None
+
+        for level in ROLLUP_LEVELS:
+            indexes = {}
+            for order in ORDERS:
+                index = load_index(index_path(self.manager.chroma_path, self.manager.collection.name, level, order))
+                if index:
+                    indexes[order] = index
+            if indexes:
+                periods = next(iter(indexes.values()))["periods"]
+                years = {int(scope): n for scope, n in periods.items() if scope != ALL_YEARS}
+                stats["rollups"][level] = {"indexes": indexes, "total": periods.get(ALL_YEARS, 0), "years": years}
+        try:
+            stats["collection_count"] = self.manager.collection.count()
+        except Exception:
+            stats["collection_count"] = None
+        return stats
+
+    def _periods_in_year(self, level, year):
+        rollups = self.statistics()["rollups"].get(level)
+        if rollups is None:
+            return None
+        return rollups["total"] if year is None else rollups["years"].get(year, 0)
+
+    # --- Planning ---
+    def plan(self, parsed: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Returns {'intent', 'params', 'source', 'estimated_rows', 'estimated_cost', 'candidates'}."""
+        if not parsed:
+            candidates = [{"source": "semantic_retrieval", "exact": False, "estimated_rows": None, "estimated_cost": None,
+                           "reason": "no structured intent; answered from retrieved documents"}]
+            return {"intent": "semantic", "params": {}, "source": "semantic_retrieval",
+                    "estimated_rows": None, "estimated_cost": None, "candidates": candidates}
+        if parsed["intent"] == "analytical":
+            candidates = self._analytical_candidates(**parsed["params"])
+        elif parsed["intent"] == "aggregate":
+            candidates = self._aggregate_candidates(**parsed["params"])
+        else:
+            raise ValueError(f"Unknown intent: {parsed['intent']}")
+
+        usable = [candidate for candidate in candidates if candidate["exact"] and candidate["estimated_cost"] is not None]
+        if not usable:
+            raise ValueError("No source can answer this question exactly: "
+                             + "; ".join(f"{c['source']}: {c['reason']}" for c in candidates))
+        best = min(usable, key=lambda candidate: candidate["estimated_cost"])
+        return {"intent": parsed["intent"], "params": parsed["params"], "source": best["source"],
+                "estimated_rows": best["estimated_rows"], "estimated_cost": best["estimated_cost"],
+                "candidates": candidates}
+
+    def _analytical_candidates(self, level, year, sort_by, order, limit):
+        from topk_index import index_entries_walked, top_ids_from_index
+        stats = self.statistics()
+        rollups = stats["rollups"].get(level)
+        matching = self._periods_in_year(level, year)
+        candidates = []
+
+        index = rollups["indexes"].get(order) if rollups else None
+        if index and sort_by in index["keys"] and top_ids_from_index(index, sort_by, limit, year) is not None:
+            # The bounded list is read up to `limit`, plus the still open period
+            walked = index_entries_walked(index, sort_by, limit, year)
+            candidates.append({"source": "topk_index", "exact": True, "estimated_rows": walked,
+                               "estimated_cost": _cost("topk_index", walked)})
+        elif index and sort_by in index["keys"]:
+            candidates.append({"source": "topk_index", "exact": False, "estimated_rows": None, "estimated_cost": None,
+                               "reason": f"limit {limit} exceeds the top-{index['k_max']} kept for {level}/{sort_by}"})
+        else:
+            candidates.append({"source": "topk_index", "exact": False, "estimated_rows": None, "estimated_cost": None,
+                               "reason": f"no top-K index for {level}/{sort_by} ({order})"})
+
+        if rollups is not None:
+            candidates.append({"source": "rollup_scan", "exact": True, "estimated_rows": matching,
+                               "estimated_cost": _cost("rollup_scan", matching)})
+        elif stats["collection_count"]:
+            # Rollups written before the index existed: the filter is evaluated over the whole collection
+            candidates.append({"source": "rollup_scan", "exact": True, "estimated_rows": stats["collection_count"],
+                               "estimated_cost": _cost("rollup_scan", stats["collection_count"])})
+
+        candidates.append(self._raw_readings_candidate(year))
+        return candidates
+
+    def _raw_readings_candidate(self, year):
+        from numeric_store import NumericStore
+        stats = self.statistics()
+        candidate = {"source": "raw_readings", "exact": False, "estimated_rows": None, "estimated_cost": None}
+        if not stats["store_bounds"]:
+            candidate["reason"] = "numeric store is empty"
+            return candidate
+        start, end = stats["store_bounds"]
+        if year:
+            start, end = _year_range(year)
+            start, end = start - PERIOD_PADDING, end + PERIOD_PADDING
+        if stats["raw_from"] is not None and start < stats["raw_from"]:
+            candidate["reason"] = "readings in the range were compacted; only summaries remain"
+            return candidate
+        rows = NumericStore(self.manager.numeric_store_path).count_range(start, end)
+        candidate.update(exact=True, estimated_rows=rows, estimated_cost=_cost("raw_readings", rows))
+        return candidate
+
+    def _aggregate_candidates(self, metric, aggregation, start_date, end_date, time_of_day=None, value_type='ALL'):
+        stats = self.statistics()
+        start_epoch, end_epoch = self.tools._date_range_epochs(start_date, end_date)
+        candidates = [{"source": "rollups", "exact": False, "estimated_rows": None, "estimated_cost": None,
+                       "reason": "rollups only hold per-period counter differences"
+                                 + (", not time-of-day or power values" if time_of_day or metric == "active_power_w"
+                                    else "; increments between periods are lost")}]
+        store = stats["tools_store"]
+        if store is not None:
+            import compaction
+            tiers = compaction.load_state(self.tools.NUMERIC_STORE_PATH)["tiers"]
+            raw_from = tiers[0]["horizon"] if tiers else start_epoch
+            rows = store.count_range(max(start_epoch, raw_from), end_epoch)
+            # Compacted spans cost about one summary row per period (see compaction.coverage for the spans)
+            summary_rows = 0
+            for i, tier in enumerate(tiers):
+                older = tiers[i + 1]["horizon"] if i + 1 < len(tiers) else None
+                lo = start_epoch if older is None else max(start_epoch, older)
+                hi = min(end_epoch, tier["horizon"] - 1)
+                if lo <= hi:
+                    summary_rows += math.ceil((hi - lo + 1) / tier["period"])
+            cost = _cost("numeric_store", rows) + summary_rows * ROW_COST["summary_tiers"]
+            candidates.append({"source": "numeric_store", "exact": True, "estimated_rows": rows + summary_rows,
+                               "estimated_cost": cost})
+        else:
+            rows = stats["collection_count"]
+            candidates.append({"source": "chroma_readings", "exact": rows is not None, "estimated_rows": rows,
+                               "estimated_cost": _cost("chroma_readings", rows) if rows is not None else None,
+                               "reason": "collection not available" if rows is None else "upper bound: all documents"})
+        return candidates
+
+    # --- Execution ---
+    def execute(self, plan: Dict[str, Any]) -> tuple:
+        """Runs the plan on its chosen source; returns (result, actual) with rows read and seconds taken."""
+        rows_before = _rows_scanned()
+        start = time.perf_counter()
+        params = plan["params"]
+        if plan["intent"] == "analytical":
+            result = self.manager.get_analytical_answer(**params, source=plan["source"])
+        elif plan["intent"] == "aggregate":
+            # tools picks the numeric store whenever it holds data, which is what the plan assumed
+            result = self.tools.query_aggregator(**params)
+        else:
+            raise ValueError("Semantic plans are answered by retrieval (see rag.py), not by the planner.")
+        rows = _rows_scanned() - rows_before
+        actual = {"rows": rows, "cost": _cost(plan["source"], rows) if rows else 0.0,
+                  "seconds": time.perf_counter() - start}
+        if rows == 0:
+            actual["note"] = "served from the result cache"
+        return result, actual
+
+def explain(plan: Dict[str, Any], actual: Optional[Dict[str, Any]] = None) -> str:
+    """Human-readable plan: every candidate with its estimate, the chosen one marked, then the actual cost."""
+    lines = [f"Plan: intent={plan['intent']} source={plan['source']}"]
+    for key, value in plan["params"].items():
+        lines.append(f"  {key} = {value}")
+    lines.append("Candidates:")
+    for candidate in plan["candidates"]:
+        marker = "*" if candidate["source"] == plan["source"] else " "
+        if candidate["estimated_cost"] is not None:
+            detail = f"rows~{candidate['estimated_rows']:<10} cost~{candidate['estimated_cost']:.1f}"
+        else:
+            detail = "not costed" if candidate["source"] == plan["source"] else "not usable"
+        if candidate.get("reason"):
+            detail += f" ({candidate['reason']})"
+        lines.append(f" {marker} {candidate['source']:<18} {detail}")
+    if actual is not None:
+        lines.append(f"Actual: rows={actual['rows']} cost={actual['cost']:.1f} time={actual['seconds'] * 1000:.1f} ms"
+                     + (f" ({actual['note']})" if actual.get("note") else ""))
+    return "\n".join(lines)
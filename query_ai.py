@@ -1,23 +1,90 @@
+import os
 import argparse
 import chromadb
 import re
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from ingest_manifest import MANIFEST_FILENAME, read_ingest_state
+from metrics import count, timer
+from planner import Planner, explain
+from query_server import ROOT_ENV, data_paths
+from result_cache import ResultCache, cache_key
+import pandas as pd
+import shards
+from numeric_store import NumericStore
+from smart_database import compute_rollups, load_store_readings
+from topk_index import index_entries_walked, index_path, load_index, scan_top_k, top_ids_from_index
 
 # --- Configuratie ---
-CHROMA_PATH = "C:\\Users\\emanu\\Documenten\\GitHub\\smartmeter-rag\\chroma_db"
+# Standaard dezelfde indeling onder de werkmap als main.py; main() kiest met --root een andere map
+CHROMA_PATH = data_paths(os.getcwd())["chroma"]
+NUMERIC_STORE_PATH = data_paths(os.getcwd())["numeric_store"]
 COLLECTION_NAME = "smartmeter_data"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+PERIOD_PADDING = 7 * 86400 # seconden; een week past altijd helemaal in het opgerekte bereik
 
 # --- Database Manager ---
 class ChromaManager:
     """Beheert de connectie en queries naar ChromaDB."""
-    def __init__(self):
+    def __init__(self, numeric_store_path=NUMERIC_STORE_PATH, chroma_path=None, collection_name=None, manifest_path=None,
+                 client=None):
+        """`client` is een al geopende PersistentClient op `chroma_path`, zodat een server er maar één heeft."""
         print("Verbinding maken met ChromaDB...")
-        self.client = chromadb.PersistentClient(path=CHROMA_PATH)
-        self.collection = self.client.get_collection(name=COLLECTION_NAME)
+        self.numeric_store_path = numeric_store_path
+        self.chroma_path = chroma_path or CHROMA_PATH
+        self.manifest_path = manifest_path or os.path.join(self.chroma_path, MANIFEST_FILENAME)
+        with timer("chroma", op="connect"):
+            self.client = client or chromadb.PersistentClient(path=self.chroma_path)
+            self.collection = self.client.get_collection(name=collection_name or COLLECTION_NAME)
+        self.result_cache = ResultCache()
         print("Verbinding succesvol.")
 
-    def get_analytical_answer(self, level, year, sort_by, order, limit):
-        """Voert een directe metadata query uit."""
+    def get_analytical_answer(self, level, year, sort_by, order, limit, source=None):
+        """
+        Geeft de `limit` beste (id, metadata)-paren volgens `sort_by` terug.
+        Antwoorden worden gecachet tot er metingen in (de buurt van) het gevraagde jaar bijkomen.
+        `source` kiest de bron (zie ANALYTICAL_SOURCES); zonder bron wordt de goedkoopste beschikbare gebruikt.
+        """
+        ingest = read_ingest_state(self.manifest_path)
+        key = cache_key("analytical", {"level": level, "year": year, "sort_by": sort_by, "order": order, "limit": limit})
+        cached = self.result_cache.get(key, ingest)
+        if cached is not None:
+            count("result_cache", outcome="hit", kind="analytical")
+            return [tuple(item) for item in cached] or None
+
+        count("result_cache", outcome="miss", kind="analytical")
+        with timer("query", kind="analytical"):
+            results = self._compute_analytical_answer(level, year, sort_by, order, limit, source)
+        # Alleen metingen in het jaar (en weken over de jaargrens) veranderen het antwoord
+        year_range = (None, None)
+        if year:
+            year_range = (int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp()) - PERIOD_PADDING,
+                          int(datetime(year, 12, 31, 23, 59, 59, tzinfo=timezone.utc).timestamp()) + PERIOD_PADDING)
+        self.result_cache.put(key, results or [], ingest, *year_range)
+        return results
+
+    def _compute_analytical_answer(self, level, year, sort_by, order, limit, source=None):
+        """
+        Met een top-K index voor het niveau zijn dat O(k) lookups; anders wordt de
+        collectie in pagina's gescand met een begrensde heap, zonder alles in te laden.
+        Met source='raw_readings' worden de periodes uit de ruwe metingen in de numerieke store berekend.
+        """
+        if source == "raw_readings":
+            return self._top_from_readings(level, year, sort_by, order, limit)
+        if level and source in (None, "topk_index"):
+            index = load_index(index_path(self.chroma_path, self.collection.name, level, order))
+            ids = top_ids_from_index(index, sort_by, limit, year) if index else None
+            if ids is not None:
+                count("query_rows_scanned", index_entries_walked(index, sort_by, limit, year), source="topk_index")
+                if not ids:
+                    return None
+                with timer("chroma", op="get"):
+                    results = self.collection.get(ids=ids, include=["metadatas"])
+                by_id = dict(zip(results['ids'], results['metadatas']))
+                return [(item_id, by_id[item_id]) for item_id in ids if item_id in by_id]
+            if source == "topk_index":
+                raise ValueError(f"Geen top-K index voor niveau '{level}' en '{sort_by}'.")
+
         where_conditions = []
         if level:
             where_conditions.append({"level": {"$eq": level}})
@@ -25,22 +92,79 @@ class ChromaManager:
             where_conditions.append({"year": {"$eq": year}})
 
         if not where_conditions:
-            results = self.collection.get()
+            where = None
         elif len(where_conditions) == 1:
-            results = self.collection.get(where=where_conditions[0])
+            where = where_conditions[0]
         else:
-            results = self.collection.get(where={"$and": where_conditions})
+            where = {"$and": where_conditions}
+
+        items = scan_top_k(self.collection, where, sort_by, order, limit)
+        return items or None
 
-        if not results or not results['ids']:
+    def _top_from_readings(self, level, year, sort_by, order, limit):
+        """
+        Berekent de rollups van `level` opnieuw uit de ruwe metingen. Het bereik wordt
+        een week opgerekt, zodat ook de randperiodes van het jaar volledig zijn.
+        """
+        store = NumericStore(self.numeric_store_path)
+        bounds = store.bounds()
+        if bounds is None:
             return None
+        start, end = bounds
+        if year:
+            start = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp()) - PERIOD_PADDING
+            end = int(datetime(year, 12, 31, 23, 59, 59, tzinfo=timezone.utc).timestamp()) + PERIOD_PADDING
+        df = load_store_readings(store, start)
+        df = df[df.index <= pd.Timestamp(end, unit='s')]
+        count("query_rows_scanned", len(df), source="raw_readings")
+        ids, _, metadatas, _ = compute_rollups(df, level)
+        items = [(item_id, metadata) for item_id, metadata in zip(ids, metadatas) if not year or metadata["year"] == year]
+        # Stabiele sortering, net als scan_top_k: bij gelijke waarden blijft de periodevolgorde
+        items.sort(key=lambda item: item[1].get(sort_by, 0), reverse=(order == 'desc'))
+        return items[:limit] or None
 
-        # Combineer de metadata met de IDs en sorteer
-        items = list(zip(results['ids'], results['metadatas']))
-        
-        reverse_order = (order == 'desc')
-        sorted_items = sorted(items, key=lambda item: item[1].get(sort_by, 0), reverse=reverse_order)
-        
-        return sorted_items[:limit]
+class ShardedChromaManager:
+    """
+    Beantwoordt analytische vragen over meerdere meters (zie shards.py): elke meter
+    heeft een eigen collectie, die parallel zijn eigen top-K levert; die lijsten
+    worden samengevoegd tot de top-K over alle meters.
+    """
+    def __init__(self, meters=shards.ALL_METERS, catalog=None):
+        self.catalog = catalog or shards.ShardCatalog()
+        self.meters = self.catalog.resolve(meters)
+        self.managers = {
+            meter: ChromaManager(
+                numeric_store_path=self.catalog.store_for(meter),
+                chroma_path=self.catalog.chroma_path,
+                collection_name=self.catalog.meter(meter)["collection"],
+                manifest_path=self.catalog.manifest_path(meter),
+            )
+            for meter in self.meters
+        }
+
+    def _meter_answer(self, meter, level, year, sort_by, order, limit, source):
+        manager = self.managers[meter]
+        if source == "raw_readings":
+            # Een meter die per jaar is opgesplitst heeft een store per jaar
+            manager.numeric_store_path = self.catalog.store_for(meter, year)
+            if manager.numeric_store_path is None:
+                return None
+        return manager.get_analytical_answer(level, year, sort_by, order, limit, source)
+
+    def get_analytical_answer(self, level, year, sort_by, order, limit, source=None):
+        """
+        Zelfde antwoord als ChromaManager.get_analytical_answer, over alle meters samen.
+        Id's krijgen de meter als voorvoegsel ('meter/id') en de metadata een 'meter'-veld.
+        """
+        with ThreadPoolExecutor(max_workers=shards.fanout_workers(len(self.meters))) as pool:
+            parts = list(pool.map(lambda meter: (meter, self._meter_answer(meter, level, year, sort_by, order, limit, source)),
+                                  self.meters))
+        count("query_shards_scanned", len(parts), kind="analytical")
+        items = [(f"{meter}/{item_id}", dict(metadata, meter=meter))
+                 for meter, results in parts for item_id, metadata in (results or [])]
+        # Stabiele sortering: bij gelijke waarden blijven de meters in volgorde
+        items.sort(key=lambda item: item[1].get(sort_by, 0), reverse=(order == 'desc'))
+        return items[:limit] or None
 
 # --- AI Query Parser ---
 class QueryParser:
@@ -57,7 +181,7 @@ class QueryParser:
         query = query.lower()
 
         # Zoek naar de verschillende entiteiten, ongeacht de volgorde
-        level_match = re.search(r'(week|weken|maand|maanden|dag|dagen)', query)
+        level_match = re.search(r'(week|weken|maand|maanden|dag|dagen|\buur\b|\buren\b)', query)
         qualifier_match = re.search(r'(top|hoogste|meeste|laagste|minste)', query)
         feature_match = re.search(r'(teruglevering|export|verbruik|import)', query)
         year_match = re.search(r'(20\d{2})', query)
@@ -84,45 +208,169 @@ class QueryParser:
                     'limit': limit
                 }
             }
-        
+
+        # Aggregatie over een periode, bijv. 'hoeveel verbruik op 2025-09-01' of 'gemiddeld vermogen in de avond in 2025-09'
+        aggregate_match = re.search(r'(hoeveel|totaal|gemiddeld|piek|maximaal|maximum|minimaal|minimum)', query)
+        period = self._parse_period(query)
+        if aggregate_match and period:
+            word = aggregate_match.group(1)
+            time_of_day_match = re.search(r'\b(nacht|ochtend|middag|avond)\b', query)
+            if word in ('hoeveel', 'totaal'):
+                if not feature_match:
+                    return None
+                metric = 'total_power_export_kwh' if feature_match.group(1) in ('teruglevering', 'export') else 'total_power_import_kwh'
+                aggregation, value_type = 'DELTA', 'ALL'
+            else:
+                metric = 'active_power_w'
+                aggregation = 'AVG' if word == 'gemiddeld' else ('MAX' if word in ('piek', 'maximaal', 'maximum') else 'MIN')
+                value_type = 'ALL'
+                if feature_match:
+                    value_type = 'PRODUCTION' if feature_match.group(1) in ('teruglevering', 'export') else 'CONSUMPTION'
+                if value_type == 'PRODUCTION' and aggregation != 'AVG':
+                    # Teruglevering is negatief vermogen: de piek is het minimum
+                    aggregation = 'MIN' if aggregation == 'MAX' else 'MAX'
+            return {
+                'intent': 'aggregate',
+                'params': {
+                    'metric': metric,
+                    'aggregation': aggregation,
+                    'start_date': period[0],
+                    'end_date': period[1],
+                    'time_of_day': time_of_day_match.group(1) if time_of_day_match else None,
+                    'value_type': value_type
+                }
+            }
+
         # Voeg hier later logica toe voor similariteit-vragen
         return None
 
+    def _parse_period(self, query):
+        """(start_date, end_date) voor een datum (2025-09-01), maand (2025-09) of jaar (2025) in de vraag."""
+        date_match = re.search(r'\b(20\d{2}-\d{2}-\d{2})\b', query)
+        if date_match:
+            return date_match.group(1), date_match.group(1)
+        month_match = re.search(r'\b(20\d{2})-(\d{2})\b', query)
+        if month_match:
+            start = pd.Timestamp(f"{month_match.group(1)}-{month_match.group(2)}-01")
+            return start.strftime("%Y-%m-%d"), (start + pd.offsets.MonthEnd(0)).strftime("%Y-%m-%d")
+        year_match = re.search(r'\b(20\d{2})\b', query)
+        if year_match:
+            return f"{year_match.group(1)}-01-01", f"{year_match.group(1)}-12-31"
+        return None
+
     def _normalize_level(self, level_str):
         if level_str.startswith('week'): return 'week'
         if level_str.startswith('dag'): return 'day'
         if level_str.startswith('maand'): return 'month'
+        if level_str in ('uur', 'uren'): return 'hour'
         return 'week' # fallback
 
+def answer_with_rag(question, collection):
+    """Streamt een LLM-antwoord op basis van opgehaalde documenten en aggregaties voor genoemde datums."""
+    import rag
+    from chromadb.utils import embedding_functions
+    from embedding_cache import CachedEmbeddingFunction
+    from retrieval import Retriever
+
+    client = rag.make_client()
+    embedding_function = CachedEmbeddingFunction(
+        embedding_functions.SentenceTransformerEmbeddingFunction,
+        model_name=EMBEDDING_MODEL
+    )
+    answerer = rag.RagAnswerer(client, cache=ResultCache(path=rag.PROMPT_CACHE_PATH),
+                               ingest=read_ingest_state(os.path.join(CHROMA_PATH, MANIFEST_FILENAME)))
+    dates = rag.question_dates(question)
+    documents = rag.retrieved_documents(Retriever(collection, embedding_function), question, dates)
+
+    print("\n--- ANTWOORD ---")
+    for piece in answerer.answer(question, documents, rag.gather_facts(dates)):
+        print(piece, end="", flush=True)
+    print("\n----------------")
+
 # --- Hoofdfunctie ---
 def main():
     parser = argparse.ArgumentParser(description='Een AI-assistent voor je slimme meter data.')
     parser.add_argument('query', type=str, help='Stel een vraag in natuurlijke taal.')
+    parser.add_argument('--explain', action='store_true', help='Toon het gekozen queryplan met geschatte en werkelijke kosten.')
+    parser.add_argument('--meters', type=str, default=None,
+                        help="Meter-id's uit de shardcatalogus (komma-gescheiden), of '*' voor alle meters (zie shards.py).")
+    parser.add_argument('--root', type=str, default=None,
+                        help=f"Map waarin main.py heeft geïndexeerd (standaard: ${ROOT_ENV}, anders de werkmap).")
     args = parser.parse_args()
+    meters = None
+    if args.meters:
+        meters = shards.ALL_METERS if args.meters == shards.ALL_METERS else args.meters.split(",")
 
+    # Eén data-root voor de collectie, de numerieke store en de aggregator in tools.py
+    import tools
+    paths = data_paths(args.root or os.environ.get(ROOT_ENV) or os.getcwd())
+    shards.SHARD_ROOT = paths["shards"]
     try:
-        db_manager = ChromaManager()
+        if meters:
+            tools.configure(paths["chroma"], paths["numeric_store"])
+            db_manager = ShardedChromaManager(meters)
+        else:
+            client = chromadb.PersistentClient(path=paths["chroma"])
+            tools.configure(paths["chroma"], paths["numeric_store"], client=client)
+            db_manager = ChromaManager(numeric_store_path=paths["numeric_store"], chroma_path=paths["chroma"], client=client)
         query_parser = QueryParser()
+        query_planner = None if meters else Planner(db_manager)
     except Exception as e:
         print(f"Fout bij initialisatie: {e}")
         return
 
-    plan = query_parser.parse(args.query)
+    with timer("query_stage", stage="parse"):
+        parsed = query_parser.parse(args.query)
+    if meters and not parsed:
+        print("Met --meters worden alleen analytische en aggregatievragen beantwoord.")
+        return
+    try:
+        with timer("query_stage", stage="plan"):
+            # Over meerdere meters is er geen kostenkeuze: elke meter gebruikt zijn goedkoopste bron
+            plan = query_planner.plan(parsed) if query_planner else dict(parsed, source="shards")
+    except ValueError as e:
+        # Lege of half gevulde database: geen enkele bron kan exact antwoorden
+        print(f"Deze vraag kan (nog) niet beantwoord worden: {e}")
+        print("Indexeer eerst de metingen met main.py en smart_database.py.")
+        return
 
-    if plan and plan['intent'] == 'analytical':
-        print(f"Analytische vraag herkend: {plan['params']}")
+    if plan['intent'] == 'semantic':
+        if args.explain:
+            print(explain(plan))
+        # Geen gestructureerde vraag: beantwoord met opgehaalde context via de LLM (zie rag.py)
+        try:
+            answer_with_rag(args.query, db_manager.collection)
+        except Exception as e:
+            print(f"Fout bij het genereren van een antwoord: {e}")
+            print("Probeer een analytische vraag zoals 'hoogste week qua teruglevering in 2025'.")
+        return
+
+    label = "Analytische vraag" if plan['intent'] == 'analytical' else "Aggregatievraag"
+    print(f"{label} herkend: {plan['params']}")
+    if query_planner:
+        results, actual = query_planner.execute(plan)
+    elif plan['intent'] == 'analytical':
         results = db_manager.get_analytical_answer(**plan['params'])
-        
-        print("\n--- ANTWOORD ---")
-        if not results:
-            print("Geen resultaten gevonden die aan de criteria voldoen.")
+    else:
+        results = tools.query_aggregator(**plan['params'], meters=meters)
+
+    print("\n--- ANTWOORD ---")
+    if plan['intent'] == 'aggregate':
+        if "error" in results:
+            print(f"Fout: {results['error']}")
         else:
-            for i, (item_id, metadata) in enumerate(results):
-                value = metadata[plan['params']['sort_by']]
-                print(f"{i+1}. ID: {item_id:<15} | {plan['params']['sort_by']}: {value:.2f} kWh")
-        print("----------------")
+            when = f" om {results['timestamp']}" if results.get('timestamp') else ""
+            over = f" over {results['meters']} meter(s)" if 'meters' in results else ""
+            print(f"{results['aggregation_type']} van {results['metric']}{over}: {results['value']:.3f}{when}")
+    elif not results:
+        print("Geen resultaten gevonden die aan de criteria voldoen.")
     else:
-        print("Ik begrijp deze vraag nog niet. Probeer een analytische vraag zoals 'hoogste week qua teruglevering in 2025'.")
+        for i, (item_id, metadata) in enumerate(results):
+            value = metadata[plan['params']['sort_by']]
+            print(f"{i+1}. ID: {item_id:<15} | {plan['params']['sort_by']}: {value:.2f} kWh")
+    print("----------------")
+    if args.explain and query_planner:
+        print(explain(plan, actual))
 
 if __name__ == "__main__":
     main()
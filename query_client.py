@@ -0,0 +1,106 @@
+import argparse
+import codecs
+import json
+import sys
+import urllib.error
+import urllib.request
+
+# Deliberately stdlib-only: the client must start in milliseconds, the server does the heavy lifting.
+SERVER_URL = "http://127.0.0.1:8765"
+
+def call(path, payload, server_url=SERVER_URL):
+    """POSTs a JSON request to the query server and returns the decoded JSON response."""
+    request = urllib.request.Request(
+        server_url + path,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read())
+
+def stream(path, payload, server_url=SERVER_URL):
+    """POSTs a request to a streaming route and prints the text as it arrives."""
+    request = urllib.request.Request(
+        server_url + path,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace") # pieces may split a character
+            while True:
+                piece = response.read1(1024)
+                if not piece:
+                    break
+                sys.stdout.write(decoder.decode(piece))
+                sys.stdout.flush()
+        print()
+    except urllib.error.HTTPError as e:
+        print(json.dumps(json.loads(e.read()), indent=4, ensure_ascii=False))
+
+def main():
+    parser = argparse.ArgumentParser(description="Thin client for the smart meter query server.")
+    parser.add_argument("--server", type=str, default=SERVER_URL)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    aggregate = subparsers.add_parser("aggregate", help="Run tools.query_aggregator on the server.")
+    aggregate.add_argument("--metric", required=True, type=str)
+    aggregate.add_argument("--aggregation", required=True, type=str)
+    aggregate.add_argument("--start_date", required=True, type=str)
+    aggregate.add_argument("--end_date", required=True, type=str)
+    aggregate.add_argument("--time_of_day", type=str, default=None)
+    aggregate.add_argument("--value_type", type=str, default='ALL')
+
+    aggregate_batch = subparsers.add_parser("aggregate-batch", help="Run many aggregations over one date range in a single scan.")
+    aggregate_batch.add_argument("--start_date", required=True, type=str)
+    aggregate_batch.add_argument("--end_date", required=True, type=str)
+    aggregate_batch.add_argument("--specs", required=True, type=str,
+                                 help='JSON list of specs, e.g. \'[{"metric": "active_power_w", "aggregation": "AVG", "time_of_day": "avond"}]\'')
+
+    ask = subparsers.add_parser("ask", help="Ask an analytical question in natural language.")
+    ask.add_argument("query", type=str)
+
+    retrieve = subparsers.add_parser("retrieve", help="Semantic retrieval over the indexed readings.")
+    retrieve.add_argument("query", type=str, nargs="?", default="", help="Leave empty for a filter-only lookup (no embedding).")
+    retrieve.add_argument("--n_results", type=int, default=10)
+    retrieve.add_argument("--limit", type=int, default=None, help="Maximum documents for a filter-only lookup.")
+    retrieve.add_argument("--date", type=str, default=None, help="Only return documents for this date (YYYY-MM-DD).")
+    retrieve.add_argument("--start_date", type=str, default=None)
+    retrieve.add_argument("--end_date", type=str, default=None)
+    retrieve.add_argument("--level", type=str, default=None, help="Rollup level: hour, day, week or month.")
+
+    answer = subparsers.add_parser("answer", help="Stream an LLM answer over retrieved context.")
+    answer.add_argument("query", type=str)
+    answer.add_argument("--n_results", type=int, default=50)
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "aggregate":
+            payload = {key: value for key, value in vars(args).items() if key not in ("server", "command")}
+            result = call("/aggregate", payload, args.server)
+        elif args.command == "aggregate-batch":
+            payload = {"start_date": args.start_date, "end_date": args.end_date, "specs": json.loads(args.specs)}
+            result = call("/aggregate_batch", payload, args.server)
+        elif args.command == "answer":
+            stream("/answer", {"query": args.query, "n_results": args.n_results}, args.server)
+            return
+        elif args.command == "ask":
+            result = call("/analytical", {"query": args.query}, args.server)
+        else:
+            payload = {"query": args.query, "n_results": args.n_results}
+            for key in ("limit", "date", "start_date", "end_date", "level"):
+                if getattr(args, key) is not None:
+                    payload[key] = getattr(args, key)
+            result = call("/retrieve", payload, args.server)
+    except urllib.error.URLError as e:
+        print(f"Query server not reachable at {args.server}: {e.reason}. Start it with 'python query_server.py'.")
+        sys.exit(1)
+
+    print(json.dumps(result, indent=4, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
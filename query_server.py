@@ -0,0 +1,220 @@
+import os
+import argparse
+import ujson
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator
+from metrics import METRICS, count, timer
+
+# --- Constants ---
+HOST = "127.0.0.1"
+PORT = 8765
+ROOT_ENV = "SMARTMETER_ROOT" # data root when --root is not given; otherwise the working directory, like main.py
+
+def data_paths(root: str) -> Dict[str, str]:
+    """Where main.py, vector_index.py, shards.py and rag.py keep their data under `root` (their working directory)."""
+    return {
+        "chroma": os.path.join(root, "chroma_db"),
+        "numeric_store": os.path.join(root, "numeric_store"),
+        "embedding_cache": os.path.join(root, "embedding_cache"),
+        "vector_index": os.path.join(root, "vector_index"),
+        "shards": os.path.join(root, "shards"),
+        "prompt_cache": os.path.join(root, "prompt_cache.json"),
+    }
+
+class QueryService:
+    """
+    Holds everything that is expensive to set up - the Chroma client, open
+    collections and the MiniLM model - for the lifetime of the server process.
+    Every store is read from one data `root` (see data_paths), through one Chroma
+    client shared by the analytical queries, the aggregator and the retriever.
+    With `quantized_index` ('int8' or 'float16') retrievals can also be answered by the
+    in-process vector index (see vector_index.QuantizedIndex).
+    """
+    def __init__(self, warm=True, quantized_index=None, root=None):
+        # Heavy imports happen once, when the server starts
+        import chromadb
+        import main
+        import query_ai
+        import retrieval
+        import shards
+        import tools
+        from chromadb.utils import embedding_functions
+        from embedding_cache import CachedEmbeddingFunction
+        from ingest_manifest import MANIFEST_FILENAME
+
+        self.tools = tools
+        self.paths = data_paths(root or os.environ.get(ROOT_ENV) or os.getcwd())
+        self.manifest_path = os.path.join(self.paths["chroma"], MANIFEST_FILENAME)
+        self.llm_client = None # created on the first /answer request
+        self.prompt_cache = None
+        self.query_parser = query_ai.QueryParser()
+        self.client = chromadb.PersistentClient(path=self.paths["chroma"])
+        tools.configure(self.paths["chroma"], self.paths["numeric_store"], client=self.client)
+        shards.SHARD_ROOT = self.paths["shards"]
+        self.chroma_manager = query_ai.ChromaManager(numeric_store_path=self.paths["numeric_store"],
+                                                     chroma_path=self.paths["chroma"], client=self.client)
+        self.embedding_function = CachedEmbeddingFunction(
+            embedding_functions.SentenceTransformerEmbeddingFunction,
+            model_name=main.EMBEDDING_MODEL,
+            cache_dir=self.paths["embedding_cache"]
+        )
+        retrieval_collection = self.client.get_collection(
+            name=main.COLLECTION_NAME,
+            embedding_function=self.embedding_function
+        )
+        vector_index = None
+        if quantized_index:
+            from vector_index import QuantizedIndex
+            vector_index = QuantizedIndex(self.paths["vector_index"], dtype=quantized_index)
+            print(f"Quantized {quantized_index} index loaded with {len(vector_index)} vectors.")
+        self.retriever = retrieval.Retriever(retrieval_collection, self.embedding_function, vector_index=vector_index)
+        if warm:
+            print("Loading embedding model...")
+            self.embedding_function.embedding_function([""])
+            try:
+                tools.get_collection()
+            except Exception as e:
+                print(f"Aggregator collection not opened, relying on the numeric store: {e}")
+
+    def aggregate(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return self.tools.query_aggregator(**request)
+
+    def aggregate_batch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return {"results": self.tools.query_aggregator_batch(request["start_date"], request["end_date"], request["specs"])}
+
+    def analytical(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Accepts either {'query': '...'} in natural language or the parsed plan params."""
+        if "query" in request:
+            plan = self.query_parser.parse(request["query"])
+            if not plan or plan['intent'] != 'analytical':
+                return {"error": "Query is not an analytical question."}
+            params = plan['params']
+        else:
+            params = request
+        results = self.chroma_manager.get_analytical_answer(**params) or []
+        return {"params": params, "results": [{"id": item_id, "metadata": metadata} for item_id, metadata in results]}
+
+    def retrieve(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Semantic search, or a filter-only lookup when 'query' is empty (see retrieval.Retriever);
+        {'backend': 'quantized'} ranks with the in-process index instead of HNSW.
+        """
+        return self.retriever.retrieve(**request)
+
+    def answer(self, request: Dict[str, Any]) -> Iterator[str]:
+        """Streams an LLM answer to {'query': '...'} over retrieved documents and aggregates (see rag.py)."""
+        import rag
+        from ingest_manifest import read_ingest_state
+        from result_cache import ResultCache
+        if self.llm_client is None:
+            self.llm_client = rag.make_client(request.get("base_url", rag.LLM_BASE_URL))
+            self.prompt_cache = ResultCache(path=self.paths["prompt_cache"])
+        answerer = rag.RagAnswerer(self.llm_client, model=request.get("model", rag.LLM_MODEL), cache=self.prompt_cache,
+                                   ingest=read_ingest_state(self.manifest_path))
+        question = request["query"]
+        dates = rag.question_dates(question)
+        documents = rag.retrieved_documents(self.retriever, question, dates, request.get("n_results", rag.RAG_N_RESULTS))
+        return answerer.answer(question, documents, rag.gather_facts(dates),
+                               request.get("token_budget", rag.CONTEXT_TOKEN_BUDGET))
+
+def make_handler(service):
+    routes = {
+        "/aggregate": service.aggregate,
+        "/aggregate_batch": service.aggregate_batch,
+        "/analytical": service.analytical,
+        "/retrieve": service.retrieve,
+    }
+    # Routes that return text pieces, written to the client as they are produced
+    streaming_routes = {
+        "/answer": service.answer,
+    }
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = ujson.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"status": "ok"})
+            elif self.path == "/metrics":
+                body = METRICS.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._reply(404, {"error": f"Unknown path: {self.path}"})
+
+        def _stream(self, route, request):
+            pieces = route(request) # context is retrieved and packed before the status is sent
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.end_headers()
+            try:
+                for piece in pieces:
+                    self.wfile.write(piece.encode("utf-8"))
+                    self.wfile.flush()
+            except Exception as e:
+                count("server_errors", route=self.path)
+                self.wfile.write(f"\n[error: {e}]".encode("utf-8"))
+            self.close_connection = True # no Content-Length: the end of the answer closes the connection
+
+        def do_POST(self):
+            if self.path in streaming_routes:
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    request = ujson.loads(self.rfile.read(length) or b"{}")
+                    with timer("server_request", route=self.path):
+                        self._stream(streaming_routes[self.path], request)
+                except Exception as e:
+                    count("server_errors", route=self.path)
+                    self._reply(400, {"error": str(e)})
+                return
+            route = routes.get(self.path)
+            if route is None:
+                self._reply(404, {"error": f"Unknown path: {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = ujson.loads(self.rfile.read(length) or b"{}")
+                with timer("server_request", route=self.path):
+                    response = route(request)
+                self._reply(200, response)
+            except Exception as e:
+                count("server_errors", route=self.path)
+                self._reply(400, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass # Keep the console quiet; every request would otherwise be printed
+
+    return QueryHandler
+
+def serve(host=HOST, port=PORT, warm=True, quantized_index=None, root=None):
+    service = QueryService(warm=warm, quantized_index=quantized_index, root=root)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Query server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident query server that keeps Chroma and the embedding model warm.")
+    parser.add_argument("--host", type=str, default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--no-warm", action="store_true", help="Load the embedding model on the first retrieval instead of at startup.")
+    parser.add_argument("--quantized-index", choices=["int8", "float16"], default=None,
+                        help="Load the quantized in-process index built by main.py/vector_index.py for backend='quantized'.")
+    parser.add_argument("--root", type=str, default=None,
+                        help=f"Directory main.py indexed into (default: ${ROOT_ENV}, else the working directory).")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, warm=not args.no_warm, quantized_index=args.quantized_index, root=args.root)
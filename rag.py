@@ -0,0 +1,211 @@
+import os
+import re
+import time
+import argparse
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from metrics import METRICS, count, timer
+from result_cache import ResultCache, cache_key
+
+# --- Constants ---
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "https://integrate.api.nvidia.com/v1")
+LLM_MODEL = os.environ.get("LLM_MODEL", "meta/llama-3.1-8b-instruct")
+LLM_API_KEY_ENV = "NVIDIA_API_KEY"
+PROMPT_CACHE_PATH = os.path.join(os.getcwd(), "prompt_cache.json")
+
+CONTEXT_TOKEN_BUDGET = 3000 # tokens of retrieved context per prompt
+MAX_ANSWER_TOKENS = 512
+CHARS_PER_TOKEN = 4 # rough estimate for English/Dutch text; avoids a tokenizer dependency
+RAG_N_RESULTS = 50
+# The aggregator facts that are computed for every date mentioned in a question
+DAY_SPECS = [
+    {"metric": "total_power_import_kwh", "aggregation": "DELTA"},
+    {"metric": "total_power_export_kwh", "aggregation": "DELTA"},
+    {"metric": "active_power_w", "aggregation": "MAX", "value_type": "CONSUMPTION"},
+    {"metric": "active_power_w", "aggregation": "MAX", "value_type": "PRODUCTION"},
+]
+SYSTEM_PROMPT = (
+    "Je bent een assistent voor slimme-meterdata (stroom en gas). Beantwoord de vraag "
+    "uitsluitend op basis van de context. Geef cijfers met eenheid en zeg het eerlijk "
+    "als de context het antwoord niet bevat."
+)
+
+_NUMBER = re.compile(r"(\d+)\.\d+")
+_DATE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def dedupe_key(document: str) -> str:
+    """
+    Readings logged in the same minute produce sentences that only differ in the
+    decimals of the meter counters; dropping the fractions makes them collide.
+    """
+    return _NUMBER.sub(r"\1", document)
+
+def format_aggregate(start_date: str, end_date: str, result: Dict[str, Any]) -> Optional[str]:
+    """One context line for a tools.query_aggregator result; errors are left out."""
+    if "error" in result:
+        return None
+    period = start_date if start_date == end_date else f"{start_date} t/m {end_date}"
+    parts = [f"{period}: {result['aggregation_type']} van {result['metric']}"]
+    if result.get("value_type", "ALL") != "ALL":
+        parts.append(f"({result['value_type']})")
+    if result.get("time_of_day"):
+        parts.append(f"in de {result['time_of_day']}")
+    line = " ".join(parts) + f" = {result['value']:.3f}"
+    if result.get("timestamp"):
+        line += f" om {result['timestamp']}"
+    return line
+
+def pack_context(documents: Iterable[str], facts: Iterable[str] = (),
+                 token_budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, Dict[str, int]]:
+    """
+    Fills the token budget with the aggregator `facts` first (small and exact), then
+    with `documents` in rank order, skipping near-duplicates. Documents are consumed
+    lazily and packing stops as soon as the budget is full, so a large (paged)
+    retrieval set is never materialised. Returns the context and packing stats.
+    """
+    lines, seen = [], set()
+    stats = {"facts": 0, "documents": 0, "duplicates": 0, "tokens": 0, "truncated": 0}
+
+    def add(text):
+        tokens = estimate_tokens(text)
+        if stats["tokens"] + tokens > token_budget:
+            stats["truncated"] = 1
+            return False
+        lines.append(f"- {text}")
+        stats["tokens"] += tokens
+        return True
+
+    with timer("rag_stage", stage="pack"):
+        for fact in facts:
+            if not add(fact):
+                break
+            stats["facts"] += 1
+        for document in documents:
+            if stats["truncated"]:
+                break
+            key = dedupe_key(document)
+            if key in seen:
+                stats["duplicates"] += 1
+                continue
+            if not add(document):
+                break
+            seen.add(key)
+            stats["documents"] += 1
+    return "\n".join(lines), stats
+
+def build_messages(question: str, context: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Context:\n{context or '(geen gegevens gevonden)'}\n\nVraag: {question}"},
+    ]
+
+def make_client(base_url: str = LLM_BASE_URL, api_key: Optional[str] = None):
+    """OpenAI-compatible client for the NVIDIA API, or any other endpoint such as a local stub."""
+    from openai import OpenAI # only needed when an answer is generated
+    api_key = api_key or os.environ.get(LLM_API_KEY_ENV)
+    if not api_key:
+        raise ValueError(f"Set {LLM_API_KEY_ENV} to generate answers.")
+    return OpenAI(base_url=base_url, api_key=api_key)
+
+class RagAnswerer:
+    """
+    Streams LLM answers over a packed context. Answers are cached per (model, prompt)
+    in a ResultCache, so they are invalidated like query results once new readings
+    are ingested; a cached answer is replayed without calling the endpoint.
+    """
+    def __init__(self, client, model: str = LLM_MODEL, max_tokens: int = MAX_ANSWER_TOKENS,
+                 cache: Optional[ResultCache] = None, ingest: Optional[Dict[str, Any]] = None):
+        self.client = client
+        self.model = model
+        self.max_tokens = max_tokens
+        self.cache = cache if cache is not None else ResultCache()
+        self.ingest = ingest # see ingest_manifest.ingest_state
+
+    def stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """Yields answer text as it arrives from the endpoint."""
+        key = cache_key("rag", {"model": self.model, "messages": messages})
+        cached = self.cache.get(key, self.ingest)
+        if cached is not None:
+            count("prompt_cache", outcome="hit")
+            yield cached
+            return
+        count("prompt_cache", outcome="miss")
+
+        start = time.perf_counter()
+        first = True
+        pieces = []
+        stream = self.client.chat.completions.create(
+            model=self.model, messages=messages, max_tokens=self.max_tokens, stream=True)
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if first:
+                METRICS.observe("rag_stage", time.perf_counter() - start, stage="first_token")
+                first = False
+            pieces.append(delta)
+            yield delta
+        METRICS.observe("rag_stage", time.perf_counter() - start, stage="generate")
+        # Only complete answers are cached; an abandoned stream never gets here
+        self.cache.put(key, "".join(pieces), self.ingest)
+
+    def answer(self, question: str, documents: Iterable[str], facts: Iterable[str] = (),
+               token_budget: int = CONTEXT_TOKEN_BUDGET) -> Iterator[str]:
+        context, stats = pack_context(documents, facts, token_budget)
+        count("rag_context_documents", stats["documents"])
+        count("rag_context_duplicates", stats["duplicates"])
+        return self.stream(build_messages(question, context))
+
+def question_dates(question: str) -> List[str]:
+    """ISO dates (YYYY-MM-DD) mentioned in the question, in order."""
+    return list(dict.fromkeys(_DATE.findall(question)))
+
+def gather_facts(dates: List[str]) -> Iterator[str]:
+    """Aggregator results for every mentioned date, computed in one batched scan per date."""
+    import tools
+    for date in dates:
+        with timer("rag_stage", stage="aggregate"):
+            results = tools.query_aggregator_batch(date, date, DAY_SPECS)
+        for result in results:
+            line = format_aggregate(date, date, result)
+            if line:
+                yield line
+
+def retrieved_documents(retriever, question: str, dates: List[str], n_results: int = RAG_N_RESULTS) -> Iterator[str]:
+    """Ranked documents for the question, restricted to the mentioned dates when there are any."""
+    with timer("rag_stage", stage="retrieve"):
+        if len(dates) == 1:
+            results = retriever.retrieve(question, n_results=n_results, date=dates[0])
+        elif dates:
+            results = retriever.retrieve(question, n_results=n_results, where={"date": {"$in": dates}})
+        else:
+            results = retriever.retrieve(question, n_results=n_results)
+    yield from results["documents"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a question about the meter data with retrieved context and an LLM.")
+    parser.add_argument("question", type=str)
+    parser.add_argument("--base-url", type=str, default=LLM_BASE_URL, help="OpenAI-compatible endpoint.")
+    parser.add_argument("--model", type=str, default=LLM_MODEL)
+    parser.add_argument("--token-budget", type=int, default=CONTEXT_TOKEN_BUDGET, help="Context tokens per prompt.")
+    parser.add_argument("--n_results", type=int, default=RAG_N_RESULTS)
+    args = parser.parse_args()
+
+    import main as indexer
+    from ingest_manifest import read_ingest_state
+    from retrieval import open_retriever
+
+    answerer = RagAnswerer(make_client(args.base_url), model=args.model,
+                           cache=ResultCache(path=PROMPT_CACHE_PATH), ingest=read_ingest_state(indexer.MANIFEST_PATH))
+    dates = question_dates(args.question)
+    documents = retrieved_documents(open_retriever(), args.question, dates, args.n_results)
+    for piece in answerer.answer(args.question, documents, gather_facts(dates), args.token_budget):
+        print(piece, end="", flush=True)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import threading
+import ujson
+from collections import OrderedDict
+
+# --- Constants ---
+MAX_ENTRIES = 1024
+
+def _unaffected(entry, ingest):
+    """True when nothing written since the entry was computed overlaps the range it covers."""
+    generation = entry.get("generation")
+    if generation is None or generation > ingest["generation"]:
+        return False # written before generations existed, or by a store that was rolled back
+    if generation == ingest["generation"]:
+        return True
+    if entry["range"] is None or ingest["since"] > generation + 1:
+        return False
+    start, end = entry["range"]
+    return not any(
+        written > generation and (end is None or first <= end) and (start is None or last >= start)
+        for written, first, last in ingest["writes"]
+    )
+
+def cache_key(namespace, arguments):
+    """Normalised key for a query: same namespace and arguments give the same key, whatever the order."""
+    return ujson.dumps([namespace, arguments], sort_keys=True)
+
+class ResultCache:
+    """
+    LRU cache for query results, invalidated by what was ingested since.
+
+    Every entry remembers the ingest generation it was computed at and the epoch
+    range it covers. Each ingest run bumps the generation and logs the epoch range
+    it wrote (see ingest_manifest.record_ingest), so an entry stays valid as long as
+    no later write overlaps its range - also when readings are backfilled into the
+    past. Entries without a range, or older than the write log reaches, are dropped
+    as soon as the generation moves. Without a known ingest state nothing is cached.
+    With a `path`, the cache is loaded from and written back to a JSON file.
+    """
+    def __init__(self, max_entries=MAX_ENTRIES, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = OrderedDict(ujson.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Could not read result cache '{path}', starting empty: {e}")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, ingest):
+        """Returns the cached result, or None when absent or invalidated by newer data."""
+        if ingest is None:
+            return None
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if _unaffected(entry, ingest):
+                    entry["generation"] = ingest["generation"]
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry["result"]
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, result, ingest, range_start=None, range_end=None):
+        """
+        Stores a result computed at the `ingest` state (see ingest_manifest.ingest_state);
+        `range_start`/`range_end` (epochs, None for open-ended) bound the data it was computed from.
+        Without either bound the result depends on everything ingested.
+        """
+        if ingest is None:
+            return
+        covered = None if range_start is None and range_end is None else [range_start, range_end]
+        with self._lock:
+            self.entries[key] = {"result": result, "generation": ingest["generation"], "range": covered}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if self.path:
+                self._save()
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            if self.path:
+                self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            ujson.dump(list(self.entries.items()), f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,210 @@
+import argparse
+import ujson
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
+from metrics import count, timer
+
+# --- Constants ---
+PAGE_SIZE = 5000
+# Filtered candidate sets up to this size are ranked exactly on their stored embeddings;
+# larger ones go through Chroma's HNSW search with the filter applied there
+EXACT_PREFILTER_LIMIT = 20000
+
+def build_where(date: Optional[str] = None, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                level: Optional[str] = None, doc_type: Optional[str] = None,
+                where: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Combines the shorthand filters with an optional raw Chroma `where` clause.
+    Dates are the 'date' metadata (YYYY-MM-DD) that readings, hour/day rollups and
+    pattern documents carry; a date range becomes an $in over its days, since Chroma
+    only compares numbers.
+    """
+    conditions = []
+    if date:
+        conditions.append({"date": date})
+    if start_date or end_date:
+        days = pd.date_range(start_date or end_date, end_date or start_date, freq="D").strftime("%Y-%m-%d")
+        conditions.append({"date": {"$in": list(days)}})
+    if level:
+        conditions.append({"level": level})
+    if doc_type:
+        conditions.append({"doc_type": doc_type})
+    if where:
+        conditions.append(where)
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def iter_filtered(collection, where: Optional[Dict[str, Any]], include=("documents", "metadatas"),
+                  limit: Optional[int] = None, page_size: int = PAGE_SIZE):
+    """Yields Chroma get() pages matching `where`, up to `limit` ids in total (None = all)."""
+    offset = 0
+    while limit is None or offset < limit:
+        size = page_size if limit is None else min(page_size, limit - offset)
+        with timer("chroma", op="get"):
+            page = collection.get(where=where, include=list(include), limit=size, offset=offset)
+        if page["ids"]:
+            yield page
+        if len(page["ids"]) < size:
+            break
+        offset += size
+
+def _merge_pages(pages, keys):
+    merged = {key: [] for key in keys}
+    for page in pages:
+        for key in keys:
+            merged[key].extend(page[key])
+    return merged
+
+class Retriever:
+    """
+    Serves filter-only requests with paged metadata gets and semantic requests with a
+    vector search behind a metadata prefilter. The query is only embedded when the
+    request has query text and the filter left candidates, so filter-only lookups never
+    load the model. `embedding_function` maps a list of texts to vectors (normally a
+    lazy CachedEmbeddingFunction); `vector_index` optionally ranks prefiltered
+    candidates with the quantized in-process index (see vector_index.QuantizedIndex).
+    """
+    def __init__(self, collection, embedding_function=None, vector_index=None,
+                 exact_prefilter_limit=EXACT_PREFILTER_LIMIT):
+        self.collection = collection
+        self.embedding_function = embedding_function
+        self.vector_index = vector_index
+        self.exact_prefilter_limit = exact_prefilter_limit
+
+    def retrieve(self, query: str = "", n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+                 limit: Optional[int] = None, backend: str = "chroma", **filters) -> Dict[str, Any]:
+        """
+        Returns {'mode', 'ids', 'documents', 'metadatas', 'distances'}. Without query text
+        every matching document is returned (or the first `limit`) and distances are None;
+        with query text the best `n_results` are returned. `filters` are the shorthand
+        arguments of build_where.
+        """
+        where = build_where(where=where, **filters)
+        if not query or not query.strip():
+            if where is None and limit is None:
+                raise ValueError("A filter-only request needs a filter or a limit.")
+            count("retrieval_requests", mode="filter")
+            return self.filter_only(where, limit)
+        count("retrieval_requests", mode="semantic")
+        return self.semantic(query, n_results, where, backend)
+
+    def filter_only(self, where: Optional[Dict[str, Any]], limit: Optional[int] = None) -> Dict[str, Any]:
+        result = _merge_pages(iter_filtered(self.collection, where, limit=limit), ("ids", "documents", "metadatas"))
+        return dict(result, mode="filter", distances=None)
+
+    def _embed(self, query):
+        if self.embedding_function is None:
+            raise ValueError("Semantic retrieval needs an embedding function.")
+        with timer("embed", kind="query"):
+            return np.asarray(self.embedding_function([query]), dtype=np.float32)
+
+    def semantic(self, query: str, n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+                 backend: str = "chroma") -> Dict[str, Any]:
+        if backend not in ("chroma", "quantized"):
+            raise ValueError(f"Unknown backend: {backend}")
+        if backend == "quantized" and self.vector_index is None:
+            raise ValueError("Retriever has no quantized index.")
+
+        candidates = None
+        if where is not None:
+            # Resolve the filter first: an empty result needs no model at all, and a small
+            # one is ranked exactly instead of hoping the filtered HNSW walk finds it
+            pages = iter_filtered(self.collection, where, include=(), limit=self.exact_prefilter_limit + 1)
+            candidates = _merge_pages(pages, ("ids",))["ids"]
+            if not candidates:
+                return {"mode": "semantic", "ids": [], "documents": [], "metadatas": [], "distances": []}
+            if len(candidates) > self.exact_prefilter_limit and backend == "chroma":
+                candidates = None
+
+        query_embedding = self._embed(query)
+        if backend == "quantized":
+            rows = None
+            if where is not None:
+                if candidates is None:
+                    candidates = _merge_pages(iter_filtered(self.collection, where, include=()), ("ids",))["ids"]
+                rows = [self.vector_index.rows[item_id] for item_id in candidates if item_id in self.vector_index.rows]
+            with timer("vector_index", op="search"):
+                ids, distances = self.vector_index.search(query_embedding, k=n_results, rows=rows)
+            return self._fetch(ids[0], distances[0])
+        if candidates is not None:
+            return self._rank_exact(query_embedding[0], candidates, n_results)
+
+        with timer("chroma", op="query"):
+            results = self.collection.query(query_embeddings=query_embedding, n_results=n_results, where=where)
+        return {
+            "mode": "semantic",
+            "ids": results["ids"][0],
+            "documents": results["documents"][0],
+            "metadatas": results["metadatas"][0],
+            "distances": results["distances"][0],
+        }
+
+    def _rank_exact(self, query_embedding, candidates, n_results):
+        """Cosine top-k over the stored embeddings of the candidate ids."""
+        embeddings = []
+        for start in range(0, len(candidates), PAGE_SIZE):
+            with timer("chroma", op="get"):
+                page = self.collection.get(ids=candidates[start:start + PAGE_SIZE], include=["embeddings"])
+            embeddings.extend(zip(page["ids"], page["embeddings"]))
+        ids = [item_id for item_id, _ in embeddings]
+        matrix = np.asarray([vector for _, vector in embeddings], dtype=np.float32)
+        with timer("retrieval", op="rank_exact"):
+            norms = np.linalg.norm(matrix, axis=1) * max(np.linalg.norm(query_embedding), 1e-12)
+            distances = 1.0 - (matrix @ query_embedding) / np.maximum(norms, 1e-12)
+            top = np.argsort(distances, kind="stable")[:n_results]
+        return self._fetch([ids[i] for i in top], [float(distances[i]) for i in top])
+
+    def _fetch(self, ids: List[str], distances: List[float]) -> Dict[str, Any]:
+        """Documents and metadata for ranked ids, keeping the ranking; ids no longer in Chroma are skipped."""
+        with timer("chroma", op="get"):
+            found = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {item_id: (document, metadata) for item_id, document, metadata
+                 in zip(found["ids"], found["documents"], found["metadatas"])}
+        hits = [(item_id, distance) for item_id, distance in zip(ids, distances) if item_id in by_id]
+        return {
+            "mode": "semantic",
+            "ids": [item_id for item_id, _ in hits],
+            "documents": [by_id[item_id][0] for item_id, _ in hits],
+            "metadatas": [by_id[item_id][1] for item_id, _ in hits],
+            "distances": [distance for _, distance in hits],
+        }
+
+def open_retriever(vector_index=None):
+    """
+    Opens the indexed collection with a lazy, cache-backed embedding function: the
+    model is only loaded by the first semantic query with uncached text.
+    """
+    import chromadb
+    import main
+    from chromadb.utils import embedding_functions
+    from embedding_cache import CachedEmbeddingFunction
+
+    embedding_function = CachedEmbeddingFunction(
+        embedding_functions.SentenceTransformerEmbeddingFunction,
+        model_name=main.EMBEDDING_MODEL,
+        cache_dir=main.EMBEDDING_CACHE_PATH
+    )
+    collection = chromadb.PersistentClient(path=main.CHROMA_DB_PATH).get_collection(
+        name=main.COLLECTION_NAME,
+        embedding_function=embedding_function
+    )
+    return Retriever(collection, embedding_function, vector_index=vector_index)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieve documents by metadata filter and/or semantic query.")
+    parser.add_argument("query", nargs="?", default="", help="Query text; leave empty for a filter-only lookup.")
+    parser.add_argument("--n_results", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=None, help="Maximum documents for a filter-only lookup.")
+    parser.add_argument("--date", type=str, default=None)
+    parser.add_argument("--start_date", type=str, default=None)
+    parser.add_argument("--end_date", type=str, default=None)
+    parser.add_argument("--level", type=str, default=None, help="Rollup level: hour, day, week or month.")
+    parser.add_argument("--doc_type", type=str, default=None)
+    args = parser.parse_args()
+
+    results = open_retriever().retrieve(
+        args.query, n_results=args.n_results, limit=args.limit, date=args.date,
+        start_date=args.start_date, end_date=args.end_date, level=args.level, doc_type=args.doc_type)
+    print(ujson.dumps(results, indent=4, ensure_ascii=False))
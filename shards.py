@@ -0,0 +1,288 @@
+import os
+import re
+import glob
+import hashlib
+import argparse
+import itertools
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+import ujson
+import pandas as pd
+from metrics import count, timer
+from ingest_manifest import MANIFEST_FILENAME, ingest_state, load_manifest, record_ingest, save_manifest
+from smart_database import COUNTER_COLUMNS, ROLLUP_STATE_FILENAME
+
+# --- Constants ---
+SHARD_ROOT = os.path.join(os.getcwd(), "shards")
+CATALOG_FILENAME = "catalog.json"
+CATALOG_VERSION = 1
+COLLECTION_PREFIX = "smartmeter_data"
+ALL_METERS = "*"     # selects every meter in the catalog
+ALL_YEARS = "all"    # shard key of a meter that is not split per year
+FANOUT_WORKERS = 8   # upper bound on threads scanning shards at the same time
+
+def fanout_workers(shards: int) -> int:
+    """Threads for a fan-out over `shards` shards; reads are I/O bound, so a few more than the cores."""
+    return max(1, min(FANOUT_WORKERS, shards, (os.cpu_count() or 1) * 2))
+
+def _slug(meter: str) -> str:
+    """File and collection safe form of a meter id; a hash keeps ids that differ only in other characters apart."""
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", meter).strip("-_")
+    if slug != meter:
+        slug = f"{slug}-{hashlib.sha1(meter.encode()).hexdigest()[:8]}".strip("-")
+    return slug
+
+def collection_name(meter: str) -> str:
+    return f"{COLLECTION_PREFIX}_{_slug(meter)}"
+
+def year_span(year: int) -> tuple:
+    """First and last epoch of a UTC year, the range a per-year shard holds."""
+    start = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
+    return start, int(datetime(year + 1, 1, 1, tzinfo=timezone.utc).timestamp()) - 1
+
+class ShardCatalog:
+    """
+    The meters under `root` and their shards. Every meter has its own collection
+    (with its rollups, top-K indexes and ingest manifest) in `chroma_path`, and one
+    numeric store, or one per UTC year when it is split per year. Queries use the
+    catalog to pick the shards that overlap their range (see tools.query_aggregator_batch
+    and query_ai.ShardedChromaManager).
+    """
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or SHARD_ROOT
+        self.path = os.path.join(self.root, CATALOG_FILENAME)
+        self.chroma_path = os.path.join(self.root, "chroma_db")
+        self.data = {"version": CATALOG_VERSION, "meters": {}}
+        self.written = {} # meter -> (first, last) epoch routed to its stores since the last refresh
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.data = ujson.load(f)
+            if self.data.get("version") != CATALOG_VERSION:
+                raise ValueError(f"Unsupported shard catalog version: {self.data.get('version')}")
+
+    def save(self):
+        """Writes the catalog atomically, like the ingest manifest."""
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            ujson.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    # --- Meters ---
+    def meters(self) -> List[str]:
+        return sorted(self.data["meters"])
+
+    def resolve(self, meters) -> List[str]:
+        """Meter ids for a selection: ALL_METERS, one id or a list of ids. Unknown ids raise ValueError."""
+        if meters == ALL_METERS:
+            return self.meters()
+        if isinstance(meters, str):
+            meters = [meters]
+        unknown = [meter for meter in meters if meter not in self.data["meters"]]
+        if unknown:
+            raise ValueError(f"Unknown meter(s): {', '.join(unknown)}")
+        return sorted(dict.fromkeys(meters))
+
+    def meter(self, meter: str, per_year: bool = False) -> Dict[str, Any]:
+        """The catalog entry of `meter`, created on first use. A meter keeps the layout it was created with."""
+        entry = self.data["meters"].get(meter)
+        if entry is None:
+            entry = {"collection": collection_name(meter), "per_year": per_year, "shards": {}, "watermark": None}
+            self.data["meters"][meter] = entry
+        return entry
+
+    def manifest_path(self, meter: str) -> str:
+        return os.path.join(self.chroma_path, f"{self.meter(meter)['collection']}.{MANIFEST_FILENAME}")
+
+    def rollup_state_path(self, meter: str) -> str:
+        # Next to the collection, so the top-K indexes land where query_ai.ChromaManager looks for them
+        return os.path.join(self.chroma_path, f"{self.meter(meter)['collection']}.{ROLLUP_STATE_FILENAME}")
+
+    # --- Shards ---
+    def shard_key(self, meter: str, epoch: int) -> str:
+        if not self.meter(meter)["per_year"]:
+            return ALL_YEARS
+        return str(datetime.fromtimestamp(epoch, timezone.utc).year)
+
+    def store_path(self, meter: str, key: str) -> str:
+        """Numeric store of one shard; the shard is registered when it is new."""
+        entry = self.meter(meter)
+        shard = entry["shards"].get(key)
+        if shard is None:
+            start, end = (None, None) if key == ALL_YEARS else year_span(int(key))
+            shard = {"store": os.path.join("stores", _slug(meter), key), "start": start, "end": end}
+            entry["shards"][key] = shard
+        return os.path.join(self.root, shard["store"])
+
+    def shards(self, meters, start_epoch: int, end_epoch: int) -> List[Dict[str, Any]]:
+        """The shards of `meters` whose span overlaps the range, with absolute store paths."""
+        selected = []
+        for meter in self.resolve(meters):
+            for key, shard in sorted(self.data["meters"][meter]["shards"].items()):
+                if shard["start"] is not None and (shard["start"] > end_epoch or shard["end"] < start_epoch):
+                    continue
+                selected.append({"meter": meter, "key": key, "store": os.path.join(self.root, shard["store"]),
+                                 "start": shard["start"], "end": shard["end"]})
+        return selected
+
+    def store_for(self, meter: str, year: Optional[int] = None) -> Optional[str]:
+        """The one store that holds `year` of the meter; None when there is none (or a per-year meter is asked for all years)."""
+        entry = self.meter(meter)
+        shard = entry["shards"].get(str(year) if entry["per_year"] else ALL_YEARS)
+        return os.path.join(self.root, shard["store"]) if shard else None
+
+    # --- Watermarks ---
+    def note_written(self, meter: str, written: Optional[tuple]):
+        """Widens the epoch range written to the meter's stores since its last refresh."""
+        if written is None:
+            return
+        first, last = self.written.get(meter, written)
+        self.written[meter] = (min(first, written[0]), max(last, written[1]))
+
+    def refresh(self, meter: str) -> Optional[int]:
+        """
+        Sets the meter's watermark to the last epoch in its stores and records the range
+        written since the last refresh in the catalog's ingest log; returns the watermark.
+        """
+        from numeric_store import NumericStore
+        ends = []
+        for shard in self.data["meters"][meter]["shards"].values():
+            bounds = NumericStore(os.path.join(self.root, shard["store"])).bounds()
+            if bounds is not None:
+                ends.append(bounds[1])
+        self.data["meters"][meter]["watermark"] = max(ends) if ends else None
+        record_ingest(self.data, self.written.pop(meter, None), meter)
+        return self.data["meters"][meter]["watermark"]
+
+    def ingest_state(self, meters):
+        """
+        Ingest state of `meters` for the result cache (see ingest_manifest.ingest_state):
+        one generation for the whole catalog, with only the writes of these meters.
+        """
+        return ingest_state(self.data, self.resolve(meters))
+
+# --- Ingestion ---
+def route_readings(batches: Iterable[tuple], catalog: ShardCatalog, meter: str):
+    """
+    Passes batches through unchanged while appending their numeric readings to the
+    meter's shard stores, split by UTC year when the meter is sharded per year.
+    """
+    import main
+    from numeric_store import NumericStore
+    stores = {}
+    for documents, metadatas, ids in batches:
+        if metadatas:
+            keys = [catalog.shard_key(meter, metadata["epoch"]) for metadata in metadatas]
+            for key in dict.fromkeys(keys):
+                rows = [i for i, row_key in enumerate(keys) if row_key == key]
+                if key not in stores:
+                    stores[key] = NumericStore(catalog.store_path(meter, key))
+                part = ([documents[i] for i in rows], [metadatas[i] for i in rows], [ids[i] for i in rows])
+                for _ in main.store_numeric_readings([part], stores[key]):
+                    pass
+                catalog.note_written(meter, stores[key].take_written())
+                count("shard_records", len(rows), meter=meter)
+        yield documents, metadatas, ids
+
+def load_meter_readings(catalog: ShardCatalog, meter: str, since_epoch: Optional[int] = None) -> pd.DataFrame:
+    """The meter's cumulative readings from all of its shards, as smart_database.load_store_readings returns them."""
+    from numeric_store import NumericStore
+    from smart_database import load_store_readings
+    frames = []
+    for shard in catalog.shards(meter, since_epoch if since_epoch is not None else 0, 2**62):
+        df = load_store_readings(NumericStore(shard["store"]), since_epoch)
+        if not df.empty:
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=list(COUNTER_COLUMNS), index=pd.DatetimeIndex([]))
+    return pd.concat(frames).sort_index()
+
+def ingest_meter(catalog: ShardCatalog, meter: str, data_dir: str, per_year: bool = False, workers: int = 0,
+                 batch_size: Optional[int] = None, backend: Optional[str] = None):
+    """
+    Indexes the new readings of one meter like main.run_indexing does for the single
+    collection: reading documents go to the meter's collection, numeric readings to its
+    shard stores, then its rollups and watermark are brought up to date.
+    Returns the pipeline stats, or None when there was nothing new.
+    """
+    import main
+    from embedding_cache import EMBEDDING_CACHE_PATH
+    from ingest_pipeline import run_pipeline
+    from smart_database import load_rollup_state, rollup_cutoff, update_rollups
+
+    entry = catalog.meter(meter, per_year)
+    manifest_path = catalog.manifest_path(meter)
+    manifest = load_manifest(manifest_path)
+    batches = main.iter_record_batches(batch_size or main.BATCH_SIZE, manifest=manifest, data_dir=data_dir)
+    first_batch = next(batches, None)
+    if first_batch is None:
+        save_manifest(manifest, manifest_path)
+        print(f"No new readings for meter '{meter}'.")
+        return None
+
+    backend = backend or main.EMBEDDING_BACKEND
+    collection = main.setup_chroma_db(backend=backend, path=catalog.chroma_path, name=entry["collection"])
+    stats = run_pipeline(
+        collection,
+        route_readings(itertools.chain([first_batch], batches), catalog, meter),
+        main.EMBEDDING_MODEL,
+        workers=workers,
+        manifest=manifest,
+        save_manifest=lambda snapshot: save_manifest(snapshot, manifest_path),
+        cache_dir=EMBEDDING_CACHE_PATH,
+        backend=backend
+    )
+    save_manifest(manifest, manifest_path)
+    catalog.save() # new shards are registered before anything reads them
+
+    state_path = catalog.rollup_state_path(meter)
+    written = catalog.written.get(meter) # recorded in the catalog's ingest log by refresh below
+    with timer("ingest_stage", stage="rollups"):
+        since_epoch = rollup_cutoff(load_rollup_state(state_path), written)
+        update_rollups(collection, load_meter_readings(catalog, meter, since_epoch), state_path, written)
+
+    # As in run_indexing, the watermark only advances once every derived store is up to date
+    manifest["watermark"] = catalog.refresh(meter)
+    save_manifest(manifest, manifest_path)
+    catalog.save()
+    print(f"Meter '{meter}': {stats['documents']} documents upserted, {len(entry['shards'])} shard(s).")
+    return stats
+
+def meter_dirs(data_root: str) -> Dict[str, str]:
+    """{meter id: directory} for every subdirectory of `data_root` that holds .jsonl logs."""
+    meters = {}
+    for path in sorted(glob.glob(os.path.join(data_root, "*", ""))):
+        path = os.path.dirname(path)
+        if glob.glob(os.path.join(path, "*.jsonl")):
+            meters[os.path.basename(path)] = path
+    return meters
+
+def ingest_meters(data_root: str, catalog: Optional[ShardCatalog] = None, per_year: bool = False,
+                  workers: int = 0, batch_size: Optional[int] = None, backend: Optional[str] = None) -> Dict[str, Any]:
+    """Indexes every meter directory under `data_root` into its own shards; returns {meter: stats}."""
+    catalog = catalog or ShardCatalog()
+    results = {}
+    for meter, data_dir in meter_dirs(data_root).items():
+        results[meter] = ingest_meter(catalog, meter, data_dir, per_year=per_year, workers=workers,
+                                      batch_size=batch_size, backend=backend)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index one directory of P1 logs per meter into sharded collections and stores.")
+    parser.add_argument("action", choices=["ingest", "list"])
+    parser.add_argument("--data-root", type=str, default=None, help="Directory with one subdirectory of .jsonl logs per meter.")
+    parser.add_argument("--root", type=str, default=SHARD_ROOT, help="Directory of the shard catalog, collections and stores.")
+    parser.add_argument("--per-year", action="store_true", help="Split the numeric store of new meters per UTC year.")
+    parser.add_argument("--workers", type=int, default=0, help="Embedding worker processes (0 = one in-process thread).")
+    parser.add_argument("--embedding-backend", type=str, default=None, help="Embedding inference backend (see embedding_backend.py).")
+    args = parser.parse_args()
+
+    catalog = ShardCatalog(args.root)
+    if args.action == "ingest":
+        if not args.data_root:
+            parser.error("ingest needs --data-root")
+        ingest_meters(args.data_root, catalog, per_year=args.per_year, workers=args.workers, backend=args.embedding_backend)
+    for meter in catalog.meters():
+        entry = catalog.data["meters"][meter]
+        print(f"{meter:<20} {entry['collection']:<40} shards: {', '.join(sorted(entry['shards'])) or '-'}"
+              f"  watermark: {entry['watermark']}")
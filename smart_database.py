@@ -1,79 +1,307 @@
 
+import os
+import json
+import shutil
+import argparse
 import pandas as pd
 import chromadb
 import numpy as np
+from metrics import METRICS, enable_profiling, profiled, timer
+from topk_index import TOPK_INDEX_DIRNAME, index_path, load_index, rebuild_index, update_index
+from ingest_manifest import MANIFEST_FILENAME, load_manifest, record_ingest, save_manifest
 
 # --- Configuratie ---
 CSV_PATH = "C:\\Users\\emanu\\Documenten\\GitHub\\smartmeter-rag\\overige\\P1metingen.csv"
 CHROMA_PATH = "C:\\Users\\emanu\\Documenten\\GitHub\\smartmeter-rag\\chroma_db"
 COLLECTION_NAME = "smartmeter_data"
+ROLLUP_STATE_FILENAME = "rollup_state.json"
+CSV_CACHE_FILENAME = "P1metingen.parquet" # geconverteerde CSV naast de collectie, zie load_csv_readings
+CSV_CHUNK_ROWS = 1_000_000
 
-def setup_database():
+# Niveau -> (pandas period-frequentie, ID-formaat)
+ROLLUP_LEVELS = {
+    "hour": ("h", "hour_%Y-%m-%dT%H"),
+    "day": ("D", "day_%Y-%m-%d"),
+    "week": ("W", "week_%Y-%U"), # %U voor weeknummer (zondag als eerste dag), gelabeld op de zondag
+    "month": ("M", "month_%Y-%m"),
+}
+# Cumulatieve meterstand -> naam van het verschil in de rollup-metadata
+COUNTER_COLUMNS = {
+    "total_power_import_kwh": "total_import_kwh",
+    "total_power_export_kwh": "total_export_kwh",
+    "total_gas_m3": "total_gas_m3",
+}
+
+# Alleen de kolommen die de rollups gebruiken, met vaste types in plaats van afgeleide.
+# De cumulatieve standen blijven float64: bij standen boven 10.000 kWh houdt float32
+# de wattuur-decimalen niet meer vast, en de rollups zijn juist verschillen van standen.
+CSV_DTYPES = {"timestamp": "int64", **{column: "float64" for column in COUNTER_COLUMNS}}
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # zonder pyarrow wordt de CSV elke keer gelezen
+    pa = pq = None
+
+def load_rollup_state(path):
+    """Geeft per niveau de start (epoch) van de laatst bijgewerkte periode terug."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_rollup_state(state, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+def compute_rollups(df, level):
+    """
+    Berekent per periode van `level` het verbruik (max - min van elke cumulatieve
+    meterstand) volledig gevectoriseerd. `df` heeft een DatetimeIndex (UTC, zonder tijdzone).
+    Geeft (ids, documents, metadatas, period_starts) terug.
+    """
+    freq, id_format = ROLLUP_LEVELS[level]
+    columns = [column for column in COUNTER_COLUMNS if column in df.columns]
+    periods = df.index.to_period(freq)
+    grouped = df[columns].groupby(periods).agg(['min', 'max'])
+    grouped = grouped.dropna(how='all')
+    if grouped.empty:
+        return [], [], [], np.empty(0, dtype="int64")
+
+    period_index = grouped.index
+    starts = period_index.start_time
+    labels = period_index.end_time.normalize() if level == "week" else starts
+    ids = list(labels.strftime(id_format))
+
+    meta = pd.DataFrame({"level": level, "year": labels.year, "month": labels.month}, index=grouped.index)
+    if level == "week":
+        meta["week_of_year"] = labels.isocalendar().week.to_numpy()
+    if level in ("hour", "day"):
+        meta["date"] = starts.strftime("%Y-%m-%d")
+    if level == "hour":
+        meta["hour"] = starts.hour
+    for column in columns:
+        meta[COUNTER_COLUMNS[column]] = (grouped[(column, 'max')] - grouped[(column, 'min')]).fillna(0.0)
+    period_starts = ((starts - pd.Timestamp("1970-01-01")) // pd.Timedelta(seconds=1)).to_numpy()
+    meta["period_start"] = period_starts
+
+    metadatas = meta.to_dict('records')
+    return ids, list(ids), metadatas, period_starts
+
+def _upsert_changed(collection, ids, documents, metadatas, chunk_size=5000):
     """
-    Leest de CSV, transformeert de data en migreert deze naar een nieuwe,
-    schone ChromaDB collectie met uitgebreide metadata.
+    Upsert alleen records die nieuw zijn of waarvan de metadata gewijzigd is.
+    Geeft (aantal bijgewerkt, set van ids die nog niet bestonden) terug.
+    """
+    changed_total = 0
+    new_ids = set()
+    for start in range(0, len(ids), chunk_size):
+        chunk_ids = ids[start:start + chunk_size]
+        with timer("chroma", op="get"):
+            existing = collection.get(ids=chunk_ids, include=["metadatas"])
+        existing_metadata = dict(zip(existing['ids'], existing['metadatas']))
+        new_ids.update(record_id for record_id in chunk_ids if record_id not in existing_metadata)
+        changed = [
+            i for i in range(start, start + len(chunk_ids))
+            if existing_metadata.get(ids[i]) != metadatas[i]
+        ]
+        if changed:
+            with timer("chroma", op="upsert"):
+                collection.upsert(
+                    documents=[documents[i] for i in changed],
+                    metadatas=[metadatas[i] for i in changed],
+                    ids=[ids[i] for i in changed]
+                )
+        changed_total += len(changed)
+    return changed_total, new_ids
+
+def period_start(level, epoch):
+    """Begin (epoch) van de `level`-periode waarin `epoch` valt."""
+    freq, _ = ROLLUP_LEVELS[level]
+    return timestamp_epoch(pd.Timestamp(epoch, unit='s').to_period(freq).start_time)
+
+def timestamp_epoch(timestamp):
+    """Epoch van een naive UTC-tijdstip uit de index van de metingen."""
+    return int((timestamp - pd.Timestamp("1970-01-01")) // pd.Timedelta(seconds=1))
+
+def rollup_starts(state, written=None):
+    """
+    Per niveau de epoch vanaf waar opnieuw berekend wordt: de laatst bijgewerkte
+    (open) periode, of de periode van de eerste meting in `written` (eerste, laatste
+    epoch) als er eerder in de tijd is geschreven, bv. een laat of opnieuw ingelezen bestand.
+    """
+    starts = {}
+    for level in ROLLUP_LEVELS:
+        if level in state:
+            starts[level] = state[level] if written is None else min(state[level], period_start(level, written[0]))
+    return starts
+
+def rollup_cutoff(state, written=None):
+    """Vroegste epoch die nodig is om alle nog open en bijgeschreven periodes opnieuw te berekenen (None = alles)."""
+    if any(level not in state for level in ROLLUP_LEVELS):
+        return None
+    return min(rollup_starts(state, written).values())
+
+def load_store_readings(store, since_epoch=None):
+    """
+    Leest de cumulatieve meterstanden vanaf `since_epoch` uit de numerieke store
+    als DataFrame met een DatetimeIndex, in hetzelfde formaat als de CSV.
+    """
+    bounds = store.bounds()
+    if bounds is None:
+        return pd.DataFrame(columns=list(COUNTER_COLUMNS), index=pd.DatetimeIndex([]))
+    data = store.read_range(since_epoch if since_epoch is not None else bounds[0], bounds[1], list(COUNTER_COLUMNS))
+    df = pd.DataFrame(
+        {column: data[column] for column in COUNTER_COLUMNS},
+        index=pd.to_datetime(data["epoch"], unit='s')
+    )
+    return df.dropna(axis=1, how='all')
+
+def _csv_signature(csv_path):
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def iter_csv_chunks(csv_path, engine="c", chunksize=CSV_CHUNK_ROWS):
+    """
+    Leest de CSV in blokken van `chunksize` regels met de types uit CSV_DTYPES.
+    De pyarrow-engine leest multi-threaded maar kent geen blokken: die levert één DataFrame.
+    """
+    header = pd.read_csv(csv_path, nrows=0).columns
+    dtypes = {column: dtype for column, dtype in CSV_DTYPES.items() if column in header}
+    if engine == "pyarrow":
+        yield pd.read_csv(csv_path, usecols=list(dtypes), dtype=dtypes, engine="pyarrow")
+        return
+    yield from pd.read_csv(csv_path, usecols=list(dtypes), dtype=dtypes, chunksize=chunksize)
+
+def load_csv_readings(csv_path, since_epoch=None, cache_path=None, engine="c", chunksize=CSV_CHUNK_ROWS):
+    """
+    Geeft de metingen vanaf `since_epoch` als DataFrame met een DatetimeIndex.
+    Met `cache_path` wordt de geconverteerde CSV als Parquet bewaard en hergebruikt
+    zolang de CSV niet veranderd is (grootte en mtime); dan worden alleen de
+    row groups vanaf `since_epoch` gelezen. Anders wordt de CSV in blokken gelezen
+    en blijft alleen wat na `since_epoch` valt in het geheugen.
+    """
+    if pq is None:
+        cache_path = None
+    signature = _csv_signature(csv_path)
+    signature_path = f"{cache_path}.json"
+    cached = False
+    if cache_path and os.path.exists(cache_path) and os.path.exists(signature_path):
+        with open(signature_path, 'r') as f:
+            cached = json.load(f) == signature
+
+    if cached:
+        with timer("rollup_stage", stage="read_csv_cache"):
+            filters = [("timestamp", ">=", since_epoch)] if since_epoch is not None else None
+            df = pd.read_parquet(cache_path, filters=filters)
+    else:
+        chunks, writer = [], None
+        tmp_path = f"{cache_path}.tmp"
+        with timer("rollup_stage", stage="read_csv"):
+            for chunk in iter_csv_chunks(csv_path, engine, chunksize):
+                if cache_path:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_path, table.schema)
+                    writer.write_table(table)
+                if since_epoch is not None:
+                    chunk = chunk[chunk['timestamp'] >= since_epoch]
+                if len(chunk):
+                    chunks.append(chunk)
+        if writer is not None:
+            writer.close()
+            os.replace(tmp_path, cache_path)
+            with open(signature_path, 'w') as f:
+                json.dump(signature, f)
+        df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(
+            {column: pd.Series(dtype=dtype) for column, dtype in CSV_DTYPES.items()})
+
+    with timer("rollup_stage", stage="dataframe_build"):
+        df.index = pd.to_datetime(df.pop('timestamp'), unit='s')
+        if not df.index.is_monotonic_increasing:
+            df.sort_index(inplace=True)
+    return df
+
+def update_rollups(collection, df, state_path, written=None):
+    """
+    Werkt de uur-, dag-, week- en maand-rollups bij vanuit de metingen in `df`.
+    Per niveau worden alleen periodes vanaf de laatst bijgewerkte periode herberekend,
+    zodat nieuwe metingen alleen de lopende periodes raken; `written` (eerste, laatste
+    epoch die in de store is geschreven) haalt dat begin naar voren voor bijgeschreven
+    metingen (zie rollup_starts). `df` moet dan vanaf rollup_cutoff(state, written) lopen.
+    De begrensde top-K index per niveau en richting (naast `state_path`) wordt meteen
+    mee bijgewerkt, ook voor herberekende oudere periodes.
+    """
+    state = load_rollup_state(state_path)
+    starts = rollup_starts(state, written)
+    for level in ROLLUP_LEVELS:
+        level_df = df
+        if level in starts:
+            level_df = df[df.index >= pd.Timestamp(starts[level], unit='s')]
+        with timer("rollup_stage", stage="compute", level=level):
+            ids, documents, metadatas, period_starts = compute_rollups(level_df, level)
+        if not ids:
+            continue
+        chroma_path = os.path.dirname(state_path)
+        if level in state and load_index(index_path(chroma_path, collection.name, level)) is None:
+            # Eerdere rollups zonder (actuele) index: eenmalig opbouwen vanuit de collectie
+            with timer("rollup_stage", stage="topk_rebuild", level=level):
+                rebuild_index(collection, chroma_path, level)
+        changed, new_ids = _upsert_changed(collection, ids, documents, metadatas)
+        with timer("rollup_stage", stage="topk_index", level=level):
+            update_index(chroma_path, collection.name, level, ids, metadatas, new_ids=new_ids)
+        state[level] = int(period_starts.max())
+        print(f"{changed} van {len(ids)} {level}-documenten bijgewerkt in de database.")
+    save_rollup_state(state, state_path)
+
+def setup_database(rebuild=False, engine="c", csv_cache=True):
+    """
+    Leest de CSV en werkt de uur/dag/week/maand-rollups in de ChromaDB collectie
+    incrementeel bij. Alleen nieuwe of gewijzigde periodes worden ge-upsert; met
+    `rebuild` wordt de collectie eerst volledig opnieuw opgebouwd. De CSV wordt in
+    blokken (of met `engine='pyarrow'`) gelezen en met `csv_cache` als Parquet bewaard.
     """
     print("--- Stap 1: Database opzetten ---")
     print("Data inlezen en voorbereiden...")
-    df = pd.read_csv(CSV_PATH)
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-    df.set_index('timestamp', inplace=True)
-    df.sort_index(inplace=True)
-
-    # Bereken dagelijkse import/export
-    df_day = df.resample('D').agg(
-        daily_import=('total_power_import_kwh', lambda x: x.max() - x.min() if not x.empty else 0),
-        daily_export=('total_power_export_kwh', lambda x: x.max() - x.min() if not x.empty else 0)
-    ).dropna()
-
-    # Bereken wekelijkse import/export
-    df_week = df_day.resample('W').agg(
-        weekly_import=('daily_import', 'sum'),
-        weekly_export=('daily_export', 'sum')
-    ).dropna()
-    print("Data succesvol voorbereid.")
+    state_path = os.path.join(CHROMA_PATH, ROLLUP_STATE_FILENAME)
+    cutoff = None if rebuild else rollup_cutoff(load_rollup_state(state_path))
+    cache_path = os.path.join(CHROMA_PATH, CSV_CACHE_FILENAME) if csv_cache else None
+    if cache_path:
+        os.makedirs(CHROMA_PATH, exist_ok=True)
+
+    df = load_csv_readings(CSV_PATH, cutoff, cache_path=cache_path, engine=engine)
+    print(f"Data succesvol voorbereid ({len(df)} metingen).")
 
     # ChromaDB client initialiseren
     client = chromadb.PersistentClient(path=CHROMA_PATH)
 
-    # Oude collectie verwijderen voor een schone start
-    try:
-        client.delete_collection(name=COLLECTION_NAME)
-        print(f"Bestaande collectie '{COLLECTION_NAME}' verwijderd.")
-    except Exception:
-        pass # Collectie bestond niet, geen probleem.
-
-    collection = client.create_collection(name=COLLECTION_NAME)
-    print(f"Nieuwe, schone collectie '{COLLECTION_NAME}' aangemaakt.")
-
-    # Voeg week-data toe aan de collectie
-    print("Wekelijkse data toevoegen aan de database...")
-    documents_to_add = []
-    metadatas_to_add = []
-    ids_to_add = []
-
-    for index, row in df_week.iterrows():
-        week_id = f"week_{index.strftime('%Y-%U')}" # %U voor weeknummer (zondag als eerste dag)
-        ids_to_add.append(week_id)
-        
-        # Lege documenten, we focussen op metadata
-        documents_to_add.append(week_id)
-        
-        # Rijke metadata toevoegen
-        metadatas_to_add.append({
-            "level": "week",
-            "year": index.year,
-            "week_of_year": index.week,
-            "total_import_kwh": row['weekly_import'],
-            "total_export_kwh": row['weekly_export']
-        })
-
-    collection.add(
-        documents=documents_to_add,
-        metadatas=metadatas_to_add,
-        ids=ids_to_add
-    )
-    print(f"{len(ids_to_add)} week-documenten succesvol toegevoegd aan de database.")
+    # Alleen bij een expliciete rebuild de oude collectie verwijderen
+    if rebuild:
+        try:
+            client.delete_collection(name=COLLECTION_NAME)
+            print(f"Bestaande collectie '{COLLECTION_NAME}' verwijderd.")
+        except Exception:
+            pass # Collectie bestond niet, geen probleem.
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        shutil.rmtree(os.path.join(CHROMA_PATH, TOPK_INDEX_DIRNAME), ignore_errors=True)
+
+    collection = client.get_or_create_collection(name=COLLECTION_NAME)
+    print(f"Collectie '{COLLECTION_NAME}' is klaar.")
+
+    print("Rollups bijwerken in de database...")
+    update_rollups(collection, df, state_path)
+
+    # Net als main stap 5: het ingelezen bereik vastleggen, zodat gecachte resultaten
+    # (result_cache) die dit bereik raken na deze (her)opbouw vervallen
+    if len(df):
+        manifest_path = os.path.join(CHROMA_PATH, MANIFEST_FILENAME)
+        manifest = load_manifest(manifest_path)
+        record_ingest(manifest, (timestamp_epoch(df.index[0]), timestamp_epoch(df.index[-1])))
+        save_manifest(manifest, manifest_path)
     return collection
 
 def answer_export_question(collection):
@@ -85,7 +313,7 @@ def answer_export_question(collection):
 
     # Haal alle weken uit 2025 op, inclusief hun metadata
     results = collection.get(
-        where={"year": 2025}
+        where={"$and": [{"level": "week"}, {"year": 2025}]}
     )
 
     if not results or not results['ids']:
@@ -115,8 +343,22 @@ def answer_export_question(collection):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bouw of werk de rollup-collectie bij vanuit de P1 CSV.")
+    parser.add_argument("--rebuild", action="store_true", help="Verwijder de collectie en bouw alles opnieuw op.")
+    parser.add_argument("--engine", choices=["c", "pyarrow"], default="c",
+                        help="CSV-parser: 'c' leest in blokken, 'pyarrow' leest multi-threaded in één keer.")
+    parser.add_argument("--no-csv-cache", action="store_true", help="Lees altijd de CSV, zonder de Parquet-cache.")
+    parser.add_argument("--metrics", type=str, default=None, help="Schrijf de timings naar dit bestand (.prom of .jsonl).")
+    parser.add_argument("--profile", type=str, default=None, help="Schrijf een cProfile-dump naar deze map.")
+    args = parser.parse_args()
+
     # Stap 1: Zet de database op (of update deze)
-    db_collection = setup_database()
+    if args.profile:
+        enable_profiling(args.profile)
+    with profiled("setup_database"):
+        db_collection = setup_database(rebuild=args.rebuild, engine=args.engine, csv_cache=not args.no_csv_cache)
+    if args.metrics:
+        METRICS.export(args.metrics, command="setup_database")
     
     # Stap 2: Beantwoord de specifieke vraag
     answer_export_question(db_collection)
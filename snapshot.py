@@ -0,0 +1,259 @@
+import os
+import time
+import ujson
+import argparse
+import numpy as np
+from typing import Any, Dict, Iterator, List, Optional
+from metrics import count, timer
+
+# --- Constants ---
+CHROMA_DB_PATH = os.path.join(os.getcwd(), "chroma_db")
+COLLECTION_NAME = "smartmeter_data"
+SNAPSHOT_PATH = os.path.join(os.getcwd(), "snapshots", COLLECTION_NAME)
+SNAPSHOT_MANIFEST = "snapshot.json"
+SNAPSHOT_VERSION = 1
+FORMATS = ("ndjson", "npy")
+PAGE_SIZE = 2000     # records fetched per Chroma get, roughly
+SHARD_SIZE = 100_000 # records per shard file
+INCLUDE = ["documents", "metadatas", "embeddings"]
+# Numeric metadata the export cursor walks; every document kind carries one of them:
+# readings 'epoch', rollups and day pattern summaries 'period_start'
+CURSOR_KEYS = ("epoch", "period_start")
+CURSOR_END = 1 << 40   # beyond any epoch
+WINDOW_SECONDS = 3600  # first cursor window; it grows or shrinks to about `page_size` records
+
+def _window(key, start, end):
+    return {"$and": [{key: {"$gte": start}}, {key: {"$lt": end}}]}
+
+def _has_records(collection, key, start, end):
+    with timer("snapshot_stage", stage="probe"):
+        return bool(collection.get(where=_window(key, start, end), include=[], limit=1)["ids"])
+
+def _next_key(collection, key, start, end=CURSOR_END) -> Optional[int]:
+    """Smallest value of `key` in [start, end), found by binary search on existence probes; None when there is none."""
+    if not _has_records(collection, key, start, end):
+        return None
+    while end - start > 1:
+        middle = (start + end) // 2
+        if _has_records(collection, key, start, middle):
+            end = middle
+        else:
+            start = middle
+    return start
+
+def iter_pages(collection, page_size=PAGE_SIZE, include=INCLUDE) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the whole collection in pages of about `page_size` records, so peak memory
+    is bounded by a page whatever the collection size. The cursor is a half-open
+    window on a CURSOR_KEYS value: every page holds all records in its window and
+    the next page starts where it ended, so a page costs the same at any depth and
+    records written during the export never make others skip or repeat. Empty
+    stretches are jumped with a binary search; the window is resized after every page.
+    """
+    for key in CURSOR_KEYS:
+        cursor, span = _next_key(collection, key, 0), WINDOW_SECONDS
+        while cursor is not None:
+            with timer("snapshot_stage", stage="get"):
+                page = collection.get(where=_window(key, cursor, cursor + span), include=include, limit=2 * page_size)
+            if len(page["ids"]) == 2 * page_size:
+                if span > 1:
+                    span //= 2 # too dense: read a narrower window instead
+                    continue
+                # One key value with more records than a page: read them all at once
+                with timer("snapshot_stage", stage="get"):
+                    page = collection.get(where=_window(key, cursor, cursor + span), include=include)
+            if page["ids"]:
+                yield page
+            cursor += span
+            if len(page["ids"]) < page_size // 2:
+                span *= 2
+            elif len(page["ids"]) > page_size:
+                span = max(1, span // 2)
+            if not page["ids"]:
+                cursor, span = _next_key(collection, key, cursor), WINDOW_SECONDS
+
+class _ShardWriter:
+    """Writes records to numbered shard files of at most `shard_size` records."""
+    def __init__(self, path, fmt, shard_size):
+        self.path = path
+        self.fmt = fmt
+        self.shard_size = shard_size
+        self.shards: List[Dict[str, Any]] = []
+        self._file = None
+        self._vectors: List[np.ndarray] = []
+        self._rows = 0
+
+    def _open(self):
+        name = f"shard-{len(self.shards):05d}"
+        self.shards.append({"name": name, "records": 0})
+        self._file = open(os.path.join(self.path, f"{name}.jsonl" if self.fmt == "npy" else f"{name}.ndjson"), 'w')
+        self._rows = 0
+
+    def _close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self.fmt == "npy":
+            vectors = np.concatenate(self._vectors) if self._vectors else np.empty((0, 0), dtype=np.float32)
+            np.save(os.path.join(self.path, f"{self.shards[-1]['name']}.npy"), vectors)
+            self._vectors = []
+
+    def write(self, page):
+        embeddings = page["embeddings"]
+        embeddings = np.asarray(embeddings if embeddings is not None else [], dtype=np.float32)
+        records = len(page["ids"])
+        start = 0
+        while start < records:
+            if self._file is None or self._rows >= self.shard_size:
+                self._close()
+                self._open()
+            end = min(records, start + self.shard_size - self._rows)
+            lines = []
+            for i in range(start, end):
+                record = {"id": page["ids"][i], "document": page["documents"][i], "metadata": page["metadatas"][i]}
+                if self.fmt == "ndjson":
+                    record["embedding"] = embeddings[i].tolist() if len(embeddings) else None
+                lines.append(ujson.dumps(record))
+            self._file.write("\n".join(lines) + "\n")
+            if self.fmt == "npy":
+                self._vectors.append(embeddings[start:end])
+            self._rows += end - start
+            self.shards[-1]["records"] += end - start
+            start = end
+
+    def close(self):
+        self._close()
+
+def export_collection(collection, path=SNAPSHOT_PATH, fmt="npy", page_size=PAGE_SIZE,
+                      shard_size=SHARD_SIZE) -> Dict[str, Any]:
+    """
+    Streams ids, documents, metadatas and embeddings of `collection` to shard files in
+    `path` and writes the snapshot manifest last, so a half-written snapshot is never
+    restored. 'ndjson' shards are self-contained JSON lines; 'npy' shards keep the
+    embeddings as a float32 .npy file next to the JSON lines, which is far smaller
+    and much faster to load. Returns the manifest.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown snapshot format: {fmt}")
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, SNAPSHOT_MANIFEST)):
+        os.remove(os.path.join(path, SNAPSHOT_MANIFEST))
+    start = time.perf_counter()
+    expected = collection.count()
+    writer = _ShardWriter(path, fmt, shard_size)
+    records, dimension = 0, None
+    try:
+        for page in iter_pages(collection, page_size):
+            if dimension is None and page["embeddings"] is not None and len(page["embeddings"]):
+                dimension = len(page["embeddings"][0])
+            with timer("snapshot_stage", stage="write"):
+                writer.write(page)
+            records += len(page["ids"])
+            count("snapshot_records_exported", len(page["ids"]))
+    finally:
+        writer.close()
+    if records < expected:
+        print(f"Warning: {expected - records} record(s) without {' or '.join(CURSOR_KEYS)} were not exported.")
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "collection": collection.name,
+        "metadata": collection.metadata,
+        "format": fmt,
+        "records": records,
+        "dimension": dimension,
+        "shards": writer.shards,
+        "created": int(time.time()),
+    }
+    with open(os.path.join(path, SNAPSHOT_MANIFEST), 'w') as f:
+        ujson.dump(manifest, f, indent=2)
+    print(f"Exported {records} records in {len(writer.shards)} shard(s) to {path} in {time.perf_counter() - start:.1f} s.")
+    return manifest
+
+def load_snapshot_manifest(path=SNAPSHOT_PATH) -> Dict[str, Any]:
+    manifest_path = os.path.join(path, SNAPSHOT_MANIFEST)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"No complete snapshot at '{path}' (missing {SNAPSHOT_MANIFEST}).")
+    with open(manifest_path, 'r') as f:
+        manifest = ujson.load(f)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {manifest.get('version')}")
+    return manifest
+
+def iter_shard_batches(path, manifest, batch_size) -> Iterator[Dict[str, Any]]:
+    """Yields {'ids', 'documents', 'metadatas', 'embeddings'} batches of at most `batch_size` records."""
+    for shard in manifest["shards"]:
+        name = shard["name"]
+        vectors = None
+        if manifest["format"] == "npy":
+            vectors = np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+            lines_path = os.path.join(path, f"{name}.jsonl")
+        else:
+            lines_path = os.path.join(path, f"{name}.ndjson")
+        batch = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        row = 0
+        with open(lines_path, 'r') as f:
+            for line in f:
+                record = ujson.loads(line)
+                batch["ids"].append(record["id"])
+                batch["documents"].append(record["document"])
+                batch["metadatas"].append(record["metadata"])
+                batch["embeddings"].append(vectors[row] if vectors is not None else record["embedding"])
+                row += 1
+                if len(batch["ids"]) >= batch_size:
+                    yield batch
+                    batch = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        if batch["ids"]:
+            yield batch
+
+def restore_collection(client, path=SNAPSHOT_PATH, name: Optional[str] = None, replace=False,
+                       batch_size: Optional[int] = None):
+    """
+    Recreates a collection from a snapshot with collection.add in batches as large as
+    the client accepts. The stored embeddings are written as they are, so the model
+    is never loaded; the collection keeps the metadata (distance and HNSW parameters)
+    it was exported with. Refuses to overwrite an existing collection unless `replace`.
+    """
+    manifest = load_snapshot_manifest(path)
+    name = name or manifest["collection"]
+    if replace:
+        try:
+            client.delete_collection(name=name)
+            print(f"Existing collection '{name}' deleted.")
+        except Exception:
+            pass # Collection did not exist
+    collection = client.create_collection(name=name, metadata=manifest["metadata"] or None, embedding_function=None)
+    batch_size = min(batch_size or client.get_max_batch_size(), client.get_max_batch_size())
+
+    start = time.perf_counter()
+    restored = 0
+    for batch in iter_shard_batches(path, manifest, batch_size):
+        embeddings = np.asarray(batch["embeddings"], dtype=np.float32)
+        with timer("snapshot_stage", stage="add"):
+            collection.add(ids=batch["ids"], documents=batch["documents"], metadatas=batch["metadatas"],
+                           embeddings=embeddings)
+        restored += len(batch["ids"])
+        count("snapshot_records_restored", len(batch["ids"]))
+    if restored != manifest["records"]:
+        raise ValueError(f"Snapshot is incomplete: restored {restored} of {manifest['records']} records.")
+    print(f"Restored {restored} records into '{name}' in {time.perf_counter() - start:.1f} s.")
+    return collection
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a ChromaDB collection with its embeddings, or restore one.")
+    parser.add_argument("action", choices=["export", "restore"])
+    parser.add_argument("--path", type=str, default=SNAPSHOT_PATH, help="Snapshot directory.")
+    parser.add_argument("--collection", type=str, default=COLLECTION_NAME)
+    parser.add_argument("--chroma-path", type=str, default=CHROMA_DB_PATH)
+    parser.add_argument("--format", choices=FORMATS, default="npy", help="Shard format of an export.")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Records per shard file.")
+    parser.add_argument("--replace", action="store_true", help="Drop an existing collection with the same name on restore.")
+    args = parser.parse_args()
+
+    import chromadb
+    client = chromadb.PersistentClient(path=args.chroma_path)
+    if args.action == "export":
+        export_collection(client.get_collection(name=args.collection), args.path, args.format, shard_size=args.shard_size)
+    else:
+        restore_collection(client, args.path, name=args.collection, replace=args.replace)
@@ -0,0 +1,105 @@
+import os
+import argparse
+import ujson
+import numpy as np
+import pandas as pd
+
+# --- Constants ---
+LOCAL_TZ = "Europe/Amsterdam"
+START_DATE = "2024-01-01"
+SEED = 42
+
+def generate_day(day, cadence_s=10, seed=SEED, start_counters=(0.0, 0.0, 0.0)):
+    """
+    Generates one local calendar day of P1 readings as a DataFrame with columns
+    timestamp (epoch), active_power_w, total_power_import_kwh, total_power_export_kwh
+    and total_gas_m3. The day's random state only depends on (seed, date), so any
+    day can be regenerated on its own; the counters continue from `start_counters`.
+    """
+    day = pd.Timestamp(day).normalize()
+    rng = np.random.default_rng([seed, int(day.strftime("%Y%m%d"))])
+    local_start = day.tz_localize(LOCAL_TZ)
+    local_end = (day + pd.Timedelta(days=1)).tz_localize(LOCAL_TZ)
+    epochs = np.arange(int(local_start.timestamp()), int(local_end.timestamp()), cadence_s, dtype=np.int64)
+    hours = (epochs - int(local_start.timestamp())) / 3600.0
+    season = np.cos(2 * np.pi * (day.dayofyear - 172) / 365.25) # +1 midsummer, -1 midwinter
+
+    # Household load: base load, morning and evening peaks, and short appliance spikes
+    load = 180 + 40 * rng.standard_normal(len(epochs)).cumsum() / np.sqrt(len(epochs))
+    load += 600 * np.exp(-((hours - 7.5) / 1.0) ** 2) + 1200 * np.exp(-((hours - 19.0) / 1.8) ** 2)
+    spikes = rng.random(len(epochs)) < 0.002
+    load += np.convolve(spikes * rng.uniform(1000, 2500, len(epochs)), np.ones(max(1, 600 // cadence_s)), mode="same")
+
+    # Solar: a bell curve around solar noon, longer and higher in summer, damped by clouds
+    day_length = 12 + 4.5 * season
+    sigma = day_length / 5.5
+    peak_w = 3800 * (0.65 + 0.35 * season) * rng.uniform(0.25, 1.0)
+    clouds = np.clip(1 - 0.5 * rng.random(len(epochs)) ** 4, 0, 1)
+    solar = peak_w * np.exp(-((hours - 13.6) / sigma) ** 2) * clouds
+
+    active_power_w = np.round(np.maximum(load, 60) - solar)
+    step_h = cadence_s / 3600.0
+    import_kwh = start_counters[0] + np.cumsum(np.clip(active_power_w, 0, None)) * step_h / 1000.0
+    export_kwh = start_counters[1] + np.cumsum(np.clip(-active_power_w, 0, None)) * step_h / 1000.0
+
+    # Gas: space heating in the cold season plus showers in the morning
+    heating_m3_h = np.clip(-season, 0, None) * 0.35 * (1 + 0.5 * np.exp(-((hours - 7) / 2) ** 2))
+    shower_m3_h = 0.8 * np.exp(-((hours - 7.2) / 0.25) ** 2)
+    gas_m3 = start_counters[2] + np.cumsum(heating_m3_h + shower_m3_h) * step_h
+
+    return pd.DataFrame({
+        "timestamp": epochs,
+        "active_power_w": active_power_w,
+        "total_power_import_kwh": np.round(import_kwh, 3),
+        "total_power_export_kwh": np.round(export_kwh, 3),
+        "total_gas_m3": np.round(gas_m3, 3),
+    })
+
+def iter_days(start_date=START_DATE, days=365, cadence_s=10, seed=SEED, start_counters=(1000.0, 500.0, 300.0)):
+    """Yields one DataFrame per day with continuous meter counters; memory stays at one day."""
+    counters = start_counters
+    for day in pd.date_range(start_date, periods=days, freq="D"):
+        df = generate_day(day, cadence_s=cadence_s, seed=seed, start_counters=counters)
+        counters = tuple(df[column].iat[-1] for column in ("total_power_import_kwh", "total_power_export_kwh", "total_gas_m3"))
+        yield df
+
+def write_jsonl(out_dir, **kwargs):
+    """Writes one P1 log file per day ('p1_YYYY-MM-DD.jsonl') in the format main.py ingests."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for df in iter_days(**kwargs):
+        local = pd.to_datetime(df["timestamp"], unit="s", utc=True).dt.tz_convert(LOCAL_TZ)
+        path = os.path.join(out_dir, f"p1_{local.iat[0].strftime('%Y-%m-%d')}.jsonl")
+        stamps = local.dt.strftime("%Y-%m-%dT%H:%M:%S%z").str.replace(r"(\d{2})(\d{2})$", r"\1:\2", regex=True)
+        columns = df.drop(columns="timestamp").to_dict("list")
+        with open(path, "w") as f:
+            for i, stamp in enumerate(stamps):
+                data = {key: float(values[i]) for key, values in columns.items()}
+                f.write(ujson.dumps({"timestamp": stamp, "data": data}) + "\n")
+        paths.append(path)
+    return paths
+
+def write_csv(path, **kwargs):
+    """Writes a P1metingen-style CSV (epoch timestamp plus readings) as used by smart_database.py."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    for i, df in enumerate(iter_days(**kwargs)):
+        df.to_csv(path, mode="w" if i == 0 else "a", header=(i == 0), index=False)
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate deterministic synthetic P1 smart meter data.")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--out", required=True, type=str, help="Output directory (jsonl) or file (csv).")
+    parser.add_argument("--start-date", type=str, default=START_DATE)
+    parser.add_argument("--years", type=float, default=1.0)
+    parser.add_argument("--cadence", type=int, choices=[1, 10], default=10, help="Seconds between readings.")
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    options = dict(start_date=args.start_date, days=int(round(args.years * 365)), cadence_s=args.cadence, seed=args.seed)
+    if args.format == "jsonl":
+        written = write_jsonl(args.out, **options)
+        print(f"{len(written)} daily JSONL files written to {args.out}")
+    else:
+        write_csv(args.out, **options)
+        print(f"CSV written to {args.out}")
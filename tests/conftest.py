@@ -0,0 +1,24 @@
+import ujson
+import pandas as pd
+import pytest
+
+
+def _write_jsonl(path, count, start="2025-09-01 00:00:00"):
+    """Writes `count` P1 records, 10 s apart, with steadily rising import/export counters."""
+    stamps = pd.date_range(start, periods=count, freq="10s")
+    with open(path, "w") as f:
+        for i, ts in enumerate(stamps):
+            record = {
+                "timestamp": ts.isoformat(),
+                "data": {
+                    "total_power_import_kwh": 1000 + i * 0.001,
+                    "total_power_export_kwh": 500 + i * 0.002,
+                    "total_gas_m3": 300.0,
+                },
+            }
+            f.write(ujson.dumps(record) + "\n")
+
+
+@pytest.fixture
+def write_jsonl():
+    return _write_jsonl
@@ -0,0 +1,169 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+from numeric_store import NumericStore
+
+# 2025-09-01 00:00 Europe/Amsterdam
+START_EPOCH = 1756677600
+
+
+def _fill_store(path, days=3, step=60):
+    epochs = np.arange(START_EPOCH, START_EPOCH + days * 86400, step)
+    hours = (epochs - START_EPOCH) % 86400 / 3600
+    power = np.where((hours >= 10) & (hours < 16), -1500.0, 400.0)
+    store = NumericStore(str(path))
+    store.append({
+        "epoch": epochs,
+        "active_power_w": power,
+        "total_power_import_kwh": 1000 + np.cumsum(np.clip(power, 0, None)) * step / 3.6e6,
+        "total_power_export_kwh": 500 + np.cumsum(np.clip(-power, 0, None)) * step / 3.6e6,
+    })
+    return store, epochs, power
+
+
+def test_store_range_reads_and_out_of_order_appends(tmp_path):
+    store = NumericStore(str(tmp_path))
+    store.append({"epoch": [100, 200, 300], "active_power_w": [1, 2, 3]})
+    store.append({"epoch": [250, 200], "active_power_w": [25, 20]})
+
+    data = store.read_range(150, 260, ["active_power_w"])
+
+    assert data["epoch"].tolist() == [200, 250]
+    assert data["active_power_w"].tolist() == [20, 25]
+    assert np.isnan(store.read_range(0, 1000, ["total_gas_m3"])["total_gas_m3"]).all()
+    assert len(store) == 4 and store.bounds() == (100, 300)
+
+
+def test_aggregator_reads_from_numeric_store(tmp_path, monkeypatch):
+    _, _, power = _fill_store(tmp_path)
+    monkeypatch.setattr(tools, "NUMERIC_STORE_PATH", str(tmp_path))
+
+    result = tools.query_aggregator("active_power_w", "MAX", "2025-09-01", "2025-09-03", value_type="PRODUCTION")
+    assert result["value"] == -1500.0
+
+    result = tools.query_aggregator("active_power_w", "AVG", "2025-09-01", "2025-09-03", time_of_day="avond")
+    assert result["value"] == 400.0
+
+    result = tools.query_aggregator("total_power_export_kwh", "DELTA", "2025-09-02", "2025-09-02")
+    assert abs(result["value"] - 6 * 1.5) < 0.05
+
+
+def test_partial_states_merge_exactly():
+    rng = np.random.default_rng(7)
+    epochs = np.arange(1000, 1000 + 500 * 10, 10)
+    values = rng.normal(size=len(epochs))
+
+    whole = tools.AggregateState().update(epochs, values)
+    merged = tools.AggregateState()
+    for part in np.array_split(np.arange(len(epochs))[::-1], 7):  # shuffled, uneven chunks
+        merged.merge(tools.AggregateState().update(epochs[part], values[part]))
+
+    assert merged.count == whole.count == 500
+    assert np.isclose(merged.sum, values.sum())
+    assert (merged.max, merged.max_epoch) == (whole.max, whole.max_epoch) == (values.max(), epochs[values.argmax()])
+    assert (merged.first, merged.last) == (values[0], values[-1])
+    assert tools.AggregateState().merge(merged).result("DELTA")["value"] == values[-1] - values[0]
+
+
+def test_aggregator_covers_ranges_beyond_one_chunk(tmp_path, monkeypatch):
+    _, epochs, power = _fill_store(tmp_path, days=40, step=10)
+    monkeypatch.setattr(tools, "NUMERIC_STORE_PATH", str(tmp_path))
+    # The range starts before the store: that part is looked up in an (empty) Chroma directory
+    monkeypatch.setattr(tools, "CHROMA_DB_PATH", str(tmp_path / "chroma_db"))
+    original = tools._iter_reading_chunks
+    monkeypatch.setattr(tools, "_iter_reading_chunks", lambda *args, **kwargs: original(*args, **dict(kwargs, chunk_size=1000)))
+
+    result = tools.query_aggregator("active_power_w", "AVG", "2025-08-25", "2025-10-20")
+
+    assert len(epochs) > 10000  # more than the old hard-coded limit
+    assert np.isclose(result["value"], power.mean())
+
+
+def test_batch_matches_individual_queries(tmp_path, monkeypatch):
+    _fill_store(tmp_path, days=5)
+    monkeypatch.setattr(tools, "NUMERIC_STORE_PATH", str(tmp_path))
+    scans = []
+    original = tools._iter_reading_chunks
+    monkeypatch.setattr(tools, "_iter_reading_chunks", lambda *args, **kwargs: scans.append(args[0]) or original(*args, **kwargs))
+
+    specs = [
+        (metric, aggregation, time_of_day, value_type)
+        for time_of_day in ["ochtend", "middag", "avond", "nacht", None]
+        for value_type in ["CONSUMPTION", "PRODUCTION"]
+        for metric, aggregation in [("active_power_w", "AVG"), ("active_power_w", "MAX")]
+    ] + [("total_power_import_kwh", "DELTA", None, "ALL"), ("total_power_import_kwh", "SUM", None, "ALL")]
+
+    batch = tools.query_aggregator_batch("2025-09-01", "2025-09-04", specs)
+    assert len(scans) == 1
+
+    for spec, result in zip(specs, batch):
+        single = tools.query_aggregator(spec[0], spec[1], "2025-09-01", "2025-09-04", spec[2], spec[3])
+        result.pop("time_of_day", None)
+        assert result == single
+    assert batch[0]["value"] == 400.0
+    assert "error" in batch[-1]
+
+
+def test_chroma_fallback_pushes_filters_down(tmp_path, monkeypatch):
+    import chromadb
+    import main
+    from ingest_manifest import empty_manifest, save_manifest
+
+    epochs = np.arange(START_EPOCH, START_EPOCH + 2 * 86400, 300)
+    power = np.where(((epochs - START_EPOCH) % 86400) // 3600 >= 12, -800.0, 300.0)
+    records = [({"timestamp": tools._local_isoformat(int(epoch)), "data": {"active_power_w": float(p)}}, "a.jsonl")
+               for epoch, p in zip(epochs, power)]
+    documents, metadatas, ids = main._build_batch(records)
+    collection = chromadb.EphemeralClient().get_or_create_collection("pushdown_test", embedding_function=None)
+    collection.upsert(documents=documents, metadatas=metadatas, ids=ids, embeddings=[[0.0, 1.0]] * len(ids))
+    wheres = []
+    original_get = collection.get
+    monkeypatch.setattr(collection, "get", lambda **kwargs: wheres.append(kwargs.get("where")) or original_get(**kwargs))
+    monkeypatch.setattr(tools, "get_collection", lambda: collection)
+    monkeypatch.setattr(tools, "NUMERIC_STORE_PATH", str(tmp_path / "empty_store"))
+    save_manifest(empty_manifest(), str(tmp_path / "manifest.json"))
+    monkeypatch.setattr(tools, "MANIFEST_PATH", str(tmp_path / "manifest.json"))
+    rows = []
+    monkeypatch.setattr(tools, "count", lambda name, value=1, **labels: rows.append(value) if name == "query_rows_scanned" else None)
+
+    result = tools.query_aggregator("active_power_w", "AVG", "2025-09-01", "2025-09-02", time_of_day="avond", value_type="PRODUCTION")
+
+    assert result["value"] == -800.0
+    assert {"time_of_day": {"$eq": "avond"}} in wheres[0]["$and"] and {"power_sign": {"$eq": -1}} in wheres[0]["$and"]
+    assert sum(rows) == 2 * 6 * 12  # only the evening readings crossed into Python
+    assert tools.query_aggregator("active_power_w", "MAX", "2025-09-01", "2025-09-02",
+                                  time_of_day="ochtend", value_type="PRODUCTION") == {
+        "error": "No data found for value_type='PRODUCTION' in the selected period."}
+
+
+def test_history_older_than_the_store_is_read_from_chroma(tmp_path, monkeypatch):
+    import chromadb
+    import main
+
+    full, epochs, _ = _fill_store(tmp_path / "full", days=3)
+    data = full.read_range(int(epochs[0]), int(epochs[-1]), ["active_power_w", "total_power_import_kwh", "total_power_export_kwh"])
+    # Every reading is in Chroma; the store was only created on the second day
+    records = [({"timestamp": tools._local_isoformat(int(epoch)),
+                 "data": {key: float(data[key][i]) for key in ("active_power_w", "total_power_import_kwh", "total_power_export_kwh")}},
+                "a.jsonl") for i, epoch in enumerate(epochs)]
+    documents, metadatas, ids = main._build_batch(records)
+    collection = chromadb.EphemeralClient().get_or_create_collection("history_test", embedding_function=None)
+    collection.upsert(documents=documents, metadatas=metadatas, ids=ids, embeddings=[[0.0, 1.0]] * len(ids))
+    recent = NumericStore(str(tmp_path / "recent"))
+    later = epochs >= START_EPOCH + 86400
+    recent.append({"epoch": epochs[later], **{key: np.asarray(values)[later] for key, values in data.items() if key != "epoch"}})
+    monkeypatch.setattr(tools, "get_collection", lambda: collection)
+
+    specs = [{"metric": "total_power_import_kwh", "aggregation": "DELTA"}, {"metric": "active_power_w", "aggregation": "AVG"},
+             {"metric": "active_power_w", "aggregation": "MAX", "value_type": "PRODUCTION"}]
+    monkeypatch.setattr(tools, "NUMERIC_STORE_PATH", str(tmp_path / "full"))
+    expected = tools.query_aggregator_batch("2025-09-01", "2025-09-03", specs)
+    monkeypatch.setattr(tools, "NUMERIC_STORE_PATH", str(tmp_path / "recent"))
+    combined = tools.query_aggregator_batch("2025-09-01", "2025-09-03", specs)
+    for result, reference in zip(combined, expected):
+        assert abs(result["value"] - reference["value"]) < 1e-9 and result.get("timestamp") == reference.get("timestamp")
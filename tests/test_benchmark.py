@@ -0,0 +1,45 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import main
+import synthetic_p1
+
+
+def test_generator_is_deterministic_and_counters_continue():
+    first = list(synthetic_p1.iter_days(start_date="2024-06-20", days=2, seed=7))
+    again = synthetic_p1.generate_day("2024-06-21", seed=7, start_counters=tuple(
+        first[0][column].iat[-1] for column in ("total_power_import_kwh", "total_power_export_kwh", "total_gas_m3")))
+
+    assert len(first[0]) == 8640
+    assert first[1].equals(again)
+    for column in ("total_power_import_kwh", "total_power_export_kwh", "total_gas_m3"):
+        values = np.concatenate([day[column].to_numpy() for day in first])
+        assert (np.diff(values) >= 0).all()
+    # Midsummer has solar export around noon
+    assert first[0]["active_power_w"].min() < 0
+
+
+def test_generated_jsonl_is_ingested_by_main(tmp_path, monkeypatch):
+    synthetic_p1.write_jsonl(str(tmp_path), start_date="2024-03-31", days=1, cadence_s=10)
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+
+    documents, metadatas, ids = main.load_data()
+
+    # DST switch: the local day is 23 hours long
+    assert len(ids) == len(set(ids)) == 23 * 360
+    assert metadatas[0]["date"] == "2024-03-31"
+
+
+def test_benchmark_suite_records_and_compares(tmp_path):
+    results = benchmark.run_suite(years=0.01, repeat=1, skip=["load_data", "indexing", "indexing_daily", "setup_database", "vector_index"],
+                                  work_dir=str(tmp_path))
+
+    timings = dict(benchmark._flatten(results["benchmarks"]))
+    assert "query_parser" in timings and "query_aggregator.day.batch" in timings
+    assert all("error" not in timing for timing in timings.values())
+    assert benchmark.compare(results, results) == []
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compaction
+import tools
+from benchmark import fill_numeric_store
+from numeric_store import NumericStore
+
+SPECS = [
+    ("active_power_w", "AVG", None, "ALL"),
+    ("active_power_w", "MAX", None, "CONSUMPTION"),
+    ("active_power_w", "MIN", "middag", "PRODUCTION"),
+    ("active_power_w", "SUM", "avond", "ALL"),
+    ("total_power_import_kwh", "DELTA", None, "ALL"),
+    ("total_power_export_kwh", "MAX", None, "ALL"),
+]
+RANGES = [("2024-05-01", "2024-06-29"), ("2024-05-03", "2024-05-03"), ("2024-05-20", "2024-06-10"), ("2024-06-25", "2024-06-29")]
+
+
+def test_compacted_tiers_answer_like_raw_readings(tmp_path, monkeypatch):
+    store_path = str(tmp_path / "store")
+    fill_numeric_store(store_path, start_date="2024-05-01", days=60, cadence_s=10)
+    monkeypatch.setattr(tools, "NUMERIC_STORE_PATH", store_path)
+    monkeypatch.setattr(tools, "MANIFEST_PATH", str(tmp_path / "no_manifest.json"))
+    before = [tools.query_aggregator_batch(start, end, SPECS) for start, end in RANGES]
+    raw_rows = len(NumericStore(store_path))
+
+    now = 1719792000  # 2024-07-01
+    folded = compaction.compact(store_path, tiers=(("minute", 60, 20), ("hour", 3600, 40)), now=now)
+
+    raw_from, spans = compaction.coverage(store_path)
+    assert folded["minute"] > 0 and folded["hour"] > 0
+    assert len(NumericStore(store_path)) < raw_rows / 2
+    assert NumericStore(store_path).bounds()[0] == raw_from == spans[0][2]
+    after = [tools.query_aggregator_batch(start, end, SPECS) for start, end in RANGES]
+    for expected, actual in zip(before, after):
+        for a, b in zip(expected, actual):
+            assert a.keys() == b.keys()
+            assert np.isclose(a.get("value", 0), b.get("value", 0)) and a.get("timestamp") == b.get("timestamp")
+
+    # Running again with the same clock changes nothing
+    assert compaction.compact(store_path, tiers=(("minute", 60, 20), ("hour", 3600, 40)), now=now) == {"minute": 0, "hour": 0}
+    assert [tools.query_aggregator_batch(start, end, SPECS) for start, end in RANGES] == after
+
+
+def test_tier_periods_must_divide_an_hour():
+    assert compaction.parse_tier("quarter:900:60") == ("quarter", 900, 60)
+    for text in ("day:86400:365", "2h:7200:90", "odd:7:1", "hour:3600"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            compaction.parse_tier(text)
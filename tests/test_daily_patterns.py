@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import daily_patterns
+import main
+import synthetic_p1
+from test_ingest import _LengthEmbeddingFunction
+
+
+def _readings(start_date, days):
+    return pd.concat(synthetic_p1.iter_days(start_date=start_date, days=days)).rename(columns={"timestamp": "epoch"})
+
+
+def test_day_profiles_follow_local_days():
+    # 31 March 2024 is the 23-hour DST day
+    days, day_parts = daily_patterns.compute_day_profiles(_readings("2024-03-30", 3))
+
+    assert list(days.index) == ["2024-03-30", "2024-03-31", "2024-04-01"]
+    assert days.loc["2024-03-31", "readings"] == 23 * 360
+    assert len(day_parts) == 12
+    assert days["import_kwh"].gt(0).all() and days["peak_part"].notna().all()
+
+    documents, metadatas, ids = daily_patterns.build_pattern_documents(days, day_parts)
+    assert ids[1] == "pattern_2024-03-31"
+    assert documents[1].startswith("Sunday 2024-03-31: consumption peak in the")
+    assert metadatas[1]["doc_type"] == "daily_pattern" and "epoch" not in metadatas[1]
+
+    _, metadatas, ids = daily_patterns.build_pattern_documents(days, day_parts, per_day_part=True)
+    assert ids[:2] == ["pattern_2024-03-30_night", "pattern_2024-03-30_morning"]
+    assert metadatas[3]["day_part"] == "evening"
+
+
+def test_pattern_readings_stream_whole_local_months(tmp_path):
+    store = main.NumericStore(str(tmp_path / "store"))
+    df = _readings("2024-01-30", 35)
+    store.append({column: df[column].to_numpy() for column in ["epoch"] + daily_patterns.PATTERN_COLUMNS})
+
+    frames = list(daily_patterns.iter_pattern_readings(store))
+    per_month = [daily_patterns.compute_day_profiles(frame)[0] for frame in frames]
+    whole, _ = daily_patterns.compute_day_profiles(pd.concat(frames, ignore_index=True))
+
+    # Local midnight of 1 February/March (UTC 23:00 the day before) starts a new frame
+    assert len(frames) == 3 and sum(len(frame) for frame in frames) == len(df)
+    assert [len(days) for days in per_month] == [2, 29, 4]
+    assert pd.concat(per_month).equals(whole)
+
+
+def test_daily_mode_embeds_one_document_per_day(tmp_path, monkeypatch):
+    import chromadb
+    import ingest_pipeline
+
+    synthetic_p1.write_jsonl(str(tmp_path / "logs"), start_date="2024-06-01", days=2)
+    for name, value in {
+        "DATA_DIR": str(tmp_path / "logs"),
+        "CHROMA_DB_PATH": str(tmp_path / "chroma_db"),
+        "MANIFEST_PATH": str(tmp_path / "chroma_db" / "ingest_manifest.json"),
+        "ROLLUP_STATE_PATH": str(tmp_path / "chroma_db" / "rollup_state.json"),
+        "NUMERIC_STORE_PATH": str(tmp_path / "numeric_store"),
+        "EMBEDDING_CACHE_PATH": str(tmp_path / "embedding_cache"),
+    }.items():
+        monkeypatch.setattr(main, name, value)
+    monkeypatch.setattr(ingest_pipeline.embedding_functions, "SentenceTransformerEmbeddingFunction", _LengthEmbeddingFunction)
+    collection = chromadb.EphemeralClient().get_or_create_collection("daily_test", embedding_function=None)
+    original_upsert = collection.upsert
+    collection.upsert = lambda documents, metadatas, ids, embeddings=None: original_upsert(
+        documents=documents, metadatas=metadatas, ids=ids,
+        embeddings=embeddings if embeddings is not None else [[0.0, 1.0]] * len(ids))
+    monkeypatch.setattr(main, "setup_chroma_db", lambda rebuild=False, **kwargs: collection)
+
+    stats = main.run_indexing(documents="daily")
+
+    assert stats["documents"] == 2
+    patterns = collection.get(where={"doc_type": "daily_pattern"})
+    assert sorted(patterns["ids"]) == ["pattern_2024-06-01", "pattern_2024-06-02"]
+    # Raw readings only live in the numeric store
+    assert len(main.NumericStore(main.NUMERIC_STORE_PATH)) == 2 * 8640
+    assert collection.get(where={"epoch": {"$gte": 0}})["ids"] == []
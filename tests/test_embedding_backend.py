@@ -0,0 +1,70 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import embedding_backend
+
+
+class _FakeSession:
+    """Stands in for the ONNX session: token vectors from a fixed table, with recorded batch widths."""
+    def __init__(self, vocab_size, dim=8):
+        self.table = np.random.default_rng(0).normal(size=(vocab_size, dim)).astype(np.float32)
+        self.widths = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name="input_ids"), SimpleNamespace(name="attention_mask")]
+
+    def run(self, outputs, feeds):
+        self.widths.append(feeds["input_ids"].shape[1])
+        return [self.table[feeds["input_ids"]]]
+
+
+def _backend(batch_size=2):
+    from tokenizers import Tokenizer, models, pre_tokenizers
+
+    words = ["[PAD]", "[UNK]", "on", "the", "total", "power", "import", "was", "kwh", "at", "noon"]
+    tokenizer = Tokenizer(models.WordLevel({word: i for i, word in enumerate(words)}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    backend = embedding_backend.OnnxMiniLM(threads=1, batch_size=batch_size)
+    backend._tokenizer = tokenizer
+    session = _FakeSession(len(words))
+    backend.session = lambda threads=None: session
+    return backend, session
+
+
+def test_length_sorted_batches_are_padded_per_batch_and_keep_order():
+    backend, session = _backend(batch_size=2)
+    texts = ["the total power import was at noon kwh", "on", "power", "the total power import was"]
+
+    vectors = np.asarray(backend(texts))
+    assert session.widths == [1, 8] # the two one-word texts share a batch without padding
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.0, rtol=1e-5)
+    for text, vector in zip(texts, vectors):
+        np.testing.assert_allclose(np.asarray(backend([text]))[0], vector, rtol=1e-5, atol=1e-6)
+
+
+def test_tune_picks_candidate_settings_and_parity_check():
+    backend, _ = _backend(batch_size=0)
+    backend.threads = 0
+    settings = backend.tune(["the total power import was"] * 40 + ["on"] * 40)
+    assert settings["batch_size"] in embedding_backend.BATCH_SIZES
+    assert settings["threads"] in embedding_backend.thread_candidates()
+
+    # A single query runs at the defaults; the first indexing-sized batch tunes
+    backend, _ = _backend(batch_size=0)
+    backend.threads = 0
+    backend(["the total power import was"])
+    assert backend.batch_size == 0 and backend.threads == 0
+    backend(["the total power import was"] * embedding_backend.TUNE_MIN_TEXTS)
+    assert backend.batch_size in embedding_backend.BATCH_SIZES and backend.threads in embedding_backend.thread_candidates()
+    assert backend.get_config()["normalize_embeddings"] is False
+
+    reference = np.random.default_rng(1).normal(size=(200, 16)).astype(np.float32)
+    close = reference + 0.01 * np.random.default_rng(2).normal(size=reference.shape).astype(np.float32)
+    assert embedding_backend.parity_check(reference, close)["passed"]
+    assert not embedding_backend.parity_check(reference, np.random.default_rng(3).normal(size=reference.shape))["passed"]
+    assert embedding_backend.cache_name("m", "onnx") == "m" != embedding_backend.cache_name("m", "onnx-int8")
@@ -0,0 +1,67 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_cache import CachedEmbeddingFunction, EmbeddingCache
+
+
+class CountingEmbeddingFunction:
+    """Stand-in for a sentence-transformer: deterministic vectors, counts every text embedded."""
+    embedded = []
+    constructed = 0
+
+    def __init__(self, model_name):
+        CountingEmbeddingFunction.constructed += 1
+        self.model_name = model_name
+
+    def __call__(self, input):
+        CountingEmbeddingFunction.embedded.extend(input)
+        return [np.full(4, len(text), dtype=np.float32) for text in input]
+
+    @staticmethod
+    def name():
+        return "counting"
+
+
+def test_repeat_texts_skip_inference(tmp_path):
+    CountingEmbeddingFunction.embedded = []
+    ef = CachedEmbeddingFunction(CountingEmbeddingFunction, "mini", cache_dir=str(tmp_path))
+
+    first = ef(["a", "bb", "a"])
+    second = ef(["bb", "ccc"])
+
+    assert CountingEmbeddingFunction.embedded == ["a", "bb", "ccc"]
+    assert np.allclose(first[0], first[2])
+    assert np.allclose(second[0], first[1])
+    assert ef.name() == "counting"
+
+
+def test_cache_persists_and_survives_torn_write(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "mini", dtype="float16")
+    cache.put_many(["x", "y"], np.array([[1, 2], [3, 4]], dtype=np.float32))
+    with open(cache.vectors_path, "ab") as f:
+        f.write(b"\x00\x01\x02")  # vector write interrupted before its key
+
+    reopened = EmbeddingCache(str(tmp_path), "mini", dtype="float16")
+
+    assert len(reopened) == 2
+    y, missing = reopened.get_many(["y", "z"])
+    assert np.allclose(y, [3, 4]) and missing is None
+    assert EmbeddingCache(str(tmp_path), "other", dtype="float16").get_many(["y"]) == [None]
+
+
+def test_fully_cached_run_never_constructs_the_model(tmp_path):
+    import chromadb
+
+    CachedEmbeddingFunction(CountingEmbeddingFunction, "mini", cache_dir=str(tmp_path))(["a", "bb"])
+    CountingEmbeddingFunction.constructed = 0
+    ef = CachedEmbeddingFunction(CountingEmbeddingFunction, "mini", cache_dir=str(tmp_path))
+
+    collection = chromadb.EphemeralClient().get_or_create_collection("cached_test", embedding_function=ef)
+    collection.upsert(ids=["1", "2"], documents=["a", "bb"])
+
+    assert CountingEmbeddingFunction.constructed == 0
+    assert ef.get_config()["model_name"] == "mini" and ef.hits == 2
@@ -0,0 +1,102 @@
+import os
+import sys
+
+import ujson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import follower
+from ingest_manifest import load_manifest, read_ingest_state
+from numeric_store import NumericStore
+
+
+def _lines(first, count):
+    return "".join(ujson.dumps({
+        "timestamp": f"2025-09-01 00:{(first + i) // 6:02d}:{(first + i) % 6 * 10:02d}",
+        "data": {"total_power_import_kwh": 1000 + (first + i) * 0.001, "total_power_export_kwh": 500.0,
+                 "total_gas_m3": 300.0, "active_power_w": 250.0},
+    }) + "\n" for i in range(count))
+
+
+def _follower(tmp_path, collection):
+    return follower.Follower(collection, NumericStore(str(tmp_path / "store")), str(tmp_path / "logs"),
+                             str(tmp_path / "manifest.json"), str(tmp_path / "rollup_state.json"),
+                             flush_records=100, flush_seconds=0.0, rollup_seconds=3600)
+
+
+def test_follower_tails_partial_lines_rotation_and_restarts(tmp_path):
+    import chromadb
+
+    collection = chromadb.EphemeralClient().get_or_create_collection("follow_test", embedding_function=None)
+    original_upsert = collection.upsert
+    collection.upsert = lambda documents, metadatas, ids: original_upsert(
+        documents=documents, metadatas=metadatas, ids=ids, embeddings=[[0.0, 1.0]] * len(ids))
+    log = tmp_path / "logs" / "p1.jsonl"
+    log.parent.mkdir()
+    log.write_text(_lines(0, 5) + '{"timestamp": "2025-09-01 00:00:50", "da')
+
+    tail = _follower(tmp_path, collection)
+    assert tail.step() == 5
+    assert collection.count() == 5 and tail.store.count_range(0, 2**40) == 5
+
+    # The partial line is completed and more readings arrive
+    with open(log, "a") as f:
+        f.write(_lines(5, 3)[len('{"timestamp": "2025-09-01 00:00:50", "da'):])
+    tail.step()
+    assert collection.count() == 8
+
+    # Lines written just before a rename-style rotation are drained from the old file
+    with open(log, "a") as f:
+        f.write(_lines(8, 2))
+    os.rename(log, tmp_path / "logs" / "p1.jsonl.1")
+    log.write_text(_lines(10, 3))
+    tail.step()
+    assert collection.count() == 13
+    assert tail.store.count_range(0, 2**40) == 13
+    tail.close()
+    assert load_manifest(str(tmp_path / "manifest.json"))["watermark"] == tail.store.bounds()[1]
+    assert read_ingest_state(str(tmp_path / "manifest.json"))["writes"][-1][1:] == list(tail.store.bounds())
+    assert collection.get(where={"level": "day"})["ids"]
+
+    # A restarted follower continues after the last flushed line
+    with open(log, "a") as f:
+        f.write(_lines(13, 1))
+    restarted = _follower(tmp_path, collection)
+    assert restarted.step() == 1
+    restarted.close()
+
+
+def test_follower_keeps_few_handles_over_many_historical_files(tmp_path):
+    import chromadb
+
+    collection = chromadb.EphemeralClient().get_or_create_collection("follow_many", embedding_function=None)
+    original_upsert = collection.upsert
+    collection.upsert = lambda documents, metadatas, ids: original_upsert(
+        documents=documents, metadatas=metadatas, ids=ids, embeddings=[[0.0, 1.0]] * len(ids))
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    for i in range(120):
+        (logs / f"p1-{i:03d}.jsonl").write_text(_lines(2 * i, 2))
+
+    # The backlog is read a few files at a time; finished files give their handle to waiting ones
+    tail = follower.Follower(collection, NumericStore(str(tmp_path / "store")), str(logs),
+                             str(tmp_path / "manifest.json"), str(tmp_path / "rollup_state.json"),
+                             flush_records=100, flush_seconds=0.0, rollup_seconds=3600, max_open_files=8)
+    most_open = 0
+    for _ in range(100):
+        tail.step()
+        most_open = max(most_open, len(tail.files))
+    assert most_open <= 8 and collection.count() == 240
+    tail.close()
+
+    # A restart opens nothing for files that were fully indexed, and only the one that grows later
+    restarted = follower.Follower(collection, NumericStore(str(tmp_path / "store")), str(logs),
+                                  str(tmp_path / "manifest.json"), str(tmp_path / "rollup_state.json"),
+                                  flush_records=100, flush_seconds=0.0, rollup_seconds=3600, idle_seconds=0.0)
+    assert restarted.step() == 0 and restarted.files == {}
+    with open(logs / "p1-007.jsonl", "a") as f:
+        f.write(_lines(240, 1))
+    assert restarted.step() == 1 and list(restarted.files) == [str(logs / "p1-007.jsonl")]
+    restarted.step()
+    assert restarted.files == {} # flushed and idle, so the handle is closed again
+    restarted.close()
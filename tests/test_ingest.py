@@ -0,0 +1,104 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from ingest_manifest import empty_manifest
+
+
+def test_iter_record_batches_yields_bounded_batches(tmp_path, monkeypatch, write_jsonl):
+    write_jsonl(tmp_path / "a.jsonl", 25)
+    with open(tmp_path / "a.jsonl", "a") as f:
+        f.write("not json\n")
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+
+    batches = list(main.iter_record_batches(batch_size=10))
+
+    assert [len(docs) for docs, _, _ in batches] == [10, 10, 5]
+    docs, metas, ids = batches[0]
+    assert docs[0].startswith("On 2025-09-01 at 00:00, the total power import was 1000.000 kWh")
+    assert metas[1]["date"] == "2025-09-01"
+    assert metas[1]["source_file"] == "a.jsonl"
+
+
+def test_load_data_matches_batches(tmp_path, monkeypatch, write_jsonl):
+    write_jsonl(tmp_path / "a.jsonl", 12)
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+
+    documents, metadatas, ids = main.load_data()
+
+    assert len(documents) == len(metadatas) == len(ids) == 12
+    assert len(set(ids)) == 12
+    assert ids[0] == "rec_1756677600"
+
+
+def test_naive_timestamps_are_local_time():
+    stamps = ["2025-10-26 12:00:00", "2025-10-26 02:30:00", "2025-10-26 02:30:00", "2025-03-30 02:30:00"]
+    records = [({"timestamp": ts, "data": {"total_power_import_kwh": 1.0}}, "a.jsonl") for ts in stamps]
+
+    _, metas, ids = main._build_batch(records)
+
+    noon = metas[0]
+    assert (noon["hour"], noon["local_date"], noon["date"]) == (12, "2025-10-26", "2025-10-26")
+    assert noon["epoch"] == 1761476400  # 11:00 UTC, after the switch to winter time
+    # The repeated hour is told apart by order, the skipped one moves forward to 03:00
+    assert [m["epoch"] for m in metas[1:3]] == [1761438600, 1761442200]
+    assert metas[3]["hour"] == 3 and len(set(ids)) == 4
+
+
+def test_manifest_resumes_after_last_complete_line(tmp_path, monkeypatch, write_jsonl):
+    path = tmp_path / "a.jsonl"
+    write_jsonl(path, 5)
+    with open(path, "a") as f:
+        f.write('{"timestamp": "2025-09-01 00:01:00", "da')  # still being written
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    manifest = empty_manifest()
+
+    first_run = [ids for _, _, ids in main.iter_record_batches(manifest=manifest)]
+    assert sum(len(ids) for ids in first_run) == 5
+    assert manifest["files"]["a.jsonl"]["lines"] == 5
+
+    # Unchanged file: nothing to do
+    assert list(main.iter_record_batches(manifest=manifest)) == []
+
+    with open(path, "a") as f:
+        f.write('ta": {"total_power_import_kwh": 1001.0}}\n')
+    second_run = [ids for _, _, ids in main.iter_record_batches(manifest=manifest)]
+    assert second_run == [["rec_1756677660"]]
+    assert manifest["files"]["a.jsonl"]["offset"] == os.path.getsize(path)
+
+
+class _LengthEmbeddingFunction:
+    def __init__(self, model_name):
+        pass
+
+    def __call__(self, input):
+        return [[float(len(text)), 1.0] for text in input]
+
+
+def test_pipeline_upserts_batches_and_saves_manifest(tmp_path, monkeypatch, write_jsonl):
+    import chromadb
+    import ingest_pipeline
+
+    data_dir = tmp_path / "logs"
+    data_dir.mkdir()
+    write_jsonl(data_dir / "a.jsonl", 30)
+    monkeypatch.setattr(main, "DATA_DIR", str(data_dir))
+    monkeypatch.setattr(ingest_pipeline.embedding_functions, "SentenceTransformerEmbeddingFunction", _LengthEmbeddingFunction)
+    collection = chromadb.EphemeralClient().get_or_create_collection("pipeline_test", embedding_function=None)
+    manifest = empty_manifest()
+    saved = []
+
+    stats = ingest_pipeline.run_pipeline(
+        collection,
+        main.iter_record_batches(batch_size=8, manifest=manifest),
+        "mini",
+        manifest=manifest,
+        save_manifest=saved.append,
+        cache_dir=str(tmp_path / "cache"),
+    )
+
+    assert stats["documents"] == collection.count() == 30
+    assert stats["embedded"] == 30
+    assert [s["files"]["a.jsonl"]["lines"] for s in saved] == [8, 16, 24, 30]
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import ujson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+import tools
+from test_aggregator import _fill_store
+
+
+def test_timers_counters_and_exports(tmp_path):
+    registry = metrics.Metrics()
+    with registry.timer("query_stage", stage="filter"):
+        pass
+    with registry.timer("query_stage", stage="filter"):
+        pass
+    registry.count("ingest_records", 1000)
+    registry.count("ingest_records", 24)
+
+    text = registry.to_prometheus()
+    assert "# TYPE smartmeter_ingest_records_total counter" in text
+    assert "smartmeter_ingest_records_total 1024" in text
+    assert 'smartmeter_query_stage_seconds_count{stage="filter"} 2' in text
+
+    registry.export(str(tmp_path / "metrics.prom"))
+    registry.export(str(tmp_path / "metrics.jsonl"), command="test")
+    registry.export(str(tmp_path / "metrics.jsonl"), command="test")
+    assert (tmp_path / "metrics.prom").read_text() == text
+    lines = [ujson.loads(line) for line in (tmp_path / "metrics.jsonl").read_text().splitlines()]
+    assert len(lines) == 2 and lines[0]["command"] == "test"
+    assert lines[0]["timers"][0]["count"] == 2
+
+
+def test_aggregator_stages_are_recorded(tmp_path, monkeypatch):
+    _fill_store(tmp_path / "store")
+    monkeypatch.setattr(tools, "NUMERIC_STORE_PATH", str(tmp_path / "store"))
+    monkeypatch.setattr(metrics, "_trace_path", str(tmp_path / "trace.jsonl"))
+    metrics.METRICS.reset()
+
+    tools.query_aggregator("active_power_w", "MAX", "2025-09-01", "2025-09-03")
+
+    stages = {(timer["name"], timer["labels"].get("stage")) for timer in metrics.METRICS.snapshot()["timers"]}
+    assert {("query", None), ("query_stage", "read"), ("query_stage", "filter"), ("query_stage", "aggregate")} <= stages
+    spans = [ujson.loads(line) for line in (tmp_path / "trace.jsonl").read_text().splitlines()]
+    assert spans[-1]["name"] == "query" and spans[-1]["duration_s"] >= 0
+
+
+def test_profiled_dumps_stats(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "_profile_dir", str(tmp_path))
+    with metrics.profiled("outer"):
+        with metrics.profiled("inner"):
+            sum(range(1000))
+
+    dumps = os.listdir(tmp_path)
+    assert len(dumps) == 1 and dumps[0].startswith("outer-")
@@ -0,0 +1,100 @@
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import planner
+import query_ai
+import smart_database
+import tools
+from result_cache import ResultCache
+
+
+def _manager(tmp_path, monkeypatch):
+    import chromadb
+
+    store_path = str(tmp_path / "numeric_store")
+    store = benchmark.fill_numeric_store(store_path, start_date="2024-06-01", days=10)
+    collection = chromadb.EphemeralClient().get_or_create_collection("planner_test", embedding_function=None)
+    original_upsert = collection.upsert
+    collection.upsert = lambda documents, metadatas, ids: original_upsert(
+        documents=documents, metadatas=metadatas, ids=ids, embeddings=[[0.0, 1.0]] * len(ids))
+    smart_database.update_rollups(collection, smart_database.load_store_readings(store), str(tmp_path / "rollup_state.json"))
+
+    monkeypatch.setattr(query_ai, "CHROMA_PATH", str(tmp_path))
+    monkeypatch.setattr(query_ai, "COLLECTION_NAME", "planner_test")
+    monkeypatch.setattr(tools, "NUMERIC_STORE_PATH", store_path)
+    monkeypatch.setattr(tools, "MANIFEST_PATH", str(tmp_path / "no_manifest.json"))
+    manager = object.__new__(query_ai.ChromaManager)
+    manager.collection = collection
+    manager.numeric_store_path = store_path
+    manager.chroma_path = str(tmp_path)
+    manager.manifest_path = str(tmp_path / "no_manifest.json")
+    manager.result_cache = ResultCache()
+    return manager
+
+
+def test_planner_picks_cheapest_exact_source(tmp_path, monkeypatch):
+    manager = _manager(tmp_path, monkeypatch)
+    query_planner = planner.Planner(manager)
+    parsed = query_ai.QueryParser().parse("top 3 dagen met de meeste teruglevering in 2024")
+
+    plan = query_planner.plan(parsed)
+    assert plan["source"] == "topk_index"
+    assert [c["source"] for c in plan["candidates"]] == ["topk_index", "rollup_scan", "raw_readings"]
+
+    # Every exact source gives the same answer
+    answers = {}
+    for source in ("topk_index", "rollup_scan", "raw_readings"):
+        manager.result_cache = ResultCache()
+        results, actual = query_planner.execute(dict(plan, source=source))
+        answers[source] = [(item_id, round(metadata["total_export_kwh"], 6)) for item_id, metadata in results]
+        assert actual["rows"] > 0
+    assert answers["topk_index"] == answers["rollup_scan"] == answers["raw_readings"]
+    assert len(answers["topk_index"]) == 3
+
+    # Without the top-K index the paged rollup scan is cheaper than recomputing from readings
+    shutil.rmtree(tmp_path / smart_database.TOPK_INDEX_DIRNAME)
+    query_planner.refresh()
+    plan = query_planner.plan(parsed)
+    assert plan["source"] == "rollup_scan"
+    assert "no top-K index" in planner.explain(plan)
+
+
+def test_aggregate_plan_estimates_rows_exactly(tmp_path, monkeypatch):
+    manager = _manager(tmp_path, monkeypatch)
+    query_planner = planner.Planner(manager)
+    parsed = query_ai.QueryParser().parse("hoeveel verbruik op 2024-06-03")
+
+    plan = query_planner.plan(parsed)
+    result, actual = query_planner.execute(plan)
+
+    assert plan["source"] == "numeric_store"
+    assert result["aggregation_type"] == "DELTA" and result["value"] > 0
+    assert actual["rows"] == plan["estimated_rows"]
+    text = planner.explain(plan, actual)
+    assert "* numeric_store" in text and "rollups" in text and "Actual: rows=" in text
+
+
+def test_main_explains_unanswerable_question_on_empty_store(tmp_path, monkeypatch, capsys):
+    import chromadb
+
+    manager = object.__new__(query_ai.ChromaManager)
+    manager.collection = chromadb.EphemeralClient().get_or_create_collection("planner_empty", embedding_function=None)
+    manager.numeric_store_path = str(tmp_path / "empty_store")
+    manager.chroma_path = str(tmp_path)
+    manager.manifest_path = str(tmp_path / "no_manifest.json")
+    manager.result_cache = ResultCache()
+    monkeypatch.setattr(query_ai, "ChromaManager", lambda **kwargs: manager)
+    configured = []
+    monkeypatch.setattr(tools, "configure", lambda chroma_path, numeric_store_path, client=None: configured.append(numeric_store_path))
+    monkeypatch.setattr(tools, "NUMERIC_STORE_PATH", str(tmp_path / "empty_store"))
+    monkeypatch.setattr(sys, "argv", ["query_ai.py", "top 3 dagen met de meeste teruglevering in 2024", "--root", str(tmp_path)])
+
+    query_ai.main()
+
+    assert "No source can answer this question exactly" in capsys.readouterr().out
+    # The aggregator reads the same data root as the collection
+    assert configured == [str(tmp_path / "numeric_store")]
@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shards
+import tools
+from query_server import QueryService
+
+
+def test_service_reads_every_store_from_one_root(tmp_path, monkeypatch):
+    import chromadb
+
+    for name in ("CHROMA_DB_PATH", "NUMERIC_STORE_PATH", "MANIFEST_PATH", "_CLIENT"):
+        monkeypatch.setattr(tools, name, getattr(tools, name))
+    monkeypatch.setattr(shards, "SHARD_ROOT", shards.SHARD_ROOT)
+    monkeypatch.setenv("SMARTMETER_ROOT", str(tmp_path))
+    chromadb.PersistentClient(path=str(tmp_path / "chroma_db")).create_collection("smartmeter_data", embedding_function=None)
+    opened = []
+    original_client = chromadb.PersistentClient
+    monkeypatch.setattr(chromadb, "PersistentClient", lambda path, **kwargs: opened.append(path) or original_client(path, **kwargs))
+
+    service = QueryService(warm=False)
+    tools.get_collection()
+    assert opened == [str(tmp_path / "chroma_db")] and service.chroma_manager.client is service.client
+    assert service.chroma_manager.manifest_path == tools.MANIFEST_PATH == service.manifest_path
+    assert tools.NUMERIC_STORE_PATH == service.chroma_manager.numeric_store_path == str(tmp_path / "numeric_store")
+    assert service.retriever.collection.name == "smartmeter_data"
+    tools.get_collection.cache_clear()
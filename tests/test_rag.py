@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+import ujson
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rag
+from result_cache import ResultCache
+
+
+def _stub_server(tokens, requests):
+    """Minimal OpenAI-compatible /v1/chat/completions endpoint that streams `tokens` as SSE chunks."""
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            requests.append(ujson.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for token in tokens:
+                chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                self.wfile.write(f"data: {ujson.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_context_is_budgeted_and_deduplicated():
+    documents = [f"On 2025-09-01 at 12:0{i // 6}, the total power import was 1234.{i:03d} kWh." for i in range(60)]
+    facts = ["2025-09-01: DELTA van total_power_import_kwh = 8.123"]
+
+    context, stats = rag.pack_context(iter(documents), facts, token_budget=10_000)
+    assert (stats["facts"], stats["documents"], stats["duplicates"], stats["truncated"]) == (1, 10, 50, 0)
+    assert stats["tokens"] == sum(rag.estimate_tokens(line[2:]) for line in context.splitlines())
+    assert context.splitlines()[0] == f"- {facts[0]}"
+
+    consumed = []
+    def lazy_documents():
+        for document in documents:
+            consumed.append(document)
+            yield document
+    _, stats = rag.pack_context(lazy_documents(), facts, token_budget=60)
+    assert stats["documents"] == 2 and stats["truncated"] == 1
+    assert len(consumed) < len(documents) # packing stopped once the budget was full
+
+
+def test_answer_streams_from_openai_compatible_endpoint_and_caches(monkeypatch):
+    pytest.importorskip("openai")
+    requests = []
+    server = _stub_server(["Op ", "1 september ", "was de import 8,1 kWh."], requests)
+    try:
+        monkeypatch.setenv(rag.LLM_API_KEY_ENV, "test")
+        client = rag.make_client(f"http://127.0.0.1:{server.server_address[1]}/v1")
+        answerer = rag.RagAnswerer(client, model="stub", cache=ResultCache(), ingest={"generation": 1, "since": 1, "writes": []})
+
+        pieces = list(answerer.answer("Hoeveel stroom op 2025-09-01?", ["On 2025-09-01 at 12:00, ..."], ["feit"]))
+        assert pieces == ["Op ", "1 september ", "was de import 8,1 kWh."]
+        assert requests[0]["stream"] is True
+        assert "feit" in requests[0]["messages"][1]["content"]
+
+        # The same prompt is answered from the cache until anything new is ingested
+        assert "".join(answerer.answer("Hoeveel stroom op 2025-09-01?", ["On 2025-09-01 at 12:00, ..."], ["feit"])) == "".join(pieces)
+        assert len(requests) == 1
+        answerer.ingest = {"generation": 2, "since": 1, "writes": [[2, 0, 60]]}
+        list(answerer.answer("Hoeveel stroom op 2025-09-01?", ["On 2025-09-01 at 12:00, ..."], ["feit"]))
+        assert len(requests) == 2
+    finally:
+        server.shutdown()
+        server.server_close()
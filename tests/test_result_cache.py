@@ -0,0 +1,92 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+from result_cache import ResultCache, cache_key
+
+
+def test_writes_invalidate_only_overlapping_ranges(tmp_path):
+    from ingest_manifest import empty_manifest, ingest_state, record_ingest
+
+    manifest = empty_manifest()
+    record_ingest(manifest, (0, 1000))
+    cache = ResultCache(path=str(tmp_path / "results.json"))
+    cache.put("historic", {"value": 1}, ingest_state(manifest), range_start=0, range_end=500)
+    cache.put("today", {"value": 2}, ingest_state(manifest), range_start=900, range_end=1200)
+    cache.put("everything", {"value": 3}, ingest_state(manifest))
+
+    record_ingest(manifest, (1001, 2000))
+    reopened = ResultCache(path=str(tmp_path / "results.json"))
+    assert reopened.get("historic", ingest_state(manifest)) == {"value": 1}
+    assert reopened.get("today", ingest_state(manifest)) is None
+    assert reopened.get("everything", ingest_state(manifest)) is None
+
+    # A backfill into the past invalidates the range although the last epoch did not move
+    record_ingest(manifest, (400, 450))
+    assert reopened.get("historic", ingest_state(manifest)) is None
+    assert cache_key("a", {"x": 1, "y": 2}) == cache_key("a", {"y": 2, "x": 1})
+
+
+def test_entries_older_than_the_write_log_are_dropped():
+    from ingest_manifest import WRITE_LOG_LENGTH, empty_manifest, ingest_state, record_ingest
+
+    manifest = empty_manifest()
+    record_ingest(manifest, (0, 10))
+    cache = ResultCache()
+    cache.put("old", "x", ingest_state(manifest), range_start=0, range_end=10)
+    for _ in range(WRITE_LOG_LENGTH + 1):
+        record_ingest(manifest, (100, 200))
+    assert cache.get("old", ingest_state(manifest)) is None
+
+    # A rebuild carries the generation on, so nothing cached before it looks current
+    cache.put("old", "x", ingest_state(manifest), range_start=0, range_end=10)
+    rebuilt = empty_manifest(manifest["generation"])
+    record_ingest(rebuilt, (100, 200))
+    assert cache.get("old", ingest_state(rebuilt)) is None
+
+
+def test_lru_bound_and_unknown_ingest_state():
+    ingest = {"generation": 1, "since": 1, "writes": [[1, 0, 10]]}
+    cache = ResultCache(max_entries=2)
+    for key in "abc":
+        cache.put(key, key, ingest)
+    cache.put("ignored", "x", None)
+
+    assert len(cache) == 2 and cache.get("a", ingest) is None
+    assert cache.get("c", ingest) == "c" and cache.get("c", None) is None
+
+
+def test_aggregator_reuses_cached_results(tmp_path, monkeypatch):
+    from test_aggregator import _fill_store
+    from ingest_manifest import empty_manifest, record_ingest, save_manifest
+
+    store, epochs, _ = _fill_store(tmp_path / "store", days=3)
+    manifest_path = str(tmp_path / "manifest.json")
+    manifest = empty_manifest()
+    record_ingest(manifest, (int(epochs[0]), int(epochs[-1])))
+    save_manifest(manifest, manifest_path)
+    monkeypatch.setattr(tools, "NUMERIC_STORE_PATH", str(tmp_path / "store"))
+    monkeypatch.setattr(tools, "MANIFEST_PATH", manifest_path)
+    monkeypatch.setattr(tools, "RESULT_CACHE", ResultCache())
+    scans = []
+    original = tools._iter_reading_chunks
+    monkeypatch.setattr(tools, "_iter_reading_chunks", lambda *args, **kwargs: scans.append(args) or original(*args, **kwargs))
+
+    first = tools.query_aggregator("active_power_w", "MAX", "2025-09-01", "2025-09-01")
+    again = tools.query_aggregator("active_power_w", "MAX", "2025-09-01", "2025-09-01")
+    tools.query_aggregator("active_power_w", "MAX", "2025-09-01", "2025-09-03")
+    assert first == again and len(scans) == 2
+
+    record_ingest(manifest, (int(epochs[-1]) + 60, int(epochs[-1]) + 60))
+    save_manifest(manifest, manifest_path)
+    assert tools.query_aggregator("active_power_w", "MAX", "2025-09-01", "2025-09-01") == first
+    tools.query_aggregator("active_power_w", "MAX", "2025-09-01", "2025-09-03")
+    assert len(scans) == 3  # only the range that reaches the new data is recomputed
+
+    # Readings backfilled into the first day recompute it, though the last epoch stays the same
+    record_ingest(manifest, (int(epochs[840]), int(epochs[850])))
+    save_manifest(manifest, manifest_path)
+    tools.query_aggregator("active_power_w", "MAX", "2025-09-01", "2025-09-01")
+    assert len(scans) == 4
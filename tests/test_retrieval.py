@@ -1,10 +1,18 @@
 import os
+import sys
 import chromadb
+import numpy as np
 from chromadb.utils import embedding_functions
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_cache import CachedEmbeddingFunction
+from retrieval import Retriever
+
 # --- Constants ---
 # Ensure these constants match the ones used in main.py
 CHROMA_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chroma_db")
+EMBEDDING_CACHE_PATH = os.path.join(os.path.dirname(CHROMA_DB_PATH), "embedding_cache")
 COLLECTION_NAME = "smartmeter_data"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 
@@ -21,8 +29,10 @@ def test_retrieval_date_filter_only():
 
     # 1. Initialize ChromaDB client and embedding function
     client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-    embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=EMBEDDING_MODEL
+    embedding_function = CachedEmbeddingFunction(
+        embedding_functions.SentenceTransformerEmbeddingFunction,
+        model_name=EMBEDDING_MODEL,
+        cache_dir=EMBEDDING_CACHE_PATH
     )
 
     # 2. Get the existing collection
@@ -40,20 +50,17 @@ def test_retrieval_date_filter_only():
     target_date = "2025-09-01"
     print(f"\nAttempting to retrieve documents for date: {target_date}")
 
-    # 4. Query the collection using only the 'where' clause
+    # 4. Filter-only lookup: paged metadata gets, the model is never loaded
     try:
-        results = collection.query(
-            query_texts=[""], # Empty query_text as we are only filtering by metadata
-            n_results=100, # Get up to 100 results for this date
-            where={"date": target_date}
-        )
+        results = Retriever(collection, embedding_function).retrieve(date=target_date, limit=100)
     except Exception as e:
-        print(f"Error during query with date filter: {e}")
+        print(f"Error during retrieval with date filter: {e}")
         return
+    assert embedding_function.hits + embedding_function.misses == 0
 
     # 5. Print the results
     print("\n--- Retrieved Documents with Date Filter ---")
-    context_documents = results.get('documents', [[]])[0]
+    context_documents = results['documents']
     if not context_documents:
         print(f"No documents found for date {target_date} using metadata filter.")
         return
@@ -62,10 +69,45 @@ def test_retrieval_date_filter_only():
     for i, doc in enumerate(context_documents):
         print(f"\nResult {i+1}:")
         print(f"  Document: {doc}")
-        metadata = results['metadatas'][0][i]
+        metadata = results['metadatas'][i]
         print(f"  Metadata: {metadata}")
 
     print("\n--- Retrieval Test (Date Filter Only) Complete ---")
 
+class _CountingEmbeddingFunction:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, texts):
+        self.calls += 1
+        return [[1.0, 0.0, 0.0]] * len(texts)
+
+def test_filter_only_requests_skip_the_model_and_are_not_capped():
+    collection = chromadb.EphemeralClient().get_or_create_collection("retrieval_test", embedding_function=None,
+                                                                     metadata={"hnsw:space": "cosine"})
+    angles = np.linspace(0, np.pi / 2, 30)
+    collection.add(
+        ids=[f"r{i}" for i in range(30)],
+        documents=[f"reading {i}" for i in range(30)],
+        metadatas=[{"date": f"2025-09-0{1 + i % 3}"} for i in range(30)],
+        embeddings=[[np.cos(a), np.sin(a), 0.0] for a in angles]
+    )
+    embedding_function = _CountingEmbeddingFunction()
+    retriever = Retriever(collection, embedding_function)
+
+    results = retriever.retrieve(date="2025-09-01", n_results=2)
+    assert results["mode"] == "filter" and len(results["ids"]) == 10
+    assert len(retriever.retrieve(start_date="2025-09-02", end_date="2025-09-03")["ids"]) == 20
+    assert retriever.retrieve("stroomverbruik", date="2025-12-25")["ids"] == []
+    assert embedding_function.calls == 0
+
+    # Semantic search ranks only the prefiltered candidates, nearest to [1, 0, 0] first
+    results = retriever.retrieve("stroomverbruik", n_results=3, date="2025-09-02")
+    assert results["ids"] == ["r1", "r4", "r7"]
+    assert results["distances"] == sorted(results["distances"])
+    retriever.exact_prefilter_limit = 5 # falls back to Chroma's filtered HNSW search
+    assert retriever.retrieve("stroomverbruik", n_results=3, date="2025-09-02")["ids"] == ["r1", "r4", "r7"]
+    assert embedding_function.calls == 2
+
 if __name__ == "__main__":
     test_retrieval_date_filter_only()
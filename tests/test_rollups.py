@@ -0,0 +1,217 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import smart_database
+from result_cache import ResultCache
+
+
+def _readings(start="2025-06-02", days=14):
+    index = pd.date_range(start, periods=days * 24 * 6, freq="10min")
+    steps = np.arange(len(index))
+    return pd.DataFrame({
+        "total_power_import_kwh": 1000 + steps * 0.05,
+        "total_power_export_kwh": 500 + steps * 0.1,
+    }, index=index)
+
+
+def test_compute_rollups_per_level():
+    df = _readings()
+
+    ids, documents, metadatas, starts = smart_database.compute_rollups(df, "day")
+    assert ids[0] == "day_2025-06-02" and len(ids) == 14
+    assert metadatas[0]["level"] == "day" and metadatas[0]["date"] == "2025-06-02"
+    assert abs(metadatas[0]["total_import_kwh"] - 143 * 0.05) < 1e-9
+
+    ids, _, metadatas, _ = smart_database.compute_rollups(df, "week")
+    # Monday 2 June - Sunday 8 June 2025 is labelled by its Sunday, as before
+    assert ids[0] == "week_2025-23" and metadatas[0]["week_of_year"] == 23
+
+    ids, _, metadatas, _ = smart_database.compute_rollups(df, "hour")
+    assert ids[0] == "hour_2025-06-02T00" and metadatas[0]["hour"] == 0
+    assert len(ids) == 14 * 24
+
+
+def test_update_rollups_only_touches_open_periods(tmp_path):
+    import chromadb
+
+    df = _readings()
+    state_path = str(tmp_path / "rollup_state.json")
+    collection = chromadb.EphemeralClient().get_or_create_collection("rollup_test", embedding_function=None)
+    upserted = []
+    original_upsert = collection.upsert
+
+    def counting_upsert(documents, metadatas, ids):
+        upserted.extend(ids)
+        original_upsert(documents=documents, metadatas=metadatas, ids=ids, embeddings=[[0.0, 1.0]] * len(ids))
+
+    collection.upsert = counting_upsert
+    smart_database.update_rollups(collection, df, state_path)
+    assert len(upserted) == 14 * 24 + 14 + 2 + 1
+
+    upserted.clear()
+    more = _readings(start=str(df.index[-1] + pd.Timedelta("10min")), days=1) + 10
+    smart_database.update_rollups(collection, more, state_path)
+    assert "day_2025-06-16" in upserted and "day_2025-06-02" not in upserted
+
+
+def test_backfilled_readings_recompute_their_closed_periods(tmp_path):
+    import chromadb
+    import topk_index
+
+    df = _readings()
+    state_path = str(tmp_path / "rollup_state.json")
+    collection = chromadb.EphemeralClient().get_or_create_collection("backfill_test", embedding_function=None)
+    original_upsert = collection.upsert
+    collection.upsert = lambda documents, metadatas, ids: original_upsert(
+        documents=documents, metadatas=metadatas, ids=ids, embeddings=[[0.0, 1.0]] * len(ids))
+    smart_database.update_rollups(collection, df, state_path)
+
+    # A late file corrects the readings from 5 June noon onwards: only that closed day grows
+    backfilled = df.copy()
+    backfilled.loc[backfilled.index >= "2025-06-05 12:00", "total_power_import_kwh"] += 50
+    written = (int(pd.Timestamp("2025-06-05 12:00").timestamp()), int(df.index[-1].timestamp()))
+    state = smart_database.load_rollup_state(state_path)
+    cutoff = smart_database.rollup_cutoff(state, written)
+    assert cutoff == int(pd.Timestamp("2025-06-01").timestamp()) # floored to the start of its month
+    smart_database.update_rollups(collection, backfilled[backfilled.index >= pd.Timestamp(cutoff, unit="s")], state_path, written)
+
+    record = collection.get(ids=["day_2025-06-05"], include=["metadatas"])["metadatas"][0]
+    assert abs(record["total_import_kwh"] - (143 * 0.05 + 50)) < 1e-9
+    index = topk_index.load_index(topk_index.index_path(str(tmp_path), collection.name, "day", "desc"))
+    assert topk_index.top_ids_from_index(index, "total_import_kwh", 1) == ["day_2025-06-05"]
+    assert index["periods"]["all"] == 14
+
+
+def test_top_k_from_index_matches_paged_scan(tmp_path, monkeypatch):
+    import chromadb
+    import query_ai
+    import topk_index
+
+    df = _readings(days=30)
+    df["total_power_export_kwh"] += np.sin(np.arange(len(df)) / 500.0) ** 2 * np.arange(len(df)) * 0.01
+    state_path = str(tmp_path / "rollup_state.json")
+    collection = chromadb.EphemeralClient().get_or_create_collection("topk_test", embedding_function=None)
+    original_upsert = collection.upsert
+    collection.upsert = lambda documents, metadatas, ids: original_upsert(
+        documents=documents, metadatas=metadatas, ids=ids, embeddings=[[0.0, 1.0]] * len(ids))
+    smart_database.update_rollups(collection, df, state_path)
+
+    manager = object.__new__(query_ai.ChromaManager)
+    manager.collection = collection
+    manager.result_cache = ResultCache()
+    manager.chroma_path = str(tmp_path)
+    manager.manifest_path = str(tmp_path / "no_manifest.json")
+
+    from_index = manager.get_analytical_answer("day", 2025, "total_export_kwh", "desc", 5)
+    scanned = topk_index.scan_top_k(
+        collection, {"$and": [{"level": "day"}, {"year": 2025}]}, "total_export_kwh", "desc", 5, page_size=7)
+    full = collection.get(where={"level": "day"})
+    expected = sorted(zip(full["ids"], full["metadatas"]), key=lambda item: item[1]["total_export_kwh"], reverse=True)[:5]
+
+    assert [item_id for item_id, _ in from_index] == [item_id for item_id, _ in expected]
+    assert [item_id for item_id, _ in scanned] == [item_id for item_id, _ in expected]
+    assert topk_index.scan_top_k(collection, {"level": "day"}, "total_export_kwh", "desc", 0) == []
+    lowest = manager.get_analytical_answer("hour", None, "total_import_kwh", "asc", 3)
+    assert len(lowest) == 3 and all(metadata["level"] == "hour" for _, metadata in lowest)
+
+
+def test_bounded_index_stays_exact_across_incremental_updates(tmp_path):
+    import topk_index
+
+    rng = np.random.default_rng(7)
+    final = {}
+    # Like update_rollups: every batch recomputes the last (open) period and adds new ones
+    for batch_start in range(0, 60, 6):
+        ids, metadatas = [], []
+        for period in range(max(batch_start - 1, 0), batch_start + 6):
+            record_id = f"day_{period:03d}"
+            final[record_id] = {"period_start": period, "year": 2024 + period // 40,
+                                "total_import_kwh": float(rng.random()), "total_export_kwh": 0.0, "total_gas_m3": 0.0}
+            ids.append(record_id)
+            metadatas.append(final[record_id])
+        topk_index.update_index(str(tmp_path), "c", "day", ids, metadatas, k_max=4)
+
+    for order in topk_index.ORDERS:
+        index = topk_index.load_index(topk_index.index_path(str(tmp_path), "c", "day", order))
+        assert index["periods"] == {"all": 60, "2024": 40, "2025": 20}
+        assert all(len(scope["entries"]) <= 4 for scope in index["keys"]["total_import_kwh"].values())
+        for year in (None, 2024, 2025):
+            matching = [i for i in final if year is None or final[i]["year"] == year]
+            expected = sorted(matching, key=lambda i: final[i]["total_import_kwh"], reverse=(order == "desc"))
+            assert topk_index.top_ids_from_index(index, "total_import_kwh", 3, year) == expected[:3]
+        # Beyond the kept top-K the index cannot answer exactly
+        assert topk_index.top_ids_from_index(index, "total_import_kwh", 10) is None
+
+    # A backfill rewrites closed periods: some of the best drop, some others rise
+    best = sorted(final, key=lambda i: final[i]["total_import_kwh"], reverse=True)
+    rewritten = {best[0]: 0.0, best[2]: 0.01, best[30]: 5.0, best[-1]: 0.5}
+    for record_id, value in rewritten.items():
+        final[record_id] = dict(final[record_id], total_import_kwh=value)
+    topk_index.update_index(str(tmp_path), "c", "day", list(rewritten), [final[i] for i in rewritten], new_ids=set(), k_max=4)
+    for order in topk_index.ORDERS:
+        index = topk_index.load_index(topk_index.index_path(str(tmp_path), "c", "day", order))
+        assert index["periods"]["all"] == 60
+        expected = sorted(final, key=lambda i: final[i]["total_import_kwh"], reverse=(order == "desc"))
+        for limit in range(1, 5):
+            ids = topk_index.top_ids_from_index(index, "total_import_kwh", limit)
+            assert ids is None or ids == expected[:limit]
+        assert topk_index.top_ids_from_index(index, "total_import_kwh", 1) == expected[:1]
+
+
+def test_csv_readings_are_typed_chunked_and_cached(tmp_path):
+    import synthetic_p1
+    from metrics import METRICS
+
+    csv_path = synthetic_p1.write_csv(str(tmp_path / "P1metingen.csv"), start_date="2025-06-02", days=2, cadence_s=60)
+    cache_path = str(tmp_path / smart_database.CSV_CACHE_FILENAME)
+    expected = pd.read_csv(csv_path)
+    since = int(expected["timestamp"].iloc[1500])
+
+    df = smart_database.load_csv_readings(csv_path, since, cache_path=cache_path, chunksize=1000)
+    assert list(df.columns) == list(smart_database.COUNTER_COLUMNS)
+    assert len(df) == len(expected) - 1500 and df.index[0] == pd.Timestamp(since, unit="s")
+    np.testing.assert_array_equal(df["total_power_import_kwh"].to_numpy(),
+                                  expected["total_power_import_kwh"].to_numpy()[1500:])
+
+    # An unchanged CSV is served from the Parquet cache, filtered on the cutoff
+    key = ("rollup_stage", (("stage", "read_csv_cache"),))
+    before = METRICS.timers.get(key, [0])[0]
+    cached = smart_database.load_csv_readings(csv_path, since, cache_path=cache_path)
+    pd.testing.assert_frame_equal(cached, df)
+    assert METRICS.timers[key][0] == before + 1
+
+    # pyarrow parses to the same frame
+    pd.testing.assert_frame_equal(smart_database.load_csv_readings(csv_path, since, engine="pyarrow"), df)
+
+    # A changed CSV invalidates the cache
+    synthetic_p1.write_csv(csv_path, start_date="2025-06-02", days=1, cadence_s=60)
+    assert len(smart_database.load_csv_readings(csv_path, cache_path=cache_path)) == 24 * 60
+
+
+def test_setup_database_invalidates_cached_results_it_rewrites(tmp_path, monkeypatch):
+    import synthetic_p1
+    from ingest_manifest import MANIFEST_FILENAME, read_ingest_state
+
+    csv_path = synthetic_p1.write_csv(str(tmp_path / "P1metingen.csv"), start_date="2025-06-02", days=1, cadence_s=600)
+    monkeypatch.setattr(smart_database, "CSV_PATH", csv_path)
+    monkeypatch.setattr(smart_database, "CHROMA_PATH", str(tmp_path / "chroma_db"))
+    monkeypatch.setattr(smart_database, "update_rollups", lambda collection, df, state_path: None)
+    manifest_path = str(tmp_path / "chroma_db" / MANIFEST_FILENAME)
+    timestamps = pd.read_csv(csv_path)["timestamp"]
+    day = int(timestamps.iloc[0])
+
+    smart_database.setup_database(csv_cache=False)
+    cache = ResultCache()
+    cache.put("june", {"answer": 1}, read_ingest_state(manifest_path), day, day + 86400)
+    cache.put("july", {"answer": 2}, read_ingest_state(manifest_path), day + 30 * 86400, day + 31 * 86400)
+
+    smart_database.setup_database(rebuild=True, csv_cache=False)
+    state = read_ingest_state(manifest_path)
+    assert state["writes"][-1][1:] == [day, int(timestamps.iloc[-1])]
+    assert cache.get("june", state) is None
+    assert cache.get("july", state) == {"answer": 2}
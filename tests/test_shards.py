@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+import shards
+import tools
+from result_cache import ResultCache
+
+
+def _ingest_stores(catalog, data_root):
+    """The numeric half of shards.ingest_meter, without a collection or embeddings."""
+    for meter, data_dir in shards.meter_dirs(str(data_root)).items():
+        catalog.meter(meter, per_year=(meter == "north"))
+        for _ in shards.route_readings(main.iter_record_batches(batch_size=7, data_dir=data_dir), catalog, meter):
+            pass
+        catalog.refresh(meter)
+    catalog.save()
+
+
+def test_fan_out_matches_per_meter_results(tmp_path, monkeypatch, write_jsonl):
+    # 'north' crosses into 2025 UTC (and is split per year); 'south' has one store
+    for meter in ("north", "south"):
+        os.makedirs(tmp_path / "logs" / meter)
+    write_jsonl(tmp_path / "logs" / "north" / "a.jsonl", 40, start="2025-01-01 00:58:00")
+    write_jsonl(tmp_path / "logs" / "south" / "a.jsonl", 30, start="2025-01-01 00:30:00")
+    monkeypatch.setattr(shards, "SHARD_ROOT", str(tmp_path / "shards"))
+    monkeypatch.setattr(tools, "RESULT_CACHE", ResultCache())
+    catalog = shards.ShardCatalog()
+    _ingest_stores(catalog, tmp_path / "logs")
+
+    assert sorted(catalog.data["meters"]["north"]["shards"]) == ["2024", "2025"]
+    assert [s["key"] for s in catalog.shards("north", *shards.year_span(2024))] == ["2024"]
+    assert [s["meter"] for s in catalog.shards(shards.ALL_METERS, *shards.year_span(2025))] == ["north", "south"]
+
+    delta = {"metric": "total_power_import_kwh", "aggregation": "DELTA"}
+    peak = {"metric": "total_power_export_kwh", "aggregation": "MAX"}
+    north = tools.query_aggregator_batch("2024-12-31", "2025-01-01", [delta, peak], meters="north")
+    south = tools.query_aggregator_batch("2024-12-31", "2025-01-01", [delta, peak], meters=["south"])
+    both = tools.query_aggregator_batch("2024-12-31", "2025-01-01", [delta, peak], meters=shards.ALL_METERS)
+
+    assert abs(north[0]["value"] - 39 * 0.001) < 1e-9
+    assert abs(both[0]["value"] - (north[0]["value"] + south[0]["value"])) < 1e-9
+    assert both[1]["value"] == max(north[1]["value"], south[1]["value"]) and both[0]["meters"] == 2
+    assert "error" in tools.query_aggregator_batch("2024-12-31", "2025-01-01", [delta], meters="west")[0]
+
+    # Only 'south' advances; the open range is recomputed although the slowest watermark did not move
+    write_jsonl(tmp_path / "logs" / "south" / "b.jsonl", 10, start="2025-01-01 02:00:00")
+    _ingest_stores(shards.ShardCatalog(), tmp_path / "logs")
+    again = tools.query_aggregator_batch("2024-12-31", "2025-01-01", [delta], meters=shards.ALL_METERS)
+    assert abs(again[0]["value"] - both[0]["value"]) > 1e-6  # b.jsonl restarts the counter, so the delta changes
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot
+
+
+@pytest.mark.parametrize("fmt", snapshot.FORMATS)
+def test_export_and_restore_round_trip_without_the_model(tmp_path, fmt):
+    import chromadb
+
+    client = chromadb.EphemeralClient()
+    name = f"snapshot_source_{fmt}"
+    source = client.get_or_create_collection(name, embedding_function=None, metadata={"hnsw:space": "cosine", "hnsw:M": 8})
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(250, 16)).astype(np.float32)
+    ids = [f"rec_{i}" for i in range(250)]
+    source.add(ids=ids, embeddings=vectors, documents=[f"reading {i}" for i in range(250)],
+               metadatas=[{"epoch": i, "date": "2025-09-01"} for i in range(250)])
+
+    manifest = snapshot.export_collection(source, str(tmp_path), fmt, page_size=40, shard_size=100)
+    assert manifest["records"] == 250 and manifest["dimension"] == 16
+    assert [shard["records"] for shard in manifest["shards"]] == [100, 100, 50]
+
+    restored = snapshot.restore_collection(client, str(tmp_path), name=f"snapshot_copy_{fmt}", batch_size=64)
+    assert restored.metadata["hnsw:M"] == 8
+    original = source.get(ids=ids, include=snapshot.INCLUDE)
+    copy = restored.get(ids=ids, include=snapshot.INCLUDE)
+    assert copy["documents"] == original["documents"] and copy["metadatas"] == original["metadatas"]
+    np.testing.assert_allclose(copy["embeddings"], original["embeddings"], rtol=1e-6)
+    query = source.query(query_embeddings=vectors[:3], n_results=5)
+    assert restored.query(query_embeddings=vectors[:3], n_results=5)["ids"] == query["ids"]
+
+    # A snapshot is never restored over an existing collection by accident
+    with pytest.raises(Exception):
+        snapshot.restore_collection(client, str(tmp_path), name=f"snapshot_copy_{fmt}")
+
+
+def test_export_cursor_survives_writes_during_the_export(tmp_path):
+    import chromadb
+
+    collection = chromadb.EphemeralClient().get_or_create_collection("snapshot_live", embedding_function=None)
+    ids = [f"rec_{i * 60}" for i in range(300)]
+    collection.add(ids=ids, embeddings=np.ones((300, 4), dtype=np.float32), documents=ids,
+                   metadatas=[{"epoch": i * 60} for i in range(300)])
+    collection.add(ids=["day_0"], embeddings=np.ones((1, 4), dtype=np.float32), documents=["day"],
+                   metadatas=[{"level": "day", "period_start": 0}])
+
+    # After the second page, readings arrive before and after the cursor, exported ones are deleted or rewritten
+    original_get, pages = collection.get, []
+    def get(**kwargs):
+        page = original_get(**kwargs)
+        if kwargs.get("include") and len(pages) == 1:
+            new = [f"rec_{epoch}" for epoch in (30, 90, 17_970 + 30, 40_000)]
+            collection.delete(ids=ids[:10])
+            collection.upsert(ids=new + ids[10:50], embeddings=np.ones((44, 4), dtype=np.float32), documents=new + ids[10:50],
+                              metadatas=[{"epoch": int(item.split("_")[1])} for item in new + ids[10:50]])
+        if kwargs.get("include"):
+            pages.append(page["ids"])
+        return page
+    collection.get = get
+
+    manifest = snapshot.export_collection(collection, str(tmp_path), "ndjson", page_size=40)
+    exported = [item for page in pages for item in page]
+    assert len(exported) == len(set(exported)) == manifest["records"]
+    assert set(ids + ["day_0"]) <= set(exported) and {"rec_18000", "rec_40000"} <= set(exported)
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+from vector_index import QuantizedIndex
+
+
+def test_quantized_search_matches_exact_search(tmp_path):
+    vectors = benchmark.synthetic_embeddings(1000, dim=32, seed=3)
+    queries = benchmark.synthetic_embeddings(5, dim=32, seed=4)
+    ids = [f"v{i}" for i in range(len(vectors))]
+    exact = [[ids[i] for i in np.argsort(-scores)[:5]] for scores in queries @ vectors.T]
+
+    for dtype in ("float16", "int8"):
+        index = QuantizedIndex(str(tmp_path / "index"), dtype=dtype)
+        index.add(ids[:600], vectors[:600])
+        index.add(ids[600:], vectors[600:])
+        found, distances = index.search(queries, k=5)
+        blocked, _ = index.search(queries, k=5, block_size=64)
+
+        assert found == blocked
+        assert sum(len(set(a) & set(b)) for a, b in zip(found, exact)) >= 0.9 * 25
+        assert all(d == sorted(d) for d in distances)
+
+    # Reopening reads the memmap back; re-adding an id overwrites its row
+    index = QuantizedIndex(str(tmp_path / "index"), dtype="int8")
+    assert len(index) == 1000
+    index.add(["v0"], queries[:1])
+    assert len(index) == 1000 and index.search(queries[:1], k=1)[0] == [["v0"]]
+    restricted, _ = index.search(queries[:1], k=3, rows=[index.rows["v5"], index.rows["v6"]])
+    assert sorted(restricted[0]) == ["v5", "v6"]
+
+
+def test_vector_index_benchmark_reports_recall(tmp_path):
+    results = benchmark.bench_vector_index(str(tmp_path), count=300, queries=10, k=5, ef_values=(10,))
+
+    assert set(results) == {"vectors", "hnsw.ef10", "quantized.int8", "quantized.float16"}
+    assert results["quantized.float16"]["recall_at_k"] > 0.9
+    assert results["quantized.int8"]["bytes"] < results["vectors"]["float32_bytes"] / 3
+    assert all("median_s" in timing for _, timing in benchmark._flatten(results))
@@ -1,12 +1,29 @@
 import argparse
+import os
 import chromadb
+import numpy as np
 import pandas as pd
 from datetime import datetime, time
-from typing import Literal, Dict, Any, Optional
+from functools import lru_cache
+from typing import Literal, Dict, Any, List, Optional
+import compaction
+from numeric_store import NumericStore
+from ingest_manifest import MANIFEST_FILENAME, read_ingest_state, read_metadata_version
+from metrics import METRICS, count, enable_profiling, profiled, timer
+from query_server import data_paths
+from result_cache import ResultCache, cache_key
 
 # --- Constants ---
-CHROMA_DB_PATH = "C:\\Users\\emanu\\Documenten\\GitHub\\smartmeter-rag\\chroma_db"
-COLLECTION_NAME = "smartmeter_master"
+# Same layout under the working directory as main.py indexes into; see configure for another root
+_PATHS = data_paths(os.getcwd())
+CHROMA_DB_PATH = _PATHS["chroma"]
+COLLECTION_NAME = "smartmeter_data"
+NUMERIC_STORE_PATH = _PATHS["numeric_store"]
+MANIFEST_PATH = os.path.join(CHROMA_DB_PATH, MANIFEST_FILENAME)
+
+# Results keyed by (date range, spec); invalidated when ingestion writes into the range
+RESULT_CACHE = ResultCache()
+_CLIENT = None # Chroma client shared with the host process, see configure
 
 # --- Type definitions for clarity ---
 Metric = Literal['active_power_w', 'total_power_import_kwh', 'total_power_export_kwh']
@@ -21,109 +38,473 @@ TIME_OF_DAY_MAPPING: Dict[TimeOfDay, tuple[time, time]] = {
     'avond': (time(18, 0), time(23, 59, 59)),
 }
 
+# Metric -> metadata key of the raw readings indexed by main.py
+CHROMA_METRIC_KEYS = {
+    'active_power_w': 'active_power_w',
+    'total_power_import_kwh': 'power_import_kwh',
+    'total_power_export_kwh': 'power_export_kwh',
+}
+
+# value_type -> power_sign metadata written at ingest (1 consumption, -1 production)
+VALUE_TYPE_POWER_SIGN = {'CONSUMPTION': 1, 'PRODUCTION': -1}
+
+CHUNK_SIZE = 50000 # readings folded into the aggregate state at a time
+LOCAL_TZ = 'Europe/Amsterdam'
+
+class AggregateState:
+    """
+    Mergeable partial aggregate over (epoch, value) readings.
+
+    Each chunk of readings is folded into a state with `update`; states built over
+    different chunks, time partitions or shards combine exactly with `merge`, so
+    results over any range need only constant memory.
+    """
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = self.max = None
+        self.min_epoch = self.max_epoch = None
+        self.first = self.last = None
+        self.first_epoch = self.last_epoch = None
+
+    def update(self, epochs, values):
+        """Folds one chunk of readings (NumPy arrays of equal length) into the state."""
+        if not len(values):
+            return self
+        chunk = AggregateState()
+        chunk.count = len(values)
+        chunk.sum = float(values.sum())
+        i_min, i_max = int(values.argmin()), int(values.argmax())
+        chunk.min, chunk.min_epoch = float(values[i_min]), int(epochs[i_min])
+        chunk.max, chunk.max_epoch = float(values[i_max]), int(epochs[i_max])
+        i_first, i_last = int(epochs.argmin()), int(epochs.argmax())
+        chunk.first, chunk.first_epoch = float(values[i_first]), int(epochs[i_first])
+        chunk.last, chunk.last_epoch = float(values[i_last]), int(epochs[i_last])
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """Combines another state into this one; ties keep the earliest reading."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.__dict__.update(other.__dict__)
+            return self
+        self.count += other.count
+        self.sum += other.sum
+        if other.min < self.min or (other.min == self.min and other.min_epoch < self.min_epoch):
+            self.min, self.min_epoch = other.min, other.min_epoch
+        if other.max > self.max or (other.max == self.max and other.max_epoch < self.max_epoch):
+            self.max, self.max_epoch = other.max, other.max_epoch
+        if other.first_epoch < self.first_epoch:
+            self.first, self.first_epoch = other.first, other.first_epoch
+        if other.last_epoch > self.last_epoch:
+            self.last, self.last_epoch = other.last, other.last_epoch
+        return self
+
+    def result(self, aggregation: Aggregation) -> Dict[str, Any]:
+        """Returns {'value': ...} (plus 'timestamp' for MAX/MIN) for the aggregation."""
+        if aggregation == 'DELTA':
+            return {"value": self.last - self.first}
+        if aggregation == 'SUM':
+            return {"value": self.sum}
+        if aggregation == 'AVG':
+            return {"value": self.sum / self.count}
+        if aggregation == 'MAX':
+            return {"value": self.max, "timestamp": _local_isoformat(self.max_epoch)}
+        if aggregation == 'MIN':
+            return {"value": self.min, "timestamp": _local_isoformat(self.min_epoch)}
+        raise ValueError(f"Invalid aggregation type: {aggregation}")
+
+def configure(chroma_path: str, numeric_store_path: str, client=None):
+    """
+    Points the aggregator at another data root: the Chroma directory (with its ingest
+    manifest) and the numeric store. An already open PersistentClient on `chroma_path`
+    is reused instead of opening a second one (see query_server.QueryService).
+    """
+    global CHROMA_DB_PATH, NUMERIC_STORE_PATH, MANIFEST_PATH, _CLIENT
+    CHROMA_DB_PATH = chroma_path
+    NUMERIC_STORE_PATH = numeric_store_path
+    MANIFEST_PATH = os.path.join(chroma_path, MANIFEST_FILENAME)
+    _CLIENT = client
+    get_collection.cache_clear()
+
+@lru_cache(maxsize=None)
+def get_collection():
+    """Opens the Chroma client and collection once per process and reuses them for every call."""
+    client = _CLIENT or chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    return client.get_collection(name=COLLECTION_NAME)
+
+def _local_isoformat(epoch: int) -> str:
+    return pd.Timestamp(epoch, unit='s', tz='UTC').tz_convert(LOCAL_TZ).isoformat()
+
+def _range_where(start_epoch: int, end_epoch: int, pushdown: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    conditions = [{"epoch": {"$gte": start_epoch}}, {"epoch": {"$lte": end_epoch}}]
+    conditions.extend({key: {"$eq": value}} for key, value in (pushdown or {}).items())
+    return {"$and": conditions}
+
+def _iter_reading_chunks(metrics: List[Metric], start_epoch: int, end_epoch: int, chunk_size: int = CHUNK_SIZE,
+                         pushdown: Optional[Dict[str, Any]] = None, store_path: Optional[str] = None):
+    """
+    Yields (epochs, {metric: values}) NumPy chunks covering every reading in the range,
+    reading all requested metrics in the same pass. The columnar store answers with a
+    binary search and memmap slices; Chroma is only paged through for the part of the
+    range before the store's oldest reading, i.e. data indexed before the store existed
+    (see compaction.first_epoch). `pushdown` holds extra equality filters on the
+    derived metadata (time_of_day, power_sign) that Chroma applies before returning rows.
+    A `store_path` reads one shard's store (see shards.py); shards never fall back to Chroma.
+    """
+    shard = store_path is not None
+    store_path = store_path or NUMERIC_STORE_PATH
+    covered_from = compaction.first_epoch(store_path) if compaction.has_data(store_path) else None
+    if not shard and (covered_from is None or start_epoch < covered_from):
+        chroma_end = end_epoch if covered_from is None else min(end_epoch, covered_from - 1)
+        yield from _iter_chroma_chunks(metrics, start_epoch, chroma_end, chunk_size, pushdown, required=covered_from is None)
+    if covered_from is None or covered_from > end_epoch:
+        return
+    # Older readings may have been compacted into summary tiers; see _merge_summary_states
+    raw_from, _ = compaction.coverage(store_path)
+    store = NumericStore(store_path)
+    for part in store.iter_range(max(start_epoch, raw_from or start_epoch), end_epoch, metrics):
+        for i in range(0, len(part["epoch"]), chunk_size):
+            with timer("query_stage", stage="read", source="numeric_store"):
+                epochs = np.asarray(part["epoch"][i:i + chunk_size])
+                values = {metric: np.asarray(part[metric][i:i + chunk_size], dtype=np.float64) for metric in metrics}
+            yield epochs, values
+
+def _iter_chroma_chunks(metrics: List[Metric], start_epoch: int, end_epoch: int, chunk_size: int = CHUNK_SIZE,
+                        pushdown: Optional[Dict[str, Any]] = None, required: bool = True):
+    """Pages the per-reading documents in the range out of Chroma as (epochs, {metric: values}) chunks."""
+    try:
+        collection = get_collection()
+    except Exception:
+        if required:
+            raise
+        return # only the numeric store was kept (or copied); it is all there is
+    offset = 0
+    while True:
+        with timer("chroma", op="get"):
+            results = collection.get(
+                where=_range_where(start_epoch, end_epoch, pushdown),
+                include=["metadatas"],
+                limit=chunk_size,
+                offset=offset
+            )
+        if results['metadatas']:
+            with timer("query_stage", stage="dataframe_build", source="chroma"):
+                df = pd.DataFrame(results['metadatas'])
+                epochs = df['epoch'].to_numpy(dtype=np.int64)
+                values = {
+                    metric: (pd.to_numeric(df[key], errors='coerce') if key in df else pd.Series(np.nan, index=df.index)).to_numpy(dtype=np.float64)
+                    for metric, key in ((metric, CHROMA_METRIC_KEYS[metric]) for metric in metrics)
+                }
+            yield epochs, values
+        if len(results['ids']) < chunk_size:
+            break
+        offset += chunk_size
+
+# Readings are grouped per (time-of-day bucket, sign) so every spec can be answered by merging groups
+TIME_OF_DAY_BUCKETS: List[TimeOfDay] = sorted(TIME_OF_DAY_MAPPING, key=lambda name: TIME_OF_DAY_MAPPING[name][0])
+SIGNS = {'positive': 0, 'negative': 1, 'zero': 2}
+VALUE_TYPE_SIGNS = {'ALL': (0, 1, 2), 'CONSUMPTION': (0,), 'PRODUCTION': (1,)}
+
+def _time_of_day_buckets(epochs) -> np.ndarray:
+    """Index into TIME_OF_DAY_BUCKETS for every epoch, based on Europe/Amsterdam wall-clock time."""
+    local = pd.to_datetime(epochs, unit='s', utc=True).tz_convert(LOCAL_TZ)
+    seconds = np.asarray(local.hour * 3600 + local.minute * 60 + local.second)
+    bucket_starts = [start.hour * 3600 + start.minute * 60 + start.second
+                     for start, _ in (TIME_OF_DAY_MAPPING[name] for name in TIME_OF_DAY_BUCKETS)]
+    return np.searchsorted(bucket_starts, seconds, side='right') - 1
+
+def _grouped_states(epochs, values, groups) -> Dict[int, AggregateState]:
+    """Builds one AggregateState per group label with a single pandas groupby."""
+    df = pd.DataFrame({"epoch": epochs, "value": values, "group": groups})
+    grouped = df.groupby("group", sort=False)
+    stats = grouped["value"].agg(["count", "sum", "min", "max", "idxmin", "idxmax"])
+    first_last = grouped["epoch"].agg(["idxmin", "idxmax"])
+
+    states = {}
+    for group, row in stats.iterrows():
+        state = AggregateState()
+        state.count, state.sum = int(row["count"]), float(row["sum"])
+        state.min, state.min_epoch = float(row["min"]), int(epochs[int(row["idxmin"])])
+        state.max, state.max_epoch = float(row["max"]), int(epochs[int(row["idxmax"])])
+        i_first, i_last = int(first_last.at[group, "idxmin"]), int(first_last.at[group, "idxmax"])
+        state.first, state.first_epoch = float(values[i_first]), int(epochs[i_first])
+        state.last, state.last_epoch = float(values[i_last]), int(epochs[i_last])
+        states[int(group)] = state
+    return states
+
+def _pushdown_filters(specs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Filters every spec agrees on and that can therefore run inside Chroma: a shared
+    time_of_day, and a shared consumption/production filter when only
+    active_power_w is asked for. Readings are still filtered afterwards, so this only
+    reduces the rows that cross into Python.
+    """
+    pushdown = {}
+    times = {spec["time_of_day"] for spec in specs}
+    if len(times) == 1 and None not in times:
+        pushdown["time_of_day"] = times.pop()
+    if specs and all(spec["metric"] == 'active_power_w' for spec in specs):
+        signs = {VALUE_TYPE_POWER_SIGN.get(spec["value_type"]) for spec in specs}
+        if len(signs) == 1 and None not in signs:
+            pushdown["power_sign"] = signs.pop()
+    return pushdown
+
+def _range_has_readings(start_epoch: int, end_epoch: int, pushdown: Optional[Dict[str, Any]] = None) -> bool:
+    return bool(get_collection().get(where=_range_where(start_epoch, end_epoch, pushdown), include=[], limit=1)['ids'])
+
+def _merge_summary_states(states: Dict[tuple, AggregateState], rows_total: Dict[str, int],
+                          metrics: List[Metric], start_epoch: int, end_epoch: int, store_path: Optional[str] = None) -> None:
+    """
+    Adds the compacted summary tiers (see compaction.py) to the per-(metric, group)
+    states. Every summary row is the exact state of one period and sign, and periods
+    never straddle a time-of-day bucket, so results match the raw readings.
+    """
+    with timer("query_stage", stage="read", source="summaries"):
+        df = compaction.read_summaries(store_path or NUMERIC_STORE_PATH, start_epoch, end_epoch, metrics)
+    if df.empty:
+        return
+    with timer("query_stage", stage="aggregate"):
+        df = df.assign(group=_time_of_day_buckets(df["epoch"].to_numpy()) * len(SIGNS) + df["sign"].to_numpy())
+        merged = compaction.merge_summaries(df, ["metric", "group"])
+        for row in merged.itertuples(index=False):
+            metric = compaction.SUMMARY_METRICS[row.metric]
+            state = AggregateState()
+            state.count, state.sum = int(row.count), float(row.sum)
+            state.min, state.min_epoch = float(row.min), int(row.min_epoch)
+            state.max, state.max_epoch = float(row.max), int(row.max_epoch)
+            state.first, state.first_epoch = float(row.first), int(row.first_epoch)
+            state.last, state.last_epoch = float(row.last), int(row.last_epoch)
+            states.setdefault((metric, int(row.group)), AggregateState()).merge(state)
+            rows_total[metric] += state.count
+
+def _scan_states(metrics: List[Metric], start_epoch: int, end_epoch: int, needs_buckets: bool,
+                 pushdown: Optional[Dict[str, Any]] = None, store_path: Optional[str] = None) -> tuple:
+    """
+    One pass over the readings (and summaries) of one store. Returns the
+    (metric, group) -> AggregateState map, group = bucket * 3 + sign, and the rows per metric.
+    """
+    states: Dict[tuple, AggregateState] = {}
+    rows_total = dict.fromkeys(metrics, 0)
+    for epochs, chunk in _iter_reading_chunks(metrics, start_epoch, end_epoch, pushdown=pushdown, store_path=store_path):
+        count("query_rows_scanned", len(epochs))
+        with timer("query_stage", stage="filter"):
+            buckets = _time_of_day_buckets(epochs) if needs_buckets else np.zeros(len(epochs), dtype=np.int64)
+        for metric, values in chunk.items():
+            rows_total[metric] += len(values)
+            with timer("query_stage", stage="filter"):
+                valid = ~np.isnan(values)
+                signs = np.where(values > 0, SIGNS['positive'], np.where(values < 0, SIGNS['negative'], SIGNS['zero']))
+                groups = buckets * len(SIGNS) + signs
+            with timer("query_stage", stage="aggregate"):
+                for group, state in _grouped_states(epochs[valid], values[valid], groups[valid]).items():
+                    states.setdefault((metric, group), AggregateState()).merge(state)
+    _merge_summary_states(states, rows_total, metrics, start_epoch, end_epoch, store_path)
+    return states, rows_total
+
+def _scan_shards(metrics: List[Metric], start_epoch: int, end_epoch: int, needs_buckets: bool, catalog, meters) -> tuple:
+    """
+    Scans every shard of `meters` that overlaps the range in a thread pool (the
+    memmap reads and NumPy folds release the GIL). Shards of one meter are disjoint
+    time partitions, so their states merge exactly; meters are kept apart because a
+    DELTA over several meters is the sum of the per-meter deltas.
+    Returns ({meter: states}, rows per metric).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import shards
+    selected = catalog.shards(meters, start_epoch, end_epoch)
+    by_meter: Dict[str, Dict[tuple, AggregateState]] = {meter: {} for meter in catalog.resolve(meters)}
+    rows_total = dict.fromkeys(metrics, 0)
+    with ThreadPoolExecutor(max_workers=shards.fanout_workers(len(selected))) as pool:
+        futures = [(shard["meter"], pool.submit(_scan_states, metrics, start_epoch, end_epoch, needs_buckets,
+                                                store_path=shard["store"])) for shard in selected]
+        for meter, future in futures:
+            states, rows = future.result()
+            merged = by_meter[meter]
+            for key, state in states.items():
+                merged.setdefault(key, AggregateState()).merge(state)
+            for metric, rows_metric in rows.items():
+                rows_total[metric] += rows_metric
+    count("query_shards_scanned", len(selected))
+    return by_meter, rows_total
+
+def _spec_states(states: Dict[tuple, AggregateState], metric: Metric, time_of_day, value_type) -> tuple:
+    """Merges the groups a spec selects; returns (state in the time window, state after the value-type filter)."""
+    buckets = [TIME_OF_DAY_BUCKETS.index(time_of_day)] if time_of_day else range(len(TIME_OF_DAY_BUCKETS))
+    # Only apply consumption/production filter for active_power_w. For the cumulative
+    # import/export metrics the value type is implied by the metric itself.
+    signs = VALUE_TYPE_SIGNS[value_type] if metric == 'active_power_w' else VALUE_TYPE_SIGNS['ALL']
+
+    in_window = AggregateState()
+    state = AggregateState()
+    for bucket in buckets:
+        for sign in SIGNS.values():
+            group_state = states.get((metric, bucket * len(SIGNS) + sign))
+            if group_state is None:
+                continue
+            in_window.merge(group_state)
+            if sign in signs:
+                state.merge(group_state)
+    return in_window, state
+
+def _validate_spec(spec: Dict[str, Any]) -> Optional[str]:
+    metric, aggregation = spec["metric"], spec["aggregation"]
+    if spec["time_of_day"] and spec["time_of_day"] not in TIME_OF_DAY_MAPPING:
+        return f"Invalid time_of_day: {spec['time_of_day']}"
+    if spec["value_type"] not in ValueType.__args__:
+        return f"Invalid value_type: {spec['value_type']}"
+    if metric not in Metric.__args__:
+        return f"Invalid metric: {metric}"
+    if aggregation == 'DELTA' and not metric.startswith('total'): # For cumulative kWh metrics
+        return "DELTA aggregation is only for cumulative metrics like total_power_import_kwh."
+    if aggregation == 'SUM' and metric != 'active_power_w': # For active_power_w, sum is not meaningful in kWh
+        return "SUM aggregation is only meaningful for active_power_w in this context."
+    if aggregation not in Aggregation.__args__:
+        return f"Invalid aggregation type: {aggregation}"
+    return None
+
+def _date_range_epochs(start_date: str, end_date: str) -> tuple[int, int]:
+    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+    end_dt = datetime.strptime(end_date, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
+    return int(start_dt.timestamp()), int(end_dt.timestamp())
+
+def _normalize_spec(spec) -> Dict[str, Any]:
+    """Accepts a dict or a (metric, aggregation, time_of_day, value_type) tuple."""
+    if not isinstance(spec, dict):
+        spec = dict(zip(("metric", "aggregation", "time_of_day", "value_type"), spec))
+    return {
+        "metric": spec["metric"],
+        "aggregation": spec["aggregation"],
+        "time_of_day": spec.get("time_of_day"),
+        "value_type": spec.get("value_type") or 'ALL',
+    }
+
+def query_aggregator_batch(start_date: str, end_date: str, specs: List[Any], meters=None) -> List[Dict[str, Any]]:
+    """
+    Answers many (metric, aggregation, time_of_day, value_type) specs over one date
+    range with a single scan. Every chunk is converted once; per metric, its readings
+    are grouped by (time-of-day bucket, sign) in one vectorized groupby and the
+    resulting partial states are merged per spec. Results come back in spec order.
+    With `meters` (a list of meter ids, or shards.ALL_METERS) the sharded stores in the
+    shard catalog are scanned in parallel instead, and results cover those meters together.
+    """
+    try:
+        specs = [_normalize_spec(spec) for spec in specs]
+        start_epoch, end_epoch = _date_range_epochs(start_date, end_date)
+    except Exception as e:
+        return [{"error": str(e)} for _ in specs]
+
+    errors = [_validate_spec(spec) for spec in specs]
+
+    # Serve what we can from the result cache; only the remaining specs need the scan
+    if meters is None:
+        ingest = read_ingest_state(MANIFEST_PATH)
+        keys = [cache_key("aggregate", dict(spec, start_date=start_date, end_date=end_date)) for spec in specs]
+    else:
+        import shards
+        catalog = shards.ShardCatalog()
+        try:
+            meters = catalog.resolve(meters)
+        except ValueError as e:
+            return [{"error": str(e)} for _ in specs]
+        ingest = catalog.ingest_state(meters)
+        keys = [cache_key("aggregate", dict(spec, start_date=start_date, end_date=end_date, meters=meters)) for spec in specs]
+    cached = [None if error else RESULT_CACHE.get(key, ingest) for key, error in zip(keys, errors)]
+    pending = [not error and result is None for result, error in zip(cached, errors)]
+    count("result_cache", sum(not error and result is not None for result, error in zip(cached, errors)), outcome="hit", kind="aggregate")
+    count("result_cache", sum(pending), outcome="miss", kind="aggregate")
+    metrics = list(dict.fromkeys(spec["metric"] for spec, todo in zip(specs, pending) if todo))
+    needs_buckets = any(spec["time_of_day"] for spec, todo in zip(specs, pending) if todo)
+
+    # Readings (partly) only in Chroma: push the shared filters down when the documents carry the derived fields
+    pushdown = {}
+    if meters is None and metrics and read_metadata_version(MANIFEST_PATH) >= 2:
+        pushdown = _pushdown_filters([spec for spec, todo in zip(specs, pending) if todo])
+
+    # meter -> (metric, group) -> AggregateState; the unsharded store is the single meter None
+    states_by_meter: Dict[Any, Dict[tuple, AggregateState]] = {None: {}}
+    rows_total = dict.fromkeys(metrics, 0)
+    try:
+        with timer("query", kind="aggregate"):
+            if metrics and meters is None:
+                states_by_meter[None], rows_total = _scan_states(metrics, start_epoch, end_epoch, needs_buckets, pushdown)
+            elif metrics:
+                states_by_meter, rows_total = _scan_shards(metrics, start_epoch, end_epoch, needs_buckets, catalog, meters)
+    except Exception as e:
+        return [{"error": str(e)} for _ in specs]
+
+    results = []
+    for spec, error, key, cached_result in zip(specs, errors, keys, cached):
+        metric, aggregation = spec["metric"], spec["aggregation"]
+        time_of_day, value_type = spec["time_of_day"], spec["value_type"]
+        if error:
+            results.append({"error": error})
+            continue
+        if cached_result is not None:
+            results.append(dict(cached_result))
+            continue
+        if rows_total[metric] == 0:
+            if pushdown and _range_has_readings(start_epoch, end_epoch):
+                # Only the pushed-down filters left nothing; report them like the in-memory filters would
+                if "time_of_day" in pushdown and not _range_has_readings(
+                        start_epoch, end_epoch, {"time_of_day": pushdown["time_of_day"]}):
+                    results.append({"error": f"No data for time_of_day='{time_of_day}' in date range."})
+                else:
+                    results.append({"error": f"No data found for value_type='{value_type}' in the selected period."})
+                continue
+            results.append({"error": "No data found for the specified date range."})
+            continue
+
+        in_window, state = AggregateState(), AggregateState()
+        meter_states = []
+        for states in states_by_meter.values():
+            meter_in_window, meter_state = _spec_states(states, metric, time_of_day, value_type)
+            in_window.merge(meter_in_window)
+            state.merge(meter_state)
+            if meter_state.count:
+                meter_states.append(meter_state)
+
+        if time_of_day and in_window.count == 0:
+            results.append({"error": f"No data for time_of_day='{time_of_day}' in date range."})
+            continue
+        if state.count == 0:
+            results.append({"error": f"No data found for value_type='{value_type}' in the selected period."})
+            continue
+
+        result = {"aggregation_type": aggregation, "metric": metric, "value_type": value_type}
+        if time_of_day:
+            result["time_of_day"] = time_of_day
+        result.update(state.result(aggregation))
+        if aggregation == 'DELTA':
+            # Counters of different meters are unrelated; their usage adds up
+            result["value"] = sum(meter_state.result('DELTA')["value"] for meter_state in meter_states)
+        result["value"] = float(result["value"])
+        if meters is not None:
+            result["meters"] = len(meter_states)
+        RESULT_CACHE.put(key, dict(result), ingest, range_start=start_epoch, range_end=end_epoch)
+        results.append(result)
+    return results
+
 def query_aggregator(
     metric: Metric,
     aggregation: Aggregation,
     start_date: str,
     end_date: str,
     time_of_day: Optional[TimeOfDay] = None,
-    value_type: ValueType = 'ALL'
+    value_type: ValueType = 'ALL',
+    meters=None
 ) -> Dict[str, Any]:
     """
-    Queries ChromaDB, filters data based on value type (consumption/production),
-    and performs a specified aggregation.
+    Streams every reading in the date range in chunks, filters them on time of day
+    and value type (consumption/production), and folds them into mergeable
+    AggregateStates. Results are exact for any range length with constant memory.
+    `meters` fans the query out over the sharded per-meter stores (see shards.py).
     """
-    try:
-        # 1. Connect to ChromaDB and get data
-        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-        collection = client.get_collection(name=COLLECTION_NAME)
-
-        start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-        end_dt = datetime.strptime(end_date, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
-        start_epoch, end_epoch = int(start_dt.timestamp()), int(end_dt.timestamp())
-
-        results = collection.get(
-            where={
-                "$and": [
-                    {"timestamp": {"$gte": start_epoch}},
-                    {"timestamp": {"$lte": end_epoch}}
-            ]
-            },
-            include=["metadatas"],
-            limit=10000
-        )
-
-        if not results or not results['metadatas']:
-            return {"error": "No data found for the specified date range."}
-
-        # 2. Load and prepare DataFrame
-        df = pd.DataFrame(results['metadatas'])
-        if df.empty:
-            return {"error": "No data found for the specified date range."}
-
-        df[metric] = pd.to_numeric(df[metric], errors='coerce')
-        df.dropna(subset=[metric], inplace=True)
-        df['datetime'] = pd.to_datetime(df['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Amsterdam')
-
-        # 3. Apply time_of_day filter
-        if time_of_day:
-            start_time, end_time = TIME_OF_DAY_MAPPING[time_of_day]
-            df = df[df['datetime'].dt.time.between(start_time, end_time)]
-            if df.empty:
-                return {"error": f"No data for time_of_day='{time_of_day}' in date range."}
-
-        # 4. Apply value_type filter (Consumption/Production)
-        if metric == 'active_power_w': # Only apply consumption/production filter for active_power_w
-            if value_type == 'CONSUMPTION':
-                df = df[df[metric] > 0].copy()
-            elif value_type == 'PRODUCTION':
-                df = df[df[metric] < 0].copy()
-        # For total_power_import_kwh and total_power_export_kwh, value_type 'CONSUMPTION' or 'PRODUCTION'
-        # implies using the metric directly, as they are inherently consumption/production.
-        # 'ALL' would also use the metric directly.
-
-        if df.empty:
-            return {"error": f"No data found for value_type='{value_type}' in the selected period."}
-
-        # 5. Perform Aggregation
-        if aggregation == 'DELTA': # For cumulative kWh metrics
-            if not metric.startswith('total'):
-                return {"error": "DELTA aggregation is only for cumulative metrics like total_power_import_kwh."}
-            result_value = df[metric].max() - df[metric].min()
-        
-        elif aggregation == 'SUM': # For active_power_w, sum is not meaningful in kWh
-            if metric != 'active_power_w':
-                 return {"error": "SUM aggregation is only meaningful for active_power_w in this context."}
-            result_value = df[metric].sum()
-
-        elif aggregation == 'AVG':
-            result_value = df[metric].mean()
-        
-        elif aggregation == 'MAX':
-            result_row = df.loc[df[metric].idxmax()]
-            result_value = result_row[metric]
-            return {
-                "aggregation_type": aggregation, "metric": metric, "value_type": value_type,
-                "value": float(result_value), "timestamp": result_row['datetime'].isoformat()
-            }
-        
-        elif aggregation == 'MIN':
-            result_row = df.loc[df[metric].idxmin()]
-            result_value = result_row[metric]
-            return {
-                "aggregation_type": aggregation, "metric": metric, "value_type": value_type,
-                "value": float(result_value), "timestamp": result_row['datetime'].isoformat()
-            }
-        else:
-            return {"error": f"Invalid aggregation type: {aggregation}"}
-
-        return {
-            "aggregation_type": aggregation, "metric": metric, "value_type": value_type,
-            "value": float(result_value)
-        }
-
-    except Exception as e:
-        return {"error": str(e)}
+    spec = {"metric": metric, "aggregation": aggregation, "time_of_day": time_of_day, "value_type": value_type}
+    result = query_aggregator_batch(start_date, end_date, [spec], meters=meters)[0]
+    result.pop("time_of_day", None)
+    return result
 
 def main():
     parser = argparse.ArgumentParser(description="Universal Aggregator for Smart Meter Data.")
@@ -133,10 +514,22 @@ def main():
     parser.add_argument("--end_date", required=True, type=str)
     parser.add_argument("--time_of_day", type=str, choices=list(TimeOfDay.__args__), default=None)
     parser.add_argument("--value_type", type=str, choices=list(ValueType.__args__), default='ALL')
-    
-    args = parser.parse_args()
-    result = query_aggregator(**vars(args))
+    parser.add_argument("--meters", type=str, default=None,
+                        help="Comma-separated meter ids from the shard catalog, or '*' for all meters (see shards.py).")
+    parser.add_argument("--metrics", type=str, default=None, help="Write stage timings to this file (.prom text or .jsonl).")
+    parser.add_argument("--profile", type=str, default=None, help="Write a cProfile dump of the query to this directory.")
+
+    args = vars(parser.parse_args())
+    metrics_path, profile_dir = args.pop("metrics"), args.pop("profile")
+    if args["meters"] and args["meters"] != "*":
+        args["meters"] = args["meters"].split(",")
+    if profile_dir:
+        enable_profiling(profile_dir)
+    with profiled("query_aggregator"):
+        result = query_aggregator(**args)
     print(result)
+    if metrics_path:
+        METRICS.export(metrics_path, command="query_aggregator")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,175 @@
+import os
+import heapq
+import ujson
+from metrics import count, timer
+
+# --- Constants ---
+TOPK_INDEX_DIRNAME = "topk_index"
+SORT_KEYS = ("total_import_kwh", "total_export_kwh", "total_gas_m3")
+ORDERS = ("desc", "asc")
+K_MAX = 100         # longest list kept per sort key and year; larger limits fall back to a scan
+ALL_YEARS = "all"   # scope of the list over every year
+INDEX_VERSION = 2
+PAGE_SIZE = 1000
+
+def index_path(chroma_path, collection_name, level, order="desc"):
+    """Location of the sorted secondary index for one rollup level and direction of a collection."""
+    return os.path.join(chroma_path, TOPK_INDEX_DIRNAME, f"{collection_name}_{level}_{order}.json")
+
+def load_index(path):
+    """
+    Returns the index of one level and direction, or None when absent (or written in
+    an older format). Layout: {"keys": {sort_key: {year or 'all': {"entries": [[value, id],
+    ...] best first, "truncated"}}}, "open": [{"id", "year", "values"}], "periods": {year or 'all': n}}.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        index = ujson.load(f)
+    return index if index.get("version") == INDEX_VERSION else None
+
+def _empty_index(order, k_max):
+    return {"version": INDEX_VERSION, "order": order, "k_max": k_max, "periods": {}, "open": [], "keys": {}}
+
+def _scopes(year):
+    return [ALL_YEARS] if year is None else [ALL_YEARS, str(year)]
+
+def _merge(bounded, entries, order, k_max):
+    """
+    Merges [value, id] entries into a bounded list; an entry already in the list is
+    rescored. Ties keep the entries that were there first. Once entries were cut off,
+    only what ranks at or above the old last entry is certainly in order, so entries
+    rescored below it are left out and the list gets shorter rather than wrong.
+    """
+    descending = order == 'desc'
+    replaced = {record_id for _, record_id in entries}
+    merged = [entry for entry in bounded["entries"] if entry[1] not in replaced] + entries
+    if bounded["truncated"] and bounded["entries"]:
+        bound = bounded["entries"][-1][0]
+        merged = [entry for entry in merged if (entry[0] >= bound if descending else entry[0] <= bound)]
+    merged.sort(key=lambda entry: entry[0], reverse=descending)
+    if len(merged) > k_max:
+        bounded["truncated"] = True
+    bounded["entries"] = merged[:k_max]
+
+def update_index(chroma_path, collection_name, level, ids, metadatas, new_ids=None, k_max=K_MAX):
+    """
+    Merges freshly computed rollup records into the index of both directions.
+    Rollups are recomputed from the latest period on (see smart_database.update_rollups),
+    so the period with the latest start is the one that keeps changing: it is kept
+    apart as 'open' and merged in at lookup time. Every other period goes into the
+    pre-sorted lists, which are capped at `k_max` entries per sort key and year and
+    stay exact for limits up to their length. A closed period that is recomputed
+    (readings backfilled into it) is rescored in place. `new_ids` are the records that
+    did not exist before, for the period counts; None counts every record not seen
+    as open before. Both files are bounded in size and rewritten atomically.
+    """
+    starts = [metadata.get("period_start") for metadata in metadatas]
+    last_start = max((start for start in starts if start is not None), default=None)
+    for order in ORDERS:
+        path = index_path(chroma_path, collection_name, level, order)
+        index = load_index(path) or _empty_index(order, k_max)
+        previous_open = {entry["id"] for entry in index["open"]}
+        # An open period that was not recomputed this time will not change any more
+        final = [entry for entry in index["open"] if entry["id"] not in set(ids)]
+        still_open = []
+        for record_id, metadata, start in zip(ids, metadatas, starts):
+            entry = {"id": record_id, "year": metadata.get("year"),
+                     "values": {key: metadata.get(key, 0) for key in SORT_KEYS}}
+            if record_id in new_ids if new_ids is not None else record_id not in previous_open:
+                for scope in _scopes(entry["year"]):
+                    index["periods"][scope] = index["periods"].get(scope, 0) + 1
+            (still_open if start is not None and start == last_start else final).append(entry)
+
+        for key in SORT_KEYS:
+            lists = index["keys"].setdefault(key, {})
+            by_scope = {}
+            for entry in final:
+                for scope in _scopes(entry["year"]):
+                    by_scope.setdefault(scope, []).append([entry["values"][key], entry["id"]])
+            for scope, entries in by_scope.items():
+                _merge(lists.setdefault(scope, {"entries": [], "truncated": False}), entries, order, index["k_max"])
+        index["open"] = still_open
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            ujson.dump(index, f)
+        os.replace(tmp_path, path)
+
+def rebuild_index(collection, chroma_path, level, page_size=PAGE_SIZE):
+    """Builds the index of `level` from the rollups already in the collection (e.g. after a format change)."""
+    ids, metadatas = [], []
+    offset = 0
+    while True:
+        with timer("chroma", op="get"):
+            page = collection.get(where={"level": level}, include=["metadatas"], limit=page_size, offset=offset)
+        ids.extend(page["ids"])
+        metadatas.extend(page["metadatas"])
+        if len(page["ids"]) < page_size:
+            break
+        offset += page_size
+    if ids:
+        update_index(chroma_path, collection.name, level, ids, metadatas)
+
+def _candidates(index, sort_by, limit, year):
+    lists = index["keys"].get(sort_by)
+    if lists is None:
+        return None
+    bounded = lists.get(ALL_YEARS if year is None else str(year), {"entries": [], "truncated": False})
+    if bounded["truncated"] and limit > len(bounded["entries"]):
+        return None
+    opened = [[entry["values"][sort_by], entry["id"]] for entry in index["open"] if year is None or entry["year"] == year]
+    return bounded["entries"][:limit], opened
+
+def top_ids_from_index(index, sort_by, limit, year=None):
+    """
+    The first `limit` ids in the index's direction: at most `limit` entries of the
+    pre-sorted list plus the open period. None when the index cannot answer exactly
+    (no list for `sort_by`, or `limit` beyond a capped list).
+    """
+    candidates = _candidates(index, sort_by, limit, year)
+    if candidates is None:
+        return None
+    bounded, opened = candidates
+    merged = bounded + opened
+    merged.sort(key=lambda entry: entry[0], reverse=(index["order"] == 'desc'))
+    return [record_id for _, record_id in merged[:limit]]
+
+def index_entries_walked(index, sort_by, limit, year=None):
+    """How many entries top_ids_from_index reads for this request: the cost of the lookup."""
+    candidates = _candidates(index, sort_by, limit, year)
+    return 0 if candidates is None else sum(len(part) for part in candidates)
+
+def scan_top_k(collection, where, sort_by, order, limit, page_size=PAGE_SIZE):
+    """
+    Streams the collection in pages of `page_size` and keeps a bounded heap of the
+    `limit` best items: O(n log k) time, O(k + page_size) memory. Missing values
+    count as 0 and ties keep collection order, like a stable full sort would.
+    """
+    if limit <= 0:
+        return []
+    sign = 1 if order == 'desc' else -1
+    heap = []
+    position = 0
+    offset = 0
+    while True:
+        kwargs = {"include": ["metadatas"], "limit": page_size, "offset": offset}
+        if where:
+            kwargs["where"] = where
+        with timer("chroma", op="get"):
+            page = collection.get(**kwargs)
+        for item_id, metadata in zip(page['ids'], page['metadatas']):
+            entry = (sign * metadata.get(sort_by, 0), -position, item_id, metadata)
+            position += 1
+            if len(heap) < limit:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+        if len(page['ids']) < page_size:
+            break
+        offset += page_size
+
+    count("query_rows_scanned", position, source="rollup_scan")
+    best = sorted(heap, key=lambda entry: entry[:2], reverse=True)
+    return [(item_id, metadata) for _, _, item_id, metadata in best]
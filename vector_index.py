@@ -0,0 +1,184 @@
+import os
+import heapq
+import argparse
+import threading
+import ujson
+import numpy as np
+
+# --- Constants ---
+VECTOR_INDEX_PATH = os.path.join(os.getcwd(), "vector_index")
+DTYPES = ("int8", "float16", "float32")
+BLOCK_SIZE = 65536 # rows scored at a time; bounds the temporary score matrix
+PAGE_SIZE = 5000
+
+class QuantizedIndex:
+    """
+    In-process exact nearest-neighbour index over L2-normalised embeddings.
+
+    Vectors are stored quantized in a memory-mapped matrix: float16, or int8 with one
+    float32 scale per row (4x smaller than float32 for MiniLM's 384 dimensions).
+    Search is brute force over blocks of `block_size` rows, so results are exact up to
+    quantization error and memory stays bounded. Scores are cosine similarities;
+    distances are reported as 1 - similarity, like Chroma's cosine space.
+    Re-adding an id overwrites its row.
+    """
+    def __init__(self, path=VECTOR_INDEX_PATH, dtype="int8"):
+        if dtype not in DTYPES:
+            raise ValueError(f"Invalid dtype: {dtype}")
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.meta_path = os.path.join(path, f"index.{dtype}.json")
+        self.vectors_path = os.path.join(path, f"index.{dtype}.vectors")
+        self.scales_path = os.path.join(path, f"index.{dtype}.scales")
+        self.ids_path = os.path.join(path, f"index.{dtype}.ids")
+        self._lock = threading.Lock()
+        self.dim = None
+        self.ids = []
+        self.rows = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                self.dim = ujson.load(f)["dim"]
+            with open(self.ids_path, 'r', encoding="utf-8") as f:
+                self.ids = f.read().splitlines()
+            # A torn append leaves more ids than vectors; keep the complete rows only
+            self.ids = self.ids[:self._stored_rows()]
+            self.rows = {item_id: row for row, item_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _stored_rows(self):
+        if not os.path.exists(self.vectors_path):
+            return 0
+        rows = os.path.getsize(self.vectors_path) // (self.dim * self.dtype.itemsize)
+        if self.dtype == np.int8:
+            rows = min(rows, os.path.getsize(self.scales_path) // 4)
+        return rows
+
+    def _quantize(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.dtype == np.int8:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(self.dtype), None
+
+    def _matrix(self, mode='r'):
+        rows = len(self.ids)
+        vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode=mode, shape=(rows, self.dim))
+        scales = np.memmap(self.scales_path, dtype=np.float32, mode=mode, shape=(rows,)) if self.dtype == np.int8 else None
+        return vectors, scales
+
+    def add(self, ids, embeddings):
+        """Adds or overwrites vectors by id."""
+        if not len(ids):
+            return
+        quantized, scales = self._quantize(embeddings)
+        with self._lock:
+            if self.dim is None:
+                self.dim = quantized.shape[1]
+                os.makedirs(self.path, exist_ok=True)
+                with open(self.meta_path, 'w') as f:
+                    ujson.dump({"dim": self.dim, "dtype": self.dtype.name}, f)
+            if quantized.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-d vectors, got {quantized.shape[1]}-d")
+
+            # Later duplicates in the same call win, like an upsert
+            last = {item_id: i for i, item_id in enumerate(ids)}
+            existing = [(self.rows[item_id], i) for item_id, i in last.items() if item_id in self.rows]
+            new = [(item_id, i) for item_id, i in last.items() if item_id not in self.rows]
+
+            if existing:
+                vectors, row_scales = self._matrix(mode='r+')
+                rows, sources = map(list, zip(*existing))
+                vectors[rows] = quantized[sources]
+                if row_scales is not None:
+                    row_scales[rows] = scales[sources]
+                vectors.flush()
+                del vectors, row_scales
+
+            if new:
+                sources = [i for _, i in new]
+                # Vectors and scales first, ids last: ids define how many rows are complete
+                with open(self.vectors_path, 'ab') as f:
+                    f.write(quantized[sources].tobytes())
+                if scales is not None:
+                    with open(self.scales_path, 'ab') as f:
+                        f.write(scales[sources].tobytes())
+                with open(self.ids_path, 'a', encoding="utf-8") as f:
+                    f.write("".join(f"{item_id}\n" for item_id, _ in new))
+                for item_id, _ in new:
+                    self.rows[item_id] = len(self.ids)
+                    self.ids.append(item_id)
+
+    def search(self, query_embeddings, k=10, block_size=BLOCK_SIZE, rows=None):
+        """
+        Returns (ids, distances) per query, best first. `block_size=None` scores the
+        whole matrix at once; `rows` optionally restricts the search to those row numbers.
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        if not self.ids:
+            return [[] for _ in queries], [[] for _ in queries]
+        vectors, scales = self._matrix()
+        candidates = np.arange(len(self.ids)) if rows is None else np.asarray(rows, dtype=np.int64)
+        block_size = block_size or len(candidates)
+        k = min(k, len(candidates))
+
+        best = [[] for _ in queries] # per query: min-heap of (score, row)
+        for start in range(0, len(candidates), block_size):
+            block_rows = candidates[start:start + block_size]
+            block = vectors[block_rows] if rows is not None else vectors[start:start + block_size]
+            scores = queries @ block.astype(np.float32).T
+            if scales is not None:
+                scores *= (scales[block_rows] if rows is not None else scales[start:start + block_size])[None, :]
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < len(block_rows) else np.tile(np.arange(len(block_rows)), (len(queries), 1))
+            for q, columns in enumerate(top):
+                heap = best[q]
+                for column in columns:
+                    entry = (float(scores[q, column]), int(block_rows[column]))
+                    if len(heap) < k:
+                        heapq.heappush(heap, entry)
+                    elif entry > heap[0]:
+                        heapq.heapreplace(heap, entry)
+
+        ids, distances = [], []
+        for heap in best:
+            ranked = sorted(heap, reverse=True)
+            ids.append([self.ids[row] for _, row in ranked])
+            distances.append([1.0 - score for score, _ in ranked])
+        return ids, distances
+
+    def nbytes(self):
+        """Bytes on disk for vectors and scales."""
+        total = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        if self.dtype == np.int8 and os.path.exists(self.scales_path):
+            total += os.path.getsize(self.scales_path)
+        return total
+
+def build_from_collection(collection, index, page_size=PAGE_SIZE):
+    """Copies every embedding of a Chroma collection into `index`, paging through the collection."""
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings"], limit=page_size, offset=offset)
+        if len(page["ids"]):
+            index.add(page["ids"], page["embeddings"])
+        if len(page["ids"]) < page_size:
+            break
+        offset += page_size
+    return len(index)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the quantized in-process vector index from the ChromaDB collection.")
+    parser.add_argument("--dtype", choices=DTYPES, default="int8")
+    parser.add_argument("--path", type=str, default=VECTOR_INDEX_PATH)
+    args = parser.parse_args()
+
+    import chromadb
+    import main
+    collection = chromadb.PersistentClient(path=main.CHROMA_DB_PATH).get_collection(name=main.COLLECTION_NAME)
+    index = QuantizedIndex(args.path, dtype=args.dtype)
+    count = build_from_collection(collection, index)
+    print(f"{count} vectors in the {args.dtype} index at {args.path} ({index.nbytes() / 1e6:.1f} MB).")
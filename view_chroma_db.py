@@ -5,7 +5,7 @@ import argparse
 
 # --- Constants ---
 CHROMA_DB_PATH = os.path.join(os.getcwd(), "chroma_db")
-COLLECTION_NAME = "smartmeter_master"
+COLLECTION_NAME = "smartmeter_data"
 
 def view_database(limit: int, offset: int):
     """Initializes ChromaDB client, retrieves a page of results, and prints it."""